@@ -0,0 +1,425 @@
+# analytics.py
+
+"""
+回测结果的向量化绩效分析。
+
+输入可以是：
+    - BARSLAST() / run_vector_backtest() 返回的 DataFrame（datetime, price, balance, position, barslast, trade）；
+    - 权益数组：一维（单次回测）或二维（回测次数 × K线数，例如参数扫描的一批结果）；
+    - api.get_trade_records() 的成交记录（ReplayApi 的 dict 列表，或 TqSdk 的成交对象）。
+
+权益类指标（equity_metrics）：总收益率、年化收益率、年化波动率、夏普、索提诺、卡玛、
+最大回撤及最长回撤持续K线数；持仓类指标（position_metrics）：交易次数、胜率、盈亏比、
+平均 / 最长持仓K线数。二维输入时全部指标按行一次算出，没有按回测次数的 Python 循环，
+长度不同的回测可以在行尾用 NaN 补齐。
+
+    metrics = analyze_result(BARSLAST(...), initial_capital=1_000_000)
+    batch = equity_metrics(balances, initial_capital=1_000_000)   # balances.shape == (runs, bars)
+    trades = analyze_trades(api.get_trade_records(), volume_multiple=10)
+"""
+
+import numpy as np
+import pandas as pd
+
+PERIODS_PER_YEAR = 252  # 日线；分钟线等其它周期需要传入对应的年化系数
+
+EQUITY_METRICS = ['total_return', 'annual_return', 'volatility', 'sharpe', 'sortino', 'calmar',
+                  'max_drawdown', 'max_drawdown_duration']
+POSITION_METRICS = ['trade_count', 'win_rate', 'profit_factor', 'avg_trade_pnl', 'avg_holding_bars',
+                    'max_holding_bars']
+
+
+def _as_2d(values) -> tuple:
+    """返回 (二维 float64 数组, 输入是否为一维)。"""
+    arr = np.asarray(values, dtype=np.float64)
+    if arr.ndim == 1:
+        return arr[np.newaxis, :], True
+    if arr.ndim != 2:
+        raise ValueError(f"只支持一维或二维输入，实际为 {arr.ndim} 维")
+    return arr, False
+
+
+def _squeeze(result: dict, single: bool) -> dict:
+    if single:
+        return {k: v[0].item() for k, v in result.items()}
+    return result
+
+
+def _last_valid(arr: np.ndarray) -> np.ndarray:
+    """每行最后一个非 NaN 的值（整行都是 NaN 时为 NaN）。"""
+    valid = ~np.isnan(arr)
+    idx = arr.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    return arr[np.arange(len(arr)), idx]
+
+
+def drawdown(balance, initial_capital: float = None) -> tuple:
+    """
+    回撤序列及回撤持续K线数。
+
+    Args:
+        balance: 权益，一维或二维（按行）。
+        initial_capital (float): 初始本金，给出时作为第一根K线之前的高点。
+
+    Returns:
+        tuple: (drawdown, duration)，形状与 balance 相同：
+            drawdown：相对历史最高权益的回撤比例（>= 0）；
+            duration：距离上一次创新高的K线数，处于新高时为 0。
+    """
+    b, single = _as_2d(balance)
+    peak = np.fmax.accumulate(b, axis=1)  # fmax 跳过 NaN
+    if initial_capital is not None:
+        peak = np.fmax(peak, initial_capital)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dd = 1 - b / peak
+    underwater = dd > 0
+    cols = np.arange(b.shape[1])
+    # 上一次处于新高的位置；初始本金视为位于 -1
+    at_peak = np.where(underwater, -1, cols)
+    if initial_capital is None:
+        at_peak[:, 0] = 0
+    last_peak = np.maximum.accumulate(at_peak, axis=1)
+    duration = np.where(underwater, cols - last_peak, 0)
+    if single:
+        return dd[0], duration[0]
+    return dd, duration
+
+
+def equity_metrics(balance, initial_capital: float = None, periods_per_year: float = PERIODS_PER_YEAR,
+                   risk_free: float = 0.0) -> dict:
+    """
+    由权益曲线计算收益与风险指标。
+
+    Args:
+        balance: 每根K线收盘时的权益，一维（单次回测）或二维（回测次数 × K线数，行尾可用 NaN 补齐）。
+        initial_capital (float): 初始本金；为 None 时以第一根K线的权益为起点。
+        periods_per_year (float): 每年的K线数，用于年化。
+        risk_free (float): 年化无风险利率。
+
+    Returns:
+        dict: 键见 EQUITY_METRICS。一维输入时值为标量，二维输入时为按行的数组。
+            sharpe / sortino：按K线收益率计算并年化（样本标准差）；
+            calmar：年化收益率 / 最大回撤；
+            max_drawdown_duration：最长回撤持续的K线数。
+    """
+    b, single = _as_2d(balance)
+    if initial_capital is not None:
+        b = np.hstack([np.full((len(b), 1), float(initial_capital)), b])
+    runs = len(b)
+    if b.shape[1] < 2:
+        nan = np.full(runs, np.nan)
+        zero = np.zeros(runs)
+        return _squeeze({'total_return': zero, 'annual_return': zero, 'volatility': nan, 'sharpe': nan,
+                         'sortino': nan, 'calmar': nan, 'max_drawdown': zero,
+                         'max_drawdown_duration': zero.astype(np.int64)}, single)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = b[:, 1:] / b[:, :-1] - 1
+        valid = ~np.isnan(returns)
+        n = valid.sum(axis=1)
+        r = np.where(valid, returns, 0.0)
+        mean = r.sum(axis=1) / n
+        var = np.where(valid, (returns - mean[:, None]) ** 2, 0.0).sum(axis=1) / (n - 1)
+        std = np.sqrt(var)
+        downside = np.sqrt((np.minimum(r, 0.0) ** 2).sum(axis=1) / n)
+        excess = mean - risk_free / periods_per_year
+        scale = np.sqrt(periods_per_year)
+
+        total_return = _last_valid(b) / b[:, 0] - 1
+        annual_return = np.power(1 + total_return, periods_per_year / n) - 1
+        sharpe = np.where(std > 0, excess / std * scale, np.nan)
+        sortino = np.where(downside > 0, excess / downside * scale, np.nan)
+
+        dd, duration = drawdown(b)
+        max_drawdown = np.nanmax(np.where(np.isnan(dd), 0.0, dd), axis=1)
+        calmar = np.where(max_drawdown > 0, annual_return / max_drawdown, np.nan)
+
+    return _squeeze({
+        'total_return': total_return,
+        'annual_return': annual_return,
+        'volatility': std * scale,
+        'sharpe': sharpe,
+        'sortino': sortino,
+        'calmar': calmar,
+        'max_drawdown': max_drawdown,
+        'max_drawdown_duration': duration.max(axis=1),
+    }, single)
+
+
+def position_metrics(holding, balance, initial_capital: float = None) -> dict:
+    """
+    按持仓分段统计交易：持仓不为 0 且保持不变的一段连续K线视为一笔交易，
+    盈亏为该段最后一根K线的权益减去进入该段前一根K线的权益（最后未平仓的一段按收盘权益计）。
+
+    Args:
+        holding: 每根K线的实际持仓（手），一维或二维，形状与 balance 相同。
+        balance: 每根K线收盘时的权益。
+        initial_capital (float): 初始本金，用于第一根K线就持仓的情况；为 None 时用第一根K线的权益。
+
+    Returns:
+        dict: 键见 POSITION_METRICS。一维输入时值为标量，二维输入时为按行的数组。
+    """
+    h, single = _as_2d(holding)
+    b, _ = _as_2d(balance)
+    if h.shape != b.shape:
+        raise ValueError(f"持仓形状 {h.shape} 与权益形状 {b.shape} 不一致")
+    runs, bars = h.shape
+    h = np.nan_to_num(h)
+
+    # 每段的起点：行首或持仓发生变化的K线
+    change = np.ones_like(h, dtype=bool)
+    change[:, 1:] = h[:, 1:] != h[:, :-1]
+    starts = np.flatnonzero(change.ravel())
+    ends = np.r_[starts[1:], h.size] - 1
+    # 段不能跨行：行首必然是新段的起点，因此上一段的终点不会越过行尾
+    flat_h, flat_b = h.ravel(), b.ravel()
+    keep = flat_h[starts] != 0
+    starts, ends = starts[keep], ends[keep]
+    row = starts // bars
+
+    before = flat_b[np.maximum(starts - 1, 0)]
+    first_col = starts % bars == 0
+    if initial_capital is not None:
+        before = np.where(first_col, initial_capital, before)
+    else:
+        before = np.where(first_col, b[row, 0], before)
+    pnl = flat_b[ends] - before
+    length = ends - starts + 1
+
+    count = np.bincount(row, minlength=runs)
+    wins = np.bincount(row, weights=pnl > 0, minlength=runs)
+    gains = np.bincount(row, weights=np.maximum(pnl, 0), minlength=runs)
+    losses = np.bincount(row, weights=np.maximum(-pnl, 0), minlength=runs)
+    total_pnl = np.bincount(row, weights=pnl, minlength=runs)
+    total_length = np.bincount(row, weights=length, minlength=runs)
+    max_length = np.zeros(runs, dtype=np.int64)
+    np.maximum.at(max_length, row, length)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = {
+            'trade_count': count,
+            'win_rate': np.where(count > 0, wins / count, np.nan),
+            'profit_factor': np.where(losses > 0, gains / losses, np.where(gains > 0, np.inf, np.nan)),
+            'avg_trade_pnl': np.where(count > 0, total_pnl / count, np.nan),
+            'avg_holding_bars': np.where(count > 0, total_length / count, np.nan),
+            'max_holding_bars': max_length,
+        }
+    return _squeeze(result, single)
+
+
+def holding_from_result(result: pd.DataFrame) -> np.ndarray:
+    """
+    由 BARSLAST() 结果的 trade 列（"开多 N 手" / "开空 N 手"）还原每根K线的实际持仓：
+    信号K线设置的目标持仓在下一根K线开盘成交。
+    """
+    if 'holding' in result.columns:
+        return result['holding'].to_numpy(dtype=np.float64)
+    parsed = result['trade'].astype('string').str.extract(r'(开多|开空)\s*(\d+)')
+    target = parsed[1].astype('float64')
+    target = target.where(parsed[0] == '开多', -target)
+    return target.shift(1).ffill().fillna(0).to_numpy(dtype=np.float64)
+
+
+def analyze_result(result: pd.DataFrame, initial_capital: float = None,
+                   periods_per_year: float = PERIODS_PER_YEAR, risk_free: float = 0.0) -> dict:
+    """
+    分析 BARSLAST() / run_vector_backtest() 的结果，返回权益类和持仓类指标（标量）。
+
+    Args:
+        result (pd.DataFrame): 至少包含 balance 和 trade 列（或 holding 列）。
+        initial_capital (float): 初始本金；为 None 时以第一根K线的权益为起点。
+        periods_per_year (float): 每年的K线数。
+        risk_free (float): 年化无风险利率。
+    """
+    balance = result['balance'].to_numpy(dtype=np.float64)
+    metrics = equity_metrics(balance, initial_capital, periods_per_year, risk_free)
+    metrics.update(position_metrics(holding_from_result(result), balance, initial_capital))
+    return metrics
+
+
+def trades_to_frame(trades) -> pd.DataFrame:
+    """
+    把成交记录整理为 DataFrame（datetime, symbol, volume, price），volume 买入为正、卖出为负。
+
+    支持 ReplayApi.get_trade_records() 的 dict 列表（datetime, symbol, volume, price），
+    以及 TqSdk 的成交对象 / dict（direction, volume, price, trade_date_time, exchange_id, instrument_id），
+    也可以传入 {成交编号: 成交} 的字典。
+    """
+    if isinstance(trades, dict):
+        trades = list(trades.values())
+    rows = []
+    for t in trades:
+        get = t.get if isinstance(t, dict) else lambda k, default=None: getattr(t, k, default)
+        if get('direction') is not None:
+            sign = 1 if get('direction') == 'BUY' else -1
+            symbol = get('symbol') or f"{get('exchange_id')}.{get('instrument_id')}"
+            rows.append((pd.Timestamp(get('trade_date_time'), unit='ns'), symbol,
+                         sign * int(get('volume')), float(get('price'))))
+        else:
+            rows.append((pd.Timestamp(get('datetime')), get('symbol'), int(get('volume')), float(get('price'))))
+    df = pd.DataFrame(rows, columns=['datetime', 'symbol', 'volume', 'price'])
+    return df.sort_values(['symbol', 'datetime'], kind='stable', ignore_index=True)
+
+
+def round_trips(trades, volume_multiple: float = 1) -> pd.DataFrame:
+    """
+    由成交记录计算回合交易（从空仓开仓到回到空仓为一个回合；反手成交拆成平仓和开仓两部分）。
+
+    Args:
+        trades: 成交记录，格式见 trades_to_frame。
+        volume_multiple (float or dict): 合约乘数，可按合约指定。
+
+    Returns:
+        pd.DataFrame: 每个已完成的回合一行：symbol, entry_time, exit_time, direction (1 多 / -1 空),
+            max_volume, pnl, holding_time。未平仓的部分不计入。
+    """
+    columns = ['symbol', 'entry_time', 'exit_time', 'direction', 'max_volume', 'pnl', 'holding_time']
+    df = trades_to_frame(trades)
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    symbol = df['symbol'].to_numpy()
+    volume = df['volume'].to_numpy(dtype=np.int64)
+    new_symbol = np.r_[True, symbol[1:] != symbol[:-1]]
+    # 按合约分组的累计持仓：整体累加后减去每个合约起点之前的累计值
+    cum = np.cumsum(volume)
+    group_start = np.maximum.accumulate(np.where(new_symbol, np.arange(len(df)), 0))
+    base = np.r_[0, cum[:-1]][group_start]
+    after = cum - base
+    before = after - volume
+
+    # 反手：成交前后持仓符号相反，拆成平掉 before 和开出 after 两笔
+    flip = (before != 0) & (after != 0) & (np.sign(before) != np.sign(after))
+    index = np.repeat(np.arange(len(df)), np.where(flip, 2, 1))
+    second = np.r_[False, index[1:] == index[:-1]]
+    leg_volume = np.where(flip[index], np.where(second, after[index], -before[index]), volume[index])
+    leg_after = np.where(flip[index] & ~second, 0, after[index])
+    leg_before = leg_after - leg_volume
+
+    if isinstance(volume_multiple, dict):
+        mult = df['symbol'].map(volume_multiple).fillna(1).to_numpy(dtype=np.float64)[index]
+    else:
+        mult = np.full(len(index), float(volume_multiple))
+    cash = -leg_volume * df['price'].to_numpy(dtype=np.float64)[index] * mult
+
+    # 每个回合以一笔从空仓开出的成交开始
+    opens = leg_before == 0
+    trip = np.cumsum(opens) - 1
+    closed = leg_after == 0
+    valid = trip >= 0
+    trip, cash, closed, index = trip[valid], cash[valid], closed[valid], index[valid]
+    n_trips = trip.max() + 1 if len(trip) else 0
+    pnl = np.bincount(trip, weights=cash, minlength=n_trips)
+    done = np.zeros(n_trips, dtype=bool)
+    done[trip[closed]] = True
+    first = np.searchsorted(trip, np.arange(n_trips), side='left')
+    last = np.searchsorted(trip, np.arange(n_trips), side='right') - 1
+    size = np.zeros(n_trips, dtype=np.int64)
+    np.maximum.at(size, trip, np.abs(leg_after[valid]))
+
+    times = df['datetime'].to_numpy()
+    entry, exit_ = index[first], index[last]
+    result = pd.DataFrame({
+        'symbol': symbol[entry],
+        'entry_time': times[entry],
+        'exit_time': times[exit_],
+        'direction': np.sign(leg_after[valid][first]).astype(np.int64),
+        'max_volume': size,
+        'pnl': pnl,
+        'holding_time': times[exit_] - times[entry],
+    })
+    return result[done].reset_index(drop=True)
+
+
+def analyze_trades(trades, volume_multiple: float = 1) -> dict:
+    """成交记录的回合统计：交易次数、胜率、盈亏比、平均盈亏、平均 / 最长持仓时间。"""
+    trips = round_trips(trades, volume_multiple)
+    pnl = trips['pnl'].to_numpy(dtype=np.float64)
+    gains, losses = pnl[pnl > 0].sum(), -pnl[pnl < 0].sum()
+    count = len(trips)
+    return {
+        'trade_count': count,
+        'win_rate': float(np.mean(pnl > 0)) if count else float('nan'),
+        'profit_factor': float(gains / losses) if losses > 0 else (float('inf') if gains > 0 else float('nan')),
+        'total_pnl': float(pnl.sum()),
+        'avg_trade_pnl': float(pnl.mean()) if count else float('nan'),
+        'avg_holding_time': trips['holding_time'].mean() if count else pd.NaT,
+        'max_holding_time': trips['holding_time'].max() if count else pd.NaT,
+    }
+
+
+def metrics_frame(balance, holding=None, initial_capital: float = None,
+                  periods_per_year: float = PERIODS_PER_YEAR, risk_free: float = 0.0) -> pd.DataFrame:
+    """二维批量结果的全部指标，每次回测一行（列为 EQUITY_METRICS 及给出 holding 时的 POSITION_METRICS）。"""
+    b, _ = _as_2d(balance)
+    result = equity_metrics(b, initial_capital, periods_per_year, risk_free)
+    if holding is not None:
+        h, _ = _as_2d(holding)
+        result.update(position_metrics(h, b, initial_capital))
+    return pd.DataFrame(result)
+
+
+def print_metrics(metrics: dict):
+    """在控制台打印 analyze_result / analyze_trades 的结果。"""
+    labels = {
+        'total_return': ('总收益率', '{:.2%}'), 'annual_return': ('年化收益率', '{:.2%}'),
+        'volatility': ('年化波动率', '{:.2%}'), 'sharpe': ('夏普比率', '{:.2f}'), 'sortino': ('索提诺比率', '{:.2f}'),
+        'calmar': ('卡玛比率', '{:.2f}'), 'max_drawdown': ('最大回撤', '{:.2%}'),
+        'max_drawdown_duration': ('最长回撤K线数', '{}'), 'trade_count': ('交易次数', '{}'),
+        'win_rate': ('胜率', '{:.2%}'), 'profit_factor': ('盈亏比', '{:.2f}'), 'total_pnl': ('总盈亏', '{:.2f}'),
+        'avg_trade_pnl': ('平均每笔盈亏', '{:.2f}'), 'avg_holding_bars': ('平均持仓K线数', '{:.1f}'),
+        'max_holding_bars': ('最长持仓K线数', '{}'), 'avg_holding_time': ('平均持仓时间', '{}'),
+        'max_holding_time': ('最长持仓时间', '{}'),
+    }
+    for key, value in metrics.items():
+        label, fmt = labels.get(key, (key, '{}'))
+        print(f"  {label}: {fmt.format(value)}")
+
+
+if __name__ == "__main__":
+    import os
+    import time
+
+    from sweep import summarize_simulation
+    from vector_backtest import (dual_ma_signals, random_walk_klines, read_tushare_csv, run_vector_backtest,
+                                 simulate_positions)
+
+    csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "000001_SZ_daily_20230101_20231231.csv")
+    result = run_vector_backtest(read_tushare_csv(csv_path), volume_multiple=100, detail=True)
+    metrics = analyze_result(result.drop(columns='holding'), initial_capital=1_000_000)
+    print("000001.SZ 日线双均线：")
+    print_metrics(metrics)
+
+    # 与逐个计算的结果一致：由 trade 列还原的持仓、回撤、收益率
+    assert np.array_equal(holding_from_result(result.drop(columns='holding')), result['holding'])
+    sim = {'balance': result['balance'].to_numpy(), 'fill_price': result['fill_price'].to_numpy()}
+    total_return, max_drawdown, _ = summarize_simulation(sim, 1_000_000)
+    assert np.isclose(metrics['total_return'], total_return) and np.isclose(metrics['max_drawdown'], max_drawdown)
+
+    # 成交记录的回合统计：每个回合的盈亏之和等于已平仓部分的权益变化
+    trades = [{'datetime': '2023-01-02', 'symbol': 'A', 'volume': 2, 'price': 10.0},
+              {'datetime': '2023-01-05', 'symbol': 'A', 'volume': -5, 'price': 12.0},   # 平多 2 并反手开空 3
+              {'datetime': '2023-01-09', 'symbol': 'A', 'volume': 3, 'price': 11.0},
+              {'datetime': '2023-01-03', 'symbol': 'B', 'volume': -1, 'price': 100.0}]  # 未平仓
+    trips = round_trips(trades, volume_multiple=10)
+    assert trips['pnl'].tolist() == [40.0, 30.0] and trips['direction'].tolist() == [1, -1]
+
+    # 二维批量：一批参数的权益曲线一次算出全部指标，并与逐行计算一致
+    klines = random_walk_klines(250)
+    open_, close = klines['open'].to_numpy(dtype=float), klines['close'].to_numpy(dtype=float)
+    sims = [simulate_positions(open_, close, dual_ma_signals(close, s, l)[2], 1_000_000, 0.2)
+            for s in range(3, 23) for l in range(24, 74)]
+    balances = np.array([s['balance'] for s in sims])
+    holdings = np.array([s['holding'] for s in sims])
+    frame = metrics_frame(balances, holdings, initial_capital=1_000_000)
+    for i in (0, 17, len(sims) - 1):
+        single = equity_metrics(balances[i], 1_000_000)
+        single.update(position_metrics(holdings[i], balances[i], 1_000_000))
+        assert np.allclose(frame.iloc[i].to_numpy(dtype=float), [single[c] for c in frame.columns], equal_nan=True)
+
+    runs = 20_000
+    batch_b = np.tile(balances, (runs // len(balances), 1))
+    batch_h = np.tile(holdings, (runs // len(holdings), 1))
+    start = time.perf_counter()
+    metrics_frame(batch_b, batch_h, initial_capital=1_000_000)
+    elapsed = time.perf_counter() - start
+    print(f"批量分析 {len(batch_b)} 次回测 x {batch_b.shape[1]} 根K线，耗时 {elapsed:.3f} 秒"
+          f"（{len(batch_b) / elapsed:,.0f} 次/秒）")
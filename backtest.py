@@ -1,41 +1,89 @@
 from datetime import date
+import os
 import pandas as pd
-from tqsdk import TqApi, TqAuth, TqBacktest, TargetPosTask, TqSim
-from tqsdk.tafunc import ma
+from indicators import BarsLast, count_new_bars
+from indicator_cache import IndicatorCache
+from tdxexpr import CompiledCondition, compile_condition
+from recorder import ResultRecorder
+from event_log import EventSink
+from profiler import NullProfiler
+from checkpoint import condition_id, load_checkpoint, save_checkpoint
+from tqcompat import create_backtest_api, kline_columns, target_pos_task
 
 # 需要传入合约代码和bool条件，默认日期是2023-1-01到2023-12-31
-def BARSLAST(symbol, condition, start_dt=date(2023, 1, 1), end_dt=date(2023, 12, 31)):
+def BARSLAST(symbol, condition, start_dt=date(2023, 1, 1), end_dt=date(2023, 12, 31),
+             short=12, long=26, invest_ratio=0.2, api=None, output_path=None,
+             sink=None, indicator_cache=None, profiler=None, checkpoint_path=None):
     """
     回测双均线策略并计算BARSLAST结果，使用日K线，仅考虑交易日周期。
 
     参数：
         symbol (str): 期货代码，例如 "DCE.m2401"。
-        condition (callable or pd.Series): 布尔条件函数（接受klines返回布尔Series）或布尔Series。
+        condition (str, callable or pd.Series): 通达信风格的条件表达式（例如 "CROSS(MA(C,12),MA(C,26))"，见 tdxexpr）、
+            布尔条件函数（接受klines返回布尔Series）或布尔Series。表达式只编译一次，每根K线增量求值。
         start_dt (date): 回测开始日期，默认为2023-01-01。
         end_dt (date): 回测结束日期，默认为2023-12-31。
+        short (int): 短周期均线，默认为12。
+        long (int): 长周期均线，默认为26。
+        invest_ratio (float): 每次投入本金的比例，默认为0.2。
+        api: 已创建的API实例，例如 replay.ReplayApi 离线回放；为None时创建TqApi回测会话。
+        output_path (str): 结果文件路径（.csv 或 .parquet）。指定后回测过程中分块写入文件，内存占用不随K线数增长。
+        sink (EventSink): 日志输出，默认每根K线在后台线程打印到控制台；传入 NullSink() 可完全静默。
+        indicator_cache (IndicatorCache): 策略均线与条件表达式共用的指标缓存，为None时新建。
+            布尔条件函数可通过 indicator_cache.series(klines, "MA", 12) 共用同一缓存。
+        profiler (BarProfiler): 逐K线分段计时（wait_update、成交检测、指标、条件、下单、记录、日志），
+            回测结束时输出汇总；为None时不计时。
+        checkpoint_path (str): 检查点文件（见 checkpoint）。文件存在时从中恢复，只处理检查点之后的新K线；
+            回放结束时把状态写回该文件。需要配合 replay.ReplayApi 使用，结果与从头重跑一致。
+            条件须为表达式或 Python 函数（恢复时按表达式文本或函数源码校验），不支持布尔Series。
 
     返回：
-        pd.DataFrame: 包含所有回测记录的DataFrame，列包括：
+        pd.DataFrame or str: 未指定 output_path 时为包含所有回测记录的DataFrame，列包括：
             datetime: 时间
             price: 收盘价
             balance: 账户余额
             position: 手数
             barslast: BARSLAST值
             trade: 交易信息
+        指定 output_path 时返回结果文件路径，不把全部记录读回内存；
+        可用 pd.read_csv / pd.read_parquet 分块读取（列类型与 recorder.ResultRecorder.to_frame 相同）。
     """
     # 策略参数
-    SHORT = 12  # 短周期均线
-    LONG = 26  # 长周期均线
+    SHORT = short  # 短周期均线
+    LONG = long  # 长周期均线
     INITIAL_CAPITAL = 1_000_000  # 初始本金
-    INVEST_RATIO = 0.2  # 每次投入本金的比例（20%）
-
-    # 创建结果列表，用于存储每个时间点的数据
-    results = []
+    INVEST_RATIO = invest_ratio  # 每次投入本金的比例
+
+    # 条件表达式只编译一次
+    if isinstance(condition, str):
+        condition = compile_condition(condition)
+    compiled = isinstance(condition, CompiledCondition)
+
+    # 从检查点恢复：参数（包括条件的标识）必须与保存时一致
+    resume = None
+    if checkpoint_path:
+        if api is None or not hasattr(api, "snapshot"):
+            raise ValueError("检查点只支持 replay.ReplayApi 等可保存状态的回放驱动")
+        checkpoint_params = {'symbol': symbol, 'short': SHORT, 'long': LONG, 'invest_ratio': INVEST_RATIO,
+                             'condition': condition_id(condition)}
+        if os.path.exists(checkpoint_path):
+            resume = load_checkpoint(checkpoint_path, checkpoint_params)
+            api.restore(resume['api'])
+
+    # 创建列式结果记录器，用于存储每个时间点的数据（从检查点恢复时继续追加）
+    recorder = ResultRecorder(output_path, resume=resume['recorder'] if resume else None)
+    own_api = api is None
+    own_sink = sink is None
+    if own_sink:
+        sink = EventSink()
+    if profiler is None:
+        profiler = NullProfiler()
 
     try:
-        # 创建API实例，启用回测模式
-        api = TqApi(account=TqSim(init_balance=1_000_000), backtest=TqBacktest(start_dt=start_dt, end_dt=end_dt),
-                    auth=TqAuth("zyf_01", "@J8wrFVd5sHBcwF"))
+        # 创建API实例，启用回测模式（此时才导入 tqsdk）
+        if own_api:
+            api = create_backtest_api(start_dt, end_dt, init_balance=INITIAL_CAPITAL,
+                                      auth=("zyf_01", "@J8wrFVd5sHBcwF"))
         print(f"开始回测：{symbol}")
 
         # 动态获取合约乘数
@@ -44,8 +92,10 @@ def BARSLAST(symbol, condition, start_dt=date(2023, 1, 1), end_dt=date(2023, 12,
         if not VOLUME_MULTIPLE:
             raise ValueError(f"无法获取 {symbol} 的合约乘数")
 
-        # 获取日K线数据
+        # 获取日K线数据，窗口长度同时满足均线和条件表达式的需要
         data_length = LONG + 2
+        if compiled:
+            data_length = max(data_length, condition.data_length)
         klines = api.get_kline_serial(symbol, duration_seconds=24 * 60 * 60, data_length=data_length)
 
         # 检查索引重复
@@ -53,163 +103,185 @@ def BARSLAST(symbol, condition, start_dt=date(2023, 1, 1), end_dt=date(2023, 12,
             print("警告：K线索引包含重复值，尝试去重")
             klines = klines.loc[~klines.index.duplicated(keep='last')]
 
-        # 创建目标持仓任务
-        target_pos = TargetPosTask(api, symbol)
-
-        # 获取账户信息
-        account = api.get_account()
-
-        # 创建历史条件记录字典
-        condition_history = {}
-        dt_list = []  # 存储时间顺序
-
-        def calculate_barslast(history, dt_list, current_dt):
-            """
-            计算BARSLAST值：返回上一次True距离当前交易日的周期数
-
-            参数:
-                history (dict): 历史条件记录，键为datetime，值为布尔值
-                dt_list (list): 按时间顺序排列的datetime列表
-                current_dt: 当前datetime
+        # 每根K线需要读取的列：时间、收盘价以及条件表达式用到的行情字段
+        bar_fields = ['datetime', 'close']
+        if compiled:
+            bar_fields += [f for f in condition.fields if f not in bar_fields]
+        # 离线回放驱动直接提供与窗口共享内存的数组；TqApi 时为 None，每根K线从 klines 取列
+        window_columns = kline_columns(api, klines, bar_fields)
 
-            返回:
-                int: BARSLAST值
-            """
-            # 如果当前条件为True，返回0
-            if history[current_dt]:
-                return 0
+        # 创建目标持仓任务（离线回放驱动使用自带的实现）
+        target_pos = target_pos_task(api, symbol)
 
-            # 找到当前日期在时间列表中的位置
-            current_idx = dt_list.index(current_dt)
-
-            # 从当前位置向前查找最近的True
-            for i in range(current_idx - 1, -1, -1):
-                if history[dt_list[i]]:
-                    return current_idx - i
-
-            # 如果没有找到True，返回-1
-            return -1
+        # 获取账户和持仓信息
+        account = api.get_account()
+        position_info = api.get_position(symbol)
+        last_pos = position_info.pos
+
+        if resume:
+            # 指标、条件表达式和BARSLAST的状态一起保存，恢复后仍共用同一个缓存
+            state = resume['strategy']
+            bars_last_state = state['bars_last']
+            indicator_cache = state['indicator_cache']
+            short_ma, long_ma = state['short_ma'], state['long_ma']
+            condition_stream = state['condition_stream']
+            last_pos = state['last_pos']
+            last_bar_dt = state['last_bar_dt']
+        else:
+            # 创建流式BARSLAST状态，每根K线O(1)更新
+            bars_last_state = BarsLast()
+
+            # 从共享缓存获取增量均线，每根K线O(1)更新；条件表达式中相同的均线直接命中缓存
+            if indicator_cache is None:
+                indicator_cache = IndicatorCache()
+            short_ma = indicator_cache.indicator("close", "MA", SHORT)
+            long_ma = indicator_cache.indicator("close", "MA", LONG)
+            condition_stream = condition.stream(cache=indicator_cache) if compiled else None
+            last_bar_dt = None  # 已处理的最后一根K线的时间
 
         while True:
+            profiler.begin_bar()
             if not api.wait_update():
+                sink.flush()
                 print("回测结束")
+                if checkpoint_path:
+                    save_checkpoint(checkpoint_path, {
+                        'params': checkpoint_params,
+                        'api': api.snapshot(),
+                        'recorder': recorder.snapshot(),
+                        'strategy': {'bars_last': bars_last_state, 'indicator_cache': indicator_cache,
+                                     'short_ma': short_ma, 'long_ma': long_ma,
+                                     'condition_stream': condition_stream, 'last_pos': last_pos,
+                                     'last_bar_dt': last_bar_dt},
+                    })
                 break
-
-            # 当K线更新时执行逻辑
-            if api.is_changing(klines.iloc[-1], "datetime"):
+            profiler.mark('wait_update')
+
+            # 当K线更新时执行逻辑：直接判断K线序列，不构造 klines.iloc[-1] 行对象；
+            # pandas 按列取值每次都有数微秒的开销，每根K线每列只取一次 NumPy 数组，之后都从数组读取
+            if api.is_changing(klines, "datetime"):
+                columns = window_columns or {f: klines[f].to_numpy() for f in bar_fields}
+                closes = columns['close']
+                datetimes = columns['datetime']
                 # 获取当前K线的时间和价格
-                current_dt = pd.Timestamp(klines.datetime.iloc[-1], unit='ns')
-                current_price = klines.close.iloc[-1]
+                current_dt = pd.Timestamp(int(datetimes[-1]), unit='ns')
+                current_price = float(closes[-1])
 
-                # 添加当前时间到时间列表
-                if current_dt not in dt_list:
-                    dt_list.append(current_dt)
+                # 上一根K线设置的目标持仓成交后记录成交事件
+                if position_info.pos != last_pos:
+                    sink.fill("时间: {datetime}, 成交: {volume:+d} 手, 当前持仓: {pos} 手",
+                              datetime=current_dt, volume=position_info.pos - last_pos, pos=position_info.pos)
+                    last_pos = position_info.pos
+                profiler.mark('fill')
 
                 # 计算均线和仓位信息
-                short_avg = ma(klines["close"], SHORT)
-                long_avg = ma(klines["close"], LONG)
+                new_bars = count_new_bars(datetimes, last_bar_dt)
+                last_bar_dt = datetimes[-1]
+                new_conditions = None
+                warmup = short_ma.count == 0
+                if warmup:
+                    # 第一根K线时用已有的K线窗口预热均线
+                    short_ma.extend(closes)
+                    long_ma.extend(closes)
+                    if compiled:
+                        condition_stream.warmup(klines)
+                else:
+                    # 上一根K线已完成，先用其最终收盘价定稿，再追加新K线；
+                    # 一次更新带来多根新K线时（例如断线重连后）逐根追加，均线窗口不会错位
+                    if new_bars >= len(closes):
+                        print(f"警告：{current_dt} 一次更新了 {new_bars} 根K线，超出K线窗口，中间的K线无法补回")
+                    short_ma.next_bars(closes, new_bars)
+                    long_ma.next_bars(closes, new_bars)
+                    if compiled:
+                        new_conditions = condition_stream.next_bars(columns, new_bars)
                 current_capital = account.balance
                 invest_amount = current_capital * INVEST_RATIO
                 position = int(invest_amount / (current_price * VOLUME_MULTIPLE))
+                profiler.mark('indicators')
 
-                # 更新条件历史记录
-                if callable(condition):
-                    condition_history[current_dt] = condition(klines).iloc[-1]
+                # 计算当前K线的条件值
+                if compiled:
+                    current_condition = condition_stream.current
+                elif callable(condition):
+                    current_condition = condition(klines).iloc[-1]
                 else:
-                    condition_history[current_dt] = condition.iloc[-1] if current_dt in condition.index else False
-
-                # 计算BARSLAST
-                bars_last = calculate_barslast(condition_history, dt_list, current_dt)
+                    current_condition = condition.iloc[-1] if current_dt in condition.index else False
+
+                # 计算BARSLAST（同一根K线重复更新时以最后一次为准），中间跳过的新K线先依次计入
+                if new_bars > 1 and not warmup:
+                    skipped_dts = pd.to_datetime(datetimes[-new_bars:-1], unit='ns')
+                    if compiled:
+                        skipped_conditions = new_conditions[:-1]
+                    elif callable(condition):
+                        skipped_conditions = condition(klines).to_numpy()[-new_bars:-1]
+                    else:
+                        skipped_conditions = [condition.get(dt, False) for dt in skipped_dts]
+                    for dt, skipped_condition in zip(skipped_dts, skipped_conditions):
+                        bars_last_state.update(skipped_condition, key=dt)
+                bars_last = bars_last_state.update(current_condition, key=current_dt)
+                profiler.mark('condition')
 
                 # 双均线策略
                 trade_action = None
-                if len(short_avg) >= 2 and len(long_avg) >= 2:
-                    if short_avg.iloc[-2] < long_avg.iloc[-2] and short_avg.iloc[-1] > long_avg.iloc[-1]:
-                        trade_action = f"开多 {position} 手"
-                        target_pos.set_target_volume(position)
-                    elif short_avg.iloc[-2] > long_avg.iloc[-2] and short_avg.iloc[-1] < long_avg.iloc[-1]:
-                        trade_action = f"开空 {position} 手"
-                        target_pos.set_target_volume(-position)
+                # 均线尚未算出时为 NaN，比较结果为 False，不会产生信号
+                if short_ma.prev < long_ma.prev and short_ma.value > long_ma.value:
+                    trade_action = f"开多 {position} 手"
+                    target_pos.set_target_volume(position)
+                    sink.signal("时间: {datetime}, 金叉信号, 目标持仓: {target} 手", datetime=current_dt, target=position)
+                elif short_ma.prev > long_ma.prev and short_ma.value < long_ma.value:
+                    trade_action = f"开空 {position} 手"
+                    target_pos.set_target_volume(-position)
+                    sink.signal("时间: {datetime}, 死叉信号, 目标持仓: {target} 手", datetime=current_dt, target=-position)
+                profiler.mark('order')
 
                 # 存储当前记录
-                record = {
-                    'datetime': current_dt,
-                    'price': current_price,
-                    'balance': current_capital,
-                    'position': position,
-                    'barslast': bars_last,
-                    'trade': trade_action
-                }
-                results.append(record)
-
-                # 打印日志
-                print(f"时间: {current_dt}, "
-                      f"价格: {current_price:.2f}, 净值: {current_capital:.2f}, "
-                      f"手数: {position}, BARSLAST: {bars_last}, 交易: {trade_action or '无'}")
+                recorder.append(current_dt, current_price, current_capital, position, bars_last, trade_action)
+                profiler.mark('record')
+
+                # 输出日志（格式化在后台线程中进行）
+                sink.bar("时间: {datetime}, 价格: {price:.2f}, 净值: {balance:.2f}, "
+                         "手数: {position}, BARSLAST: {barslast}, 交易: {trade}",
+                         datetime=current_dt, price=current_price, balance=current_capital,
+                         position=position, barslast=bars_last, trade=trade_action or '无')
+                profiler.mark('logging')
+                profiler.end_bar(current_dt)
 
     except Exception as e:
+        sink.flush()
         print(f"回测失败: {str(e)}")
         import traceback
         traceback.print_exc()
 
     finally:
-        # 确保API关闭
-        if 'api' in locals():
+        # 确保API关闭（外部传入的API由调用方负责关闭）
+        if own_api and api is not None:
             api.close()
+        # 输出剩余日志
+        if own_sink:
+            sink.close()
+        else:
+            sink.flush()
+        # 输出逐K线耗时汇总（未开启计时时为空操作）
+        profiler.report()
 
-    # 将结果转换为DataFrame并返回
-    if results:
-        return pd.DataFrame(results)
-    else:
-        return pd.DataFrame(columns=['datetime', 'price', 'balance', 'position', 'barslast', 'trade'])
+    # 返回结果：写入文件时只返回文件路径，内存占用不随K线数增长
+    return recorder.result()
 
 
 if __name__ == "__main__":
     # 示例布尔条件：收盘价等于3748.00
     condition_func = lambda klines: klines["close"] == 3748.00
 
-    # 示例布尔条件：检测金叉（短期均线从下方穿过长期均线）
-    def golden_cross_condition(klines):
-        # 计算短期和长期均线
-        short_avg = ma(klines["close"], 12)  # 短周期均线
-        long_avg = ma(klines["close"], 26)  # 长周期均线
-
-        # 创建一个与klines长度相同的布尔Series，初始值全为False
-        result = pd.Series(False, index=klines.index)
-
-        # 检查是否有足够的数据来判断金叉
-        if len(short_avg) >= 2 and len(long_avg) >= 2:
-            # 对于最新的数据点，检查是否出现金叉
-            result.iloc[-1] = (short_avg.iloc[-2] < long_avg.iloc[-2] and
-                               short_avg.iloc[-1] > long_avg.iloc[-1])
-
-        return result
-
-    # 示例布尔条件：检测死叉
-    def death_cross_condition(klines):
-        # 计算短期和长期均线
-        short_avg = ma(klines["close"], 12)  # 短周期均线
-        long_avg = ma(klines["close"], 26)  # 长周期均线
-
-        # 创建一个与klines长度相同的布尔Series，初始值全为False
-        result = pd.Series(False, index=klines.index)
-
-        # 检查是否有足够的数据来判断死叉
-        if len(short_avg) >= 2 and len(long_avg) >= 2:
-            # 对于最新的数据点，检查是否出现死叉
-            result.iloc[-1] = (short_avg.iloc[-2] > long_avg.iloc[-2] and
-                               short_avg.iloc[-1] < long_avg.iloc[-1])
-
-        return result
-
+    # 示例条件表达式：检测金叉（短期均线从下方穿过长期均线），编译后每根K线增量求值
+    golden_cross_condition = "CROSS(MA(C,12),MA(C,26))"
 
-    # 运行模块并获取结果
-    result_df = BARSLAST(symbol="DCE.m2401", condition=condition_func)
+    # 示例条件表达式：检测死叉
+    death_cross_condition = "CROSS(MA(C,26),MA(C,12))"
 
-    # 显示结果
-    print("\n回测结果DataFrame:")
-    print(result_df.head())
+    # 运行模块，结果在回测过程中分块写入CSV文件，返回文件路径
+    result_path = BARSLAST(symbol="DCE.m2401", condition=condition_func, output_path="barslast_results.csv")
 
-    # 保存结果到CSV文件
-    result_df.to_csv("barslast_results.csv", index=False)
-    print("结果已保存到 barslast_results.csv")
+    # 显示结果的前几行
+    print("\n回测结果:")
+    print(pd.read_csv(result_path, nrows=5))
+    print(f"结果已保存到 {result_path}")
@@ -0,0 +1,260 @@
+# barslast_matrix.py
+
+"""
+多条件 BARSLAST。
+
+选股和盯盘时每个合约要同时跟踪几十个条件，逐个调用 BARSLAST 时每个条件都要单独扫描一遍窗口。
+这里把 K 个条件排成 (K线数 × K) 的布尔矩阵（也可以传入 {名称: Series} 或 DataFrame）：
+    barslast_matrix   历史部分一次向量化计算全部 K 列，结果为一个 int32 矩阵；
+    BarsLastMatrix    长度为 K 的状态向量，每根K线 O(K) 增量更新，语义与 indicators.BarsLast 相同
+                      （当前成立为 0，从未成立为 -1，同一根K线可多次更新）。
+
+    state = BarsLastMatrix(["金叉", "死叉", "站上MA26"])
+    history = state.extend(conditions)          # 预热：(K线数, 3) 的 int32 矩阵
+    values = state.update([gc, dc, above], key=dt)   # 之后每根K线一行
+"""
+
+import sys
+
+import numpy as np
+
+import tdxfunc
+
+
+def _as_bool_matrix(values: np.ndarray) -> np.ndarray:
+    """把二维数组转换为布尔矩阵，NaN / None 视为 False。"""
+    if values.dtype == bool:
+        return values
+    if values.dtype.kind == 'f':
+        return np.nan_to_num(values, nan=0.0) != 0
+    if values.dtype.kind in 'iu':
+        return values != 0
+    import pandas as pd  # 对象数组可能含 None / pd.NA，交给 pandas 判断
+
+    return np.where(pd.isna(values), False, values).astype(bool)
+
+
+def condition_matrix(conditions):
+    """
+    把多个条件整理成 (K线数 × K) 的布尔矩阵。
+
+    Args:
+        conditions: 二维布尔数组（每列一个条件）、DataFrame 或 {名称: 布尔 Series/数组}，
+            各条件长度必须相同。
+
+    Returns:
+        tuple: (matrix, names)。matrix 为 C 连续的布尔数组；names 为条件名称，二维数组时为列号。
+    """
+    pd = sys.modules.get('pandas')  # 未导入 pandas 时不可能传入 DataFrame，无需导入
+    if pd is not None and isinstance(conditions, pd.DataFrame):
+        names = list(conditions.columns)
+        columns = [conditions[name] for name in names]
+    elif isinstance(conditions, dict):
+        names = list(conditions)
+        columns = list(conditions.values())
+    else:
+        values = np.asarray(conditions)
+        if values.ndim != 2:
+            raise ValueError("条件矩阵必须是二维的 (K线数 × 条件数)。")
+        return np.ascontiguousarray(_as_bool_matrix(values)), list(range(values.shape[1]))
+
+    if not columns:
+        raise ValueError("至少需要一个条件。")
+    lengths = {len(c) for c in columns}
+    if len(lengths) != 1:
+        raise ValueError(f"各条件的长度不一致：{sorted(lengths)}")
+    matrix = np.empty((lengths.pop(), len(columns)), dtype=bool)
+    for j, column in enumerate(columns):
+        matrix[:, j] = tdxfunc._as_bool_array(column)
+    return matrix, names
+
+
+def barslast_matrix(conditions) -> np.ndarray:
+    """
+    一次计算全部条件每根K线的 BARSLAST。
+
+    Args:
+        conditions: 见 condition_matrix。
+
+    Returns:
+        np.ndarray: (K线数 × K) 的 int32 矩阵，第 j 列等于 tdxfunc.BARSLAST(第 j 个条件)。
+    """
+    cond, _ = condition_matrix(conditions)
+    return _barslast(cond, np.full(cond.shape[1], -1, dtype=np.int64), 0)
+
+
+def _barslast(cond: np.ndarray, last_true: np.ndarray, start: int) -> np.ndarray:
+    """
+    cond 的第一行是全局第 start 根K线，last_true 为此前各条件最近一次成立的序号（-1 表示没有）。
+    返回 int32 结果矩阵，只分配结果本身和一个同形状的掩码。
+    """
+    n = cond.shape[0]
+    idx = np.arange(start, start + n, dtype=np.int32)[:, np.newaxis]
+    result = np.where(cond, idx, last_true.astype(np.int32))
+    np.maximum.accumulate(result, axis=0, out=result)
+    never = result < 0
+    np.subtract(idx, result, out=result)
+    result[never] = -1
+    return result
+
+
+class BarsLastMatrix:
+    """
+    K 个条件的流式 BARSLAST 状态。
+
+    Args:
+        names (int or list): 条件数量或条件名称列表。
+
+    update 返回的数组在下一次更新时就地覆盖，需要保留时请 copy()。
+    """
+
+    def __init__(self, names):
+        if isinstance(names, int):
+            names = list(range(names))
+        self.names = list(names)
+        k = len(self.names)
+        self.bar_index = -1  # 当前K线序号（从0开始）
+        self.key = None  # 当前K线的标识（通常为K线时间）
+        self.current = np.zeros(k, dtype=bool)  # 当前K线的条件值
+        self.last_true = np.full(k, -1, dtype=np.int64)  # 当前K线之前最近一次成立的序号
+        self._values = np.full(k, -1, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _check_width(self, k: int):
+        if k != len(self.names):
+            raise ValueError(f"条件数量 {k} 与状态的条件数量 {len(self.names)} 不一致。")
+
+    def extend(self, conditions, key=None) -> np.ndarray:
+        """
+        一次追加多根新K线（例如用历史窗口预热），向量化计算。
+
+        Args:
+            conditions: 见 condition_matrix，每行一根新K线。
+            key: 最后一根K线的标识，之后用相同的 key 调用 update 表示更新这根K线。
+
+        Returns:
+            np.ndarray: 这些K线的 (行数 × K) int32 结果矩阵。
+        """
+        cond, _ = condition_matrix(conditions)
+        self._check_width(cond.shape[1])
+        if len(cond) == 0:
+            return np.empty((0, len(self.names)), dtype=np.int32)
+        # 上一根K线的最终条件值计入历史
+        np.copyto(self.last_true, self.bar_index, where=self.current)
+        start = self.bar_index + 1
+        result = _barslast(cond, self.last_true, start)
+        if len(cond) > 1:
+            prev = result[-2]
+            np.copyto(self.last_true, np.where(prev >= 0, start + len(cond) - 2 - prev, -1))
+        self.bar_index = start + len(cond) - 1
+        self.key = key
+        self.current[:] = cond[-1]
+        return result
+
+    def update(self, conditions, key=None) -> np.ndarray:
+        """
+        写入一根K线的 K 个条件值并返回各条件的 BARSLAST。
+
+        Args:
+            conditions: 长度为 K 的布尔序列。
+            key: K线标识。与上一次相同表示更新同一根K线，不同或为 None 表示进入新K线。
+
+        Returns:
+            np.ndarray: 长度为 K 的 int32 数组。
+        """
+        row = np.asarray(conditions)
+        if row.shape != self.current.shape:
+            self._check_width(row.shape[0] if row.ndim == 1 else -1)
+        if key is None or key != self.key or self.bar_index < 0:
+            # 进入新K线前，把上一根K线的最终条件值计入历史
+            np.copyto(self.last_true, self.bar_index, where=self.current)
+            self.bar_index += 1
+            self.key = key
+        if row.dtype != bool:
+            row = _as_bool_matrix(row[np.newaxis])[0]
+        np.copyto(self.current, row)
+        return self.values
+
+    @property
+    def values(self) -> np.ndarray:
+        """当前K线各条件的 BARSLAST 值（当前成立为 0，从未成立为 -1）。"""
+        out = self._values
+        np.subtract(self.bar_index, self.last_true, out=out, casting='unsafe')
+        np.copyto(out, -1, where=self.last_true < 0)
+        np.copyto(out, 0, where=self.current)
+        return out
+
+    @property
+    def prior(self) -> np.ndarray:
+        """
+        不计当前K线、距离之前最近一次成立的周期数（>= 1，没有时为 -1），
+        即 test/barslast.py 中 BARSLAST 的语义。
+        """
+        return np.where(self.last_true >= 0, self.bar_index - self.last_true, -1).astype(np.int32)
+
+    def as_dict(self) -> dict:
+        """{条件名称: 当前 BARSLAST 值}。"""
+        return dict(zip(self.names, self.values.tolist()))
+
+
+if __name__ == "__main__":
+    # 与逐列 tdxfunc.BARSLAST、逐条件 indicators.BarsLast 比对，并对比 50 个条件时的耗时
+    import time
+
+    from indicators import BarsLast
+
+    rng = np.random.default_rng(0)
+    n, k = 20_000, 50
+    close = 3000 + np.cumsum(rng.normal(0, 10, n))
+    conditions = {f"C>MA{p}": close > tdxfunc.MA(close, p) for p in range(2, 2 + k - 2)}
+    conditions["金叉"] = tdxfunc.CROSS(tdxfunc.MA(close, 12), tdxfunc.MA(close, 26))
+    conditions["死叉"] = tdxfunc.CROSS(tdxfunc.MA(close, 26), tdxfunc.MA(close, 12))
+    matrix, names = condition_matrix(conditions)
+
+    start = time.perf_counter()
+    separate = [tdxfunc.BARSLAST(c) for c in conditions.values()]
+    t_separate = time.perf_counter() - start
+    start = time.perf_counter()
+    result = barslast_matrix(matrix)
+    t_matrix = time.perf_counter() - start
+    assert result.dtype == np.int32 and result.shape == (n, k)
+    for j, expected in enumerate(separate):
+        assert np.array_equal(result[:, j], expected), names[j]
+
+    # 流式：前 500 根预热，之后逐根更新；每根K线先写入一个临时值再写入最终值
+    state = BarsLastMatrix(names)
+    assert np.array_equal(state.extend(matrix[:500], key=499), result[:500])
+    singles = [BarsLast() for _ in names]
+    for j, s in enumerate(singles):
+        for i in range(500):
+            s.update(matrix[i, j], key=i)
+    for i in range(500, n // 2):
+        state.update(~matrix[i], key=i)
+        assert np.array_equal(state.update(matrix[i], key=i), result[i]), i
+    for j, s in enumerate(singles):
+        for i in range(500, n // 2):
+            s.update(matrix[i, j], key=i)
+    start = time.perf_counter()
+    for i in range(n // 2, n):
+        state.update(matrix[i], key=i)
+    t_stream = time.perf_counter() - start
+    assert np.array_equal(state.values, result[-1])
+    start = time.perf_counter()
+    for i in range(n // 2, n):
+        row = matrix[i].tolist()
+        for j, s in enumerate(singles):
+            s.update(row[j], key=i)
+    t_singles = time.perf_counter() - start
+    assert [s.value for s in singles] == state.values.tolist()
+    assert state.as_dict()["金叉"] == result[-1, names.index("金叉")]
+
+    # 分块追加与逐根更新一致，prior 等于不计当前K线的结果
+    chunked = BarsLastMatrix(k)
+    blocks = [chunked.extend(matrix[a:a + 777]) for a in range(0, n, 777)]
+    assert np.array_equal(np.vstack(blocks), result)
+    assert np.array_equal(chunked.prior, np.where(result[-2] >= 0, result[-2] + 1, -1))
+
+    print(f"{k} 个条件 x {n} 根K线：逐列向量化 {t_separate * 1000:.1f} 毫秒，矩阵一次计算 {t_matrix * 1000:.1f} 毫秒；"
+          f"流式逐根更新 {t_stream * 1000:.0f} 毫秒（{k} 个 BarsLast {t_singles * 1000:.0f} 毫秒）")
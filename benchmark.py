@@ -0,0 +1,527 @@
+# benchmark.py
+
+"""
+离线性能基准。
+
+在合成的随机游走K线（1e3 ~ 1e7 根）上测量各实现的吞吐量（根/秒）和峰值内存，
+给出随K线数增长的耗时曲线（对数坐标下的斜率，1 表示线性、2 表示平方），
+结果保存为 JSON，便于对比不同提交之间的性能变化：
+
+    python benchmark.py --sizes 1e3,1e4,1e5 --output bench.json
+    python benchmark.py --sizes 1e3,1e4,1e5 --compare bench.json   # 与旧结果对比
+
+覆盖的实现：
+    barslast.legacy_scan     backtest.BARSLAST 原来的 calculate_barslast（每根K线向前扫描）
+    barslast.streaming       indicators.BarsLast 流式更新
+    barslast.vector          tdxfunc.BARSLAST 向量化
+    barslast.test_window     test/barslast.py 的 BARSLAST，每根K线对窗口调用一次
+    barslast.matrix          barslast_matrix 一次计算 50 个条件（(K线数 × 50) 布尔矩阵）
+    barslast.matrix_stream   BarsLastMatrix 逐根K线更新 50 个条件的状态向量
+    ma.tafunc_per_bar        每根K线对窗口重算 tqsdk.tafunc.ma
+    ma.incremental           indicators.SMA 增量更新
+    ma.vector                tdxfunc.MA 向量化
+    cross.strategy_loop      run_dual_ma_strategy 中的金叉/死叉判断（增量均线 + 前后值比较）
+    cross.expr_stream        tdxexpr 条件表达式增量求值
+    cross.expr_vector        tdxexpr 条件表达式向量化求值
+    engine.vector_backtest   vector_backtest.run_vector_backtest
+    analytics.batch          analytics.metrics_frame 一次分析 10 组参数的权益和持仓（二维批量）
+    costs.scenarios          costs.score_scenarios 对一次回测的 48 种滑点 / 手续费假设打分
+    replay.backtest          backtest.BARSLAST 在 ReplayApi 上完整回放
+    replay.dual_ma_strategy  run_dual_ma_strategy 在 ReplayApi 上完整回放
+
+逐根K线循环的实现只在不超过 max_bars 的规模上运行，避免平方复杂度的实现在大数据上耗时过长；
+依赖 tqsdk 等未安装模块的用例会被跳过并在结果中注明原因。
+
+--imports 改为测量各模块在全新解释器中的导入耗时（参数扫描的每个工作进程都要付出这部分开销），
+并检查策略与指标模块是否意外导入了 tqsdk（见 tqcompat）：
+
+    python benchmark.py --imports --output imports.json
+    python benchmark.py --imports --compare imports.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import tdxfunc
+from indicators import SMA, BarsLast
+from tdxexpr import compile_condition
+from vector_backtest import dual_ma_signals, random_walk_klines, run_vector_backtest, simulate_positions
+
+SHORT = 12
+LONG = 26
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------- 用例：每个 setup 接受K线并返回一个无参的待测函数 ----------
+
+def _golden_cross(klines: pd.DataFrame) -> np.ndarray:
+    return tdxfunc.CROSS(tdxfunc.MA(klines['close'].to_numpy(), SHORT), tdxfunc.MA(klines['close'].to_numpy(), LONG))
+
+
+def _setup_legacy_scan(klines):
+    condition = _golden_cross(klines).tolist()
+
+    def calculate_barslast(history, dt_list, current_dt):
+        # backtest.BARSLAST 原来的实现，保留在这里作为性能基线
+        if history[current_dt]:
+            return 0
+        current_idx = dt_list.index(current_dt)
+        for i in range(current_idx - 1, -1, -1):
+            if history[dt_list[i]]:
+                return current_idx - i
+        return -1
+
+    def run():
+        history, dt_list = {}, []
+        for i, c in enumerate(condition):
+            history[i] = c
+            dt_list.append(i)
+            calculate_barslast(history, dt_list, i)
+    return run
+
+
+def _setup_streaming(klines):
+    condition = _golden_cross(klines).tolist()
+
+    def run():
+        state = BarsLast()
+        for c in condition:
+            state.update(c)
+    return run
+
+
+def _setup_barslast_vector(klines):
+    condition = _golden_cross(klines)
+    return lambda: tdxfunc.BARSLAST(condition)
+
+
+def _condition_matrix(klines, k: int = 50) -> np.ndarray:
+    """k 个条件：收盘价在 MA2 ~ MA(k-1) 之上，以及金叉、死叉。"""
+    close = klines['close'].to_numpy()
+    columns = [close > tdxfunc.MA(close, p) for p in range(2, k)]
+    columns.append(_golden_cross(klines))
+    return np.column_stack(columns)
+
+
+def _setup_barslast_matrix(klines):
+    from barslast_matrix import barslast_matrix
+    matrix = _condition_matrix(klines)
+    return lambda: barslast_matrix(matrix)
+
+
+def _setup_barslast_matrix_stream(klines):
+    from barslast_matrix import BarsLastMatrix
+    matrix = _condition_matrix(klines)
+
+    def run():
+        state = BarsLastMatrix(matrix.shape[1])
+        for row in matrix:
+            state.update(row)
+    return run
+
+
+def _setup_test_window(klines):
+    sys.path.insert(0, os.path.join(ROOT_DIR, "test"))
+    from barslast import BARSLAST as window_barslast
+    condition = pd.Series(_golden_cross(klines))
+    data_length = LONG + 5
+
+    def run():
+        for end in range(1, len(condition) + 1):
+            window_barslast(condition.iloc[max(0, end - data_length):end])
+    return run
+
+
+def _setup_tafunc_per_bar(klines):
+    from tqsdk.tafunc import ma
+    close = klines['close']
+    data_length = LONG + 2
+
+    def run():
+        for end in range(1, len(close) + 1):
+            window = close.iloc[max(0, end - data_length):end]
+            ma(window, SHORT).iloc[-1]
+            ma(window, LONG).iloc[-1]
+    return run
+
+
+def _setup_incremental(klines):
+    close = klines['close'].tolist()
+
+    def run():
+        short_ma, long_ma = SMA(SHORT), SMA(LONG)
+        for x in close:
+            short_ma.append(x)
+            long_ma.append(x)
+    return run
+
+
+def _setup_ma_vector(klines):
+    close = klines['close'].to_numpy()
+    return lambda: (tdxfunc.MA(close, SHORT), tdxfunc.MA(close, LONG))
+
+
+def _setup_strategy_loop(klines):
+    close = klines['close'].tolist()
+
+    def run():
+        short_ma, long_ma = SMA(SHORT), SMA(LONG)
+        signals = 0
+        for x in close:
+            short_ma.append(x)
+            long_ma.append(x)
+            if short_ma.value > long_ma.value and short_ma.prev <= long_ma.prev:
+                signals += 1
+            elif short_ma.value < long_ma.value and short_ma.prev >= long_ma.prev:
+                signals -= 1
+        return signals
+    return run
+
+
+def _setup_expr_stream(klines):
+    condition = compile_condition(f"CROSS(MA(C,{SHORT}),MA(C,{LONG}))")
+    rows = [{'close': x} for x in klines['close'].tolist()]
+
+    def run():
+        stream = condition.stream()
+        for row in rows:
+            stream.append(row)
+    return run
+
+
+def _setup_expr_vector(klines):
+    condition = compile_condition(f"CROSS(MA(C,{SHORT}),MA(C,{LONG}))")
+    return lambda: condition.evaluate(klines)
+
+
+def _setup_vector_backtest(klines):
+    return lambda: run_vector_backtest(klines, short=SHORT, long=LONG)
+
+
+def _setup_analytics_batch(klines):
+    from analytics import metrics_frame
+    close = klines['close'].to_numpy(dtype=np.float64)
+    open_ = klines['open'].to_numpy(dtype=np.float64)
+    sims = [simulate_positions(open_, close, dual_ma_signals(close, s, LONG)[2]) for s in range(2, 12)]
+    balances = np.array([s['balance'] for s in sims])
+    holdings = np.array([s['holding'] for s in sims])
+    return lambda: metrics_frame(balances, holdings, initial_capital=1_000_000)
+
+
+def _setup_cost_scenarios(klines):
+    from costs import FixedTicks, PercentSlippage, score_scenarios
+    close = klines['close'].to_numpy()
+    open_ = klines['open'].to_numpy()
+    sim = simulate_positions(open_, close, dual_ma_signals(close, SHORT, LONG)[2], 1_000_000, 0.2)
+    scenarios = {(ticks, bp): FixedTicks(ticks, 1.0) + PercentSlippage(bp / 10_000)
+                 for ticks in range(6) for bp in range(8)}
+    return lambda: score_scenarios(sim['balance'], sim['holding'], open_, scenarios, initial_capital=1_000_000)
+
+
+def _setup_replay_backtest(klines):
+    from backtest import BARSLAST
+    from event_log import NullSink
+    from replay import ReplayApi
+
+    def run():
+        api = ReplayApi(klines, symbol="BENCH")
+        BARSLAST("BENCH", condition=f"CROSS(MA(C,{SHORT}),MA(C,{LONG}))", short=SHORT, long=LONG,
+                 api=api, sink=NullSink())
+    return run
+
+
+def _setup_replay_strategy(klines):
+    sys.path.insert(0, os.path.join(ROOT_DIR, "test"))
+    from event_log import NullSink
+    from replay import ReplayApi
+    from strategy import run_dual_ma_strategy
+
+    def run():
+        api = ReplayApi(klines, symbol="BENCH")
+        run_dual_ma_strategy(api, "BENCH", SHORT, LONG, 1, 86400, sink=NullSink())
+    return run
+
+
+# (名称, 最大K线数, setup)；最大K线数为 None 表示不限
+CASES = [
+    ('barslast.legacy_scan', 20_000, _setup_legacy_scan),
+    ('barslast.streaming', 1_000_000, _setup_streaming),
+    ('barslast.vector', None, _setup_barslast_vector),
+    ('barslast.test_window', 100_000, _setup_test_window),
+    ('barslast.matrix', None, _setup_barslast_matrix),
+    ('barslast.matrix_stream', 1_000_000, _setup_barslast_matrix_stream),
+    ('ma.tafunc_per_bar', 100_000, _setup_tafunc_per_bar),
+    ('ma.incremental', 1_000_000, _setup_incremental),
+    ('ma.vector', None, _setup_ma_vector),
+    ('cross.strategy_loop', 1_000_000, _setup_strategy_loop),
+    ('cross.expr_stream', 1_000_000, _setup_expr_stream),
+    ('cross.expr_vector', None, _setup_expr_vector),
+    ('engine.vector_backtest', None, _setup_vector_backtest),
+    ('analytics.batch', None, _setup_analytics_batch),
+    ('costs.scenarios', None, _setup_cost_scenarios),
+    ('replay.backtest', 100_000, _setup_replay_backtest),
+    ('replay.dual_ma_strategy', 100_000, _setup_replay_strategy),
+]
+
+
+# 导入耗时基准的模块；除 tqsdk 本身（作为对照）外都不应导入 tqsdk
+IMPORT_MODULES = [
+    'tdxfunc', 'indicators', 'barslast_matrix', 'indicator_cache', 'tdxexpr', 'vector_backtest', 'analytics',
+    'sweep', 'walk_forward', 'robustness', 'replay', 'signal_service', 'backtest', 'portfolio',
+    'barslast', 'strategy', 'data_fetcher', 'tqsdk',
+]
+
+_IMPORT_PROBE = """\
+import json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': len(sys.modules),
+                  'tqsdk': 'tqsdk' in sys.modules, 'pandas': 'pandas' in sys.modules}}))
+"""
+
+
+def _measure_import(module: str, repeat: int) -> dict:
+    """在全新的解释器中导入模块 repeat 次，取最短耗时；导入失败时抛出 ImportError。"""
+    code = _IMPORT_PROBE.format(paths=[ROOT_DIR, os.path.join(ROOT_DIR, "test")], module=module)
+    times, info = [], None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, capture_output=True, text=True)
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            raise ImportError(lines[-1] if lines else f"退出码 {proc.returncode}")
+        info = json.loads(proc.stdout.strip().splitlines()[-1])
+        times.append(info['seconds'])
+    return {'seconds': min(times), 'median_seconds': float(np.median(times)), 'runs': len(times),
+            'modules': info['modules'], 'tqsdk': info['tqsdk'], 'pandas': info['pandas']}
+
+
+def run_import_benchmarks(modules=None, repeat: int = 5) -> dict:
+    """
+    测量模块导入耗时。
+
+    Args:
+        modules (list): 模块名列表，为 None 时使用 IMPORT_MODULES（test 目录下的模块直接用文件名）。
+        repeat (int): 每个模块在新进程中重复导入的次数，取最短耗时。
+
+    Returns:
+        dict: {'meta': 环境信息, 'imports': [每个模块一条], 'skipped': {模块: 原因}}；
+            每条记录包含耗时、导入后的模块总数，以及是否加载了 tqsdk / pandas。
+    """
+    results, skipped = [], {}
+    for module in modules or IMPORT_MODULES:
+        try:
+            measured = _measure_import(module, repeat)
+        except ImportError as e:
+            skipped[module] = str(e)
+            print(f"{module:<18} 跳过（{skipped[module]}）")
+            continue
+        measured['module'] = module
+        results.append(measured)
+        flag = "  <-- 导入了 tqsdk" if measured['tqsdk'] and module != 'tqsdk' else ""
+        print(f"{module:<18} {measured['seconds'] * 1000:9.1f} 毫秒  {measured['modules']:>5} 个模块{flag}")
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'time': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'imports': results,
+        'skipped': skipped,
+    }
+
+
+def compare_imports(current: dict, baseline: dict, threshold: float = 0.2) -> list:
+    """
+    对比两次导入耗时，返回 (模块, 旧耗时, 新耗时, 比值) 列表。
+    比值超过 1 + threshold，或原来不导入 tqsdk 而现在导入了的，视为退化并打印出来。
+    """
+    old = {r['module']: r for r in baseline.get('imports', [])}
+    rows = []
+    for r in current['imports']:
+        before = old.get(r['module'])
+        if not before or not before['seconds']:
+            continue
+        ratio = r['seconds'] / before['seconds']
+        rows.append((r['module'], before['seconds'], r['seconds'], ratio))
+        regressed = ratio > 1 + threshold or (r['tqsdk'] and not before['tqsdk'])
+        flag = "  <-- 退化" if regressed else ""
+        print(f"{r['module']:<18} {before['seconds'] * 1000:9.1f} -> {r['seconds'] * 1000:9.1f} 毫秒  x{ratio:.2f}{flag}")
+    return rows
+
+
+def _measure(setup, klines, repeat: int, memory: bool) -> dict:
+    """运行一个用例：取多次运行的最短耗时，另外在 tracemalloc 下单独运行一次测量峰值内存。"""
+    run = setup(klines)
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        if times[-1] > 5:  # 单次超过 5 秒时不再重复
+            break
+    result = {'seconds': min(times), 'median_seconds': float(np.median(times)), 'runs': len(times)}
+    if memory:
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run()
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def _scaling(points: list) -> float:
+    """耗时对K线数在对数坐标下的斜率。"""
+    if len(points) < 2:
+        return None
+    bars, seconds = np.log([p[0] for p in points]), np.log([max(p[1], 1e-9) for p in points])
+    return float(np.polyfit(bars, seconds, 1)[0])
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, cases=None, repeat: int = 3, memory: bool = True, max_loop_bars: int = None,
+                   seed: int = 0) -> dict:
+    """
+    运行基准测试。
+
+    Args:
+        sizes (list): K线数量列表，例如 [1000, 10000, 100000]。
+        cases (list): 只运行名称以这些前缀开头的用例，为 None 时运行全部。
+        repeat (int): 每个规模重复次数，取最短耗时。
+        memory (bool): 是否测量峰值内存。
+        max_loop_bars (int): 覆盖逐根K线用例的最大K线数。
+        seed (int): 随机种子。
+
+    Returns:
+        dict: {'meta': 环境信息, 'results': [每个用例每个规模一条], 'scaling': {用例: 斜率}, 'skipped': {用例: 原因}}。
+    """
+    selected = [c for c in CASES if not cases or any(c[0].startswith(p) for p in cases)]
+    results, skipped, curves = [], {}, {}
+    for n in sizes:
+        klines = random_walk_klines(n, seed)
+        for name, max_bars, setup in selected:
+            if name in skipped:
+                continue
+            limit = max_loop_bars if (max_loop_bars and max_bars) else max_bars
+            if limit and n > limit:
+                continue
+            try:
+                measured = _measure(setup, klines, repeat, memory)
+            except ImportError as e:
+                skipped[name] = f"缺少依赖: {e.name or e}"
+                print(f"{name:<26} 跳过（{skipped[name]}）")
+                continue
+            measured.update(case=name, bars=n, bars_per_sec=n / measured['seconds'] if measured['seconds'] else None)
+            results.append(measured)
+            curves.setdefault(name, []).append((n, measured['seconds']))
+            peak = f"{measured['peak_mb']:9.1f} MB" if 'peak_mb' in measured else ""
+            print(f"{name:<26} {n:>10,} 根  {measured['seconds']:9.4f} 秒  {measured['bars_per_sec']:>14,.0f} 根/秒{peak}")
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'time': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+        },
+        'results': results,
+        'scaling': {name: _scaling(points) for name, points in curves.items()},
+        'skipped': skipped,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.1) -> list:
+    """
+    对比两次结果的吞吐量，返回 (用例, K线数, 旧吞吐量, 新吞吐量, 比值) 列表。
+    比值低于 1 - threshold 的视为性能退化并打印出来。
+    """
+    old = {(r['case'], r['bars']): r['bars_per_sec'] for r in baseline['results']}
+    rows = []
+    for r in current['results']:
+        before = old.get((r['case'], r['bars']))
+        if not before or not r['bars_per_sec']:
+            continue
+        ratio = r['bars_per_sec'] / before
+        rows.append((r['case'], r['bars'], before, r['bars_per_sec'], ratio))
+        flag = "  <-- 退化" if ratio < 1 - threshold else ""
+        print(f"{r['case']:<26} {r['bars']:>10,} 根  {before:>14,.0f} -> {r['bars_per_sec']:>14,.0f} 根/秒  x{ratio:.2f}{flag}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BARSLAST / 均线 / 交叉判断 / 回放的离线性能基准")
+    parser.add_argument('--sizes', default='1e3,1e4,1e5', help="K线数量，例如 1e3,1e4,1e5,1e6,1e7")
+    parser.add_argument('--cases', default=None, help="只运行指定前缀的用例，例如 barslast,ma.vector")
+    parser.add_argument('--repeat', type=int, default=3, help="每个规模重复次数，取最短耗时")
+    parser.add_argument('--no-memory', action='store_true', help="不测量峰值内存（tracemalloc 会额外运行一次）")
+    parser.add_argument('--max-loop-bars', type=int, default=None, help="覆盖逐根K线用例的最大K线数")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    parser.add_argument('--output', default='benchmark_results.json', help="结果保存路径")
+    parser.add_argument('--compare', default=None, help="与之前保存的 JSON 结果对比")
+    parser.add_argument('--imports', action='store_true', help="改为测量各模块的导入耗时（新进程中导入）")
+    parser.add_argument('--modules', default=None, help="--imports 时只测量这些模块，例如 backtest,replay")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        modules = [x for x in args.modules.split(',') if x] if args.modules else None
+        report = run_import_benchmarks(modules, max(args.repeat, 1))
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"结果已保存到 {args.output}")
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            print(f"\n与 {args.compare}（提交 {baseline['meta'].get('commit')}）对比：")
+            compare_imports(report, baseline)
+        return
+
+    sizes = [int(float(x)) for x in args.sizes.split(',') if x]
+    cases = [x for x in args.cases.split(',') if x] if args.cases else None
+    report = run_benchmarks(sizes, cases, args.repeat, not args.no_memory, args.max_loop_bars, args.seed)
+
+    print("\n耗时随K线数增长的斜率（1 为线性，2 为平方）：")
+    for name, slope in report['scaling'].items():
+        if slope is not None:
+            print(f"  {name:<26} {slope:.2f}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"结果已保存到 {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n与 {args.compare}（提交 {baseline['meta'].get('commit')}）对比：")
+        compare(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# checkpoint.py
+
+"""
+回测检查点（断点续跑）。
+
+backtest.BARSLAST(checkpoint_path=...) 在回放结束时把完整的运行状态写入检查点文件：
+    - 参数（合约、均线周期、投入比例、条件的标识，见 condition_id），恢复时校验是否一致；
+    - 增量指标：IndicatorCache 及其中的均线状态、条件表达式的流式状态、BARSLAST 状态；
+    - 回放驱动（replay.ReplayApi）的时钟位置、账户、持仓、待成交的目标持仓和成交记录；
+    - 已记录的结果（写入文件时只记录行数，文件本身继续追加）。
+下一次用包含新K线的数据调用时，从检查点恢复并只处理检查点之后的K线，
+结果与从头重跑完全一致；每天收盘后更新整个合约池的耗时因此只与新增K线数有关：
+
+    for symbol in universe:
+        api = ReplayApi(store.frame(symbol), symbol=symbol)
+        BARSLAST(symbol, "CROSS(MA(C,12),MA(C,26))", api=api, checkpoint_path=f"ckpt/{symbol}.pkl")
+
+TqApi 回测会话无法从中途的账户和持仓继续，检查点只支持离线回放驱动。
+
+文件格式为 pickle（只应加载自己生成的检查点），写入时先写临时文件再替换，中途失败不会损坏旧检查点。
+"""
+
+import hashlib
+import inspect
+import os
+import pickle
+
+from tdxexpr import CompiledCondition
+
+CHECKPOINT_VERSION = 2
+
+
+def condition_id(condition) -> str:
+    """
+    条件的标识，保存在检查点参数中，恢复时换了条件会被识别出来。
+
+    条件表达式为其规范文本；Python 函数为 "模块.限定名:源码哈希"（取不到源码时用字节码哈希）。
+    布尔 Series 等其它条件无法可靠识别，抛出 ValueError。
+    """
+    if isinstance(condition, CompiledCondition):
+        return condition.text
+    code = getattr(condition, '__code__', None)
+    if code is None:
+        raise ValueError("检查点只支持条件表达式或 Python 函数作为条件，布尔 Series 等条件无法校验是否一致")
+    try:
+        source = inspect.getsource(condition).encode('utf-8')
+    except (OSError, TypeError):
+        source = code.co_code + repr(code.co_consts).encode('utf-8')
+    digest = hashlib.blake2b(source, digest_size=8).hexdigest()
+    return f"{condition.__module__}.{condition.__qualname__}:{digest}"
+
+
+def save_checkpoint(path: str, state: dict):
+    """原子地写入检查点。"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': CHECKPOINT_VERSION, **state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str, params: dict = None) -> dict:
+    """
+    读取检查点。
+
+    Args:
+        path (str): 检查点文件路径。
+        params (dict): 本次运行的参数，与检查点中保存的参数不一致时抛出 ValueError。
+
+    Returns:
+        dict: save_checkpoint 保存的状态。
+    """
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"检查点 {path} 的版本 {state.get('version')} 与当前版本 {CHECKPOINT_VERSION} 不兼容")
+    if params is not None:
+        saved = state.get('params', {})
+        diff = {k: (saved.get(k), v) for k, v in params.items() if saved.get(k) != v}
+        if diff:
+            detail = ", ".join(f"{k}: 检查点 {old!r} / 本次 {new!r}" for k, (old, new) in diff.items())
+            raise ValueError(f"检查点 {path} 的参数与本次运行不一致（{detail}），请删除检查点后重新回测")
+    return state
+
+
+
+if __name__ == "__main__":
+    # 分段续跑的结果应与从头重跑完全一致，包括中途失败的续跑之后再次续跑
+    import tempfile
+
+    import numpy as np
+    import pandas as pd
+
+    from backtest import BARSLAST
+    from event_log import NullSink
+    from replay import ReplayApi
+    from vector_backtest import read_tushare_csv
+
+    csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "000001_SZ_daily_20230101_20231231.csv")
+    klines = read_tushare_csv(csv_path)
+    fail_after = [None]  # 处理到该时间之后抛出异常，模拟续跑中途失败
+
+    def condition(k):
+        if fail_after[0] is not None and k['datetime'].iloc[-1] > fail_after[0]:
+            raise RuntimeError("模拟续跑失败")
+        return k['close'] > 12
+
+    def run(cond, end, **kwargs):
+        api = ReplayApi(klines.iloc[:end], symbol="SZSE.000001", volume_multiple=100)
+        return BARSLAST("SZSE.000001", cond, api=api, sink=NullSink(), **kwargs)
+
+    for cond in (condition, "CROSS(MA(C,5),MA(C,10))"):
+        full = run(cond, len(klines))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, "result.csv")
+            kwargs = {'checkpoint_path': os.path.join(tmp_dir, "ckpt.pkl"), 'output_path': output}
+            run(cond, 100, **kwargs)
+            if cond is condition:
+                # 续跑在第 150 根K线之后失败：不保存检查点，但已经写出了部分行
+                fail_after[0] = ReplayApi(klines.iloc[:151])._clock[-1]
+                run(cond, 200, **kwargs)
+                fail_after[0] = None
+            else:
+                run(cond, 180, **kwargs)
+            run(cond, len(klines), **kwargs)
+            resumed = pd.read_csv(output, parse_dates=['datetime'])
+        assert len(resumed) == len(full) and not resumed['datetime'].duplicated().any(), len(resumed)
+        assert np.allclose(resumed['balance'], full['balance'])
+        assert (resumed['barslast'].to_numpy() == full['barslast'].to_numpy()).all()
+        assert (resumed['position'].to_numpy() == full['position'].to_numpy()).all()
+    print(f"检查点续跑与从头重跑一致：{len(full)} 根K线（含一次中途失败的续跑）")
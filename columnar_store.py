@@ -0,0 +1,270 @@
+# columnar_store.py
+
+"""
+Tushare 日线 CSV 的批量导入和内存映射列式存储。
+
+导入：多进程并行解析大量 Tushare 格式的 CSV（ts_code,trade_date,open,...,vol,amount，
+带 BOM，日期为 yyyymmdd），合并后按 (合约, 日期) 排序，每列保存为一个 .npy 文件：
+    - trade_date 保存为 int32（yyyymmdd）；
+    - 价格等浮点列在 float32 能无损还原原始小数位时保存为 float32，否则保留 float64；
+    - 合约代码保存在 meta.json 中，每个合约对应一段连续的行 [start, end)。
+
+读取：各列以 mmap 方式打开，某个合约的任意日期区间通过二分查找定位，
+返回的是内存映射数组的切片（零拷贝，O(log n)），可直接交给向量化回测引擎。
+
+    python columnar_store.py data/*.csv --store daily_store --workers 8
+    python columnar_store.py          # 不带参数：用 test/ 下的示例 CSV 自检
+
+    store = ColumnarStore("daily_store")
+    cols = store.slice("000001.SZ", 20230101, 20231231)   # {列名: np.ndarray 视图}
+    df = store.frame("000001.SZ", "2023-01-01", "2023-12-31")
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+TUSHARE_COLUMNS = ['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg',
+                   'vol', 'amount']
+META_FILE = "meta.json"
+MAX_DECIMALS = 4  # 判断 float32 是否无损时考虑的最多小数位
+
+
+def _read_batch(paths) -> dict:
+    """工作进程：解析一批 CSV，返回按列拼接的数组。"""
+    frames = []
+    for path in paths:
+        df = pd.read_csv(path, encoding='utf-8-sig', dtype={'ts_code': str, 'trade_date': np.int32})
+        missing = [c for c in ('ts_code', 'trade_date', 'close') if c not in df.columns]
+        if missing:
+            raise ValueError(f"{path} 缺少列: {missing}")
+        frames.append(df)
+    if not frames:
+        return {}
+    df = pd.concat(frames, ignore_index=True)
+    result = {'ts_code': df['ts_code'].to_numpy(dtype=object), 'trade_date': df['trade_date'].to_numpy()}
+    for name in df.columns:
+        if name not in result:
+            result[name] = df[name].to_numpy(dtype=np.float64)
+    return result
+
+
+def _decimals(values: np.ndarray):
+    """原始数据的小数位数（不超过 MAX_DECIMALS），无法确定时返回 None。"""
+    finite = values[np.isfinite(values)]
+    for d in range(MAX_DECIMALS + 1):
+        if np.array_equal(np.round(finite, d), finite):
+            return d
+    return None
+
+
+def _downcast(values: np.ndarray):
+    """float32 四舍五入到原始小数位后能还原原值时使用 float32，返回 (数组, 小数位)。"""
+    d = _decimals(values)
+    if d is not None:
+        narrowed = values.astype(np.float32)
+        finite = np.isfinite(values)
+        if np.array_equal(np.round(narrowed[finite].astype(np.float64), d), values[finite]):
+            return narrowed, d
+    return values, d
+
+
+def _to_yyyymmdd(value) -> int:
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, date):
+        return value.year * 10000 + value.month * 100 + value.day
+    return int(str(value).replace('-', ''))
+
+
+def ingest_tushare_csvs(paths, store_dir: str, workers: int = None, batch_size: int = 64) -> dict:
+    """
+    并行导入 Tushare 日线 CSV，生成（覆盖）列式存储。
+
+    同一合约同一日期出现多次时保留后出现的文件中的数据。只有表头的 CSV 是合法输入，
+    全部文件都没有数据行时生成一个 0 行的空存储。
+
+    Args:
+        paths (list): CSV 文件路径列表。
+        store_dir (str): 存储目录。
+        workers (int): 进程数，默认使用全部 CPU；为 1 时在当前进程内解析。
+        batch_size (int): 每个任务解析的文件数。
+
+    Returns:
+        dict: 存储的元数据（同 meta.json）。
+    """
+    paths = list(paths)
+    if not paths:
+        raise ValueError("没有需要导入的文件")
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    workers = min(workers or os.cpu_count() or 1, len(batches))
+    if workers == 1:
+        parts = [_read_batch(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_read_batch, batches))
+    parts = [p for p in parts if p]
+    if not parts:
+        raise ValueError("没有可以导入的 CSV 文件")
+    columns = [c for c in parts[0] if all(c in p for p in parts)]
+    data = {c: np.concatenate([p[c] for p in parts]) for c in columns}
+
+    # 按 (合约, 日期) 排序；重复的 (合约, 日期) 保留最后出现的一行
+    symbols, codes = np.unique(data.pop('ts_code'), return_inverse=True)
+    order = np.lexsort((np.arange(len(codes)), data['trade_date'], codes))
+    codes = codes[order]
+    data = {c: v[order] for c, v in data.items()}
+    if len(codes):
+        keep = np.r_[(codes[1:] != codes[:-1]) | (data['trade_date'][1:] != data['trade_date'][:-1]), True]
+        codes = codes[keep]
+        data = {c: v[keep] for c, v in data.items()}
+
+    os.makedirs(store_dir, exist_ok=True)
+    meta = {'rows': int(len(codes)), 'columns': {}, 'decimals': {}, 'symbols': {}}
+    for name, values in data.items():
+        if name != 'trade_date':
+            values, d = _downcast(values)
+            meta['decimals'][name] = d
+        np.save(os.path.join(store_dir, f"{name}.npy"), values)
+        meta['columns'][name] = str(values.dtype)
+    bounds = np.searchsorted(codes, np.arange(len(symbols) + 1))
+    for i, symbol in enumerate(symbols):
+        meta['symbols'][str(symbol)] = [int(bounds[i]), int(bounds[i + 1])]
+
+    tmp_path = os.path.join(store_dir, META_FILE + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(store_dir, META_FILE))
+    return meta
+
+
+class ColumnarStore:
+    """
+    只读的内存映射列式日线存储。
+
+    Args:
+        store_dir (str): ingest_tushare_csvs 生成的存储目录。
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.columns = {name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode='r')
+                        for name in self.meta['columns']}
+
+    @property
+    def symbols(self) -> list:
+        return list(self.meta['symbols'])
+
+    def __len__(self) -> int:
+        return self.meta['rows']
+
+    def _bounds(self, symbol: str, start=None, end=None) -> tuple:
+        try:
+            lo, hi = self.meta['symbols'][symbol]
+        except KeyError:
+            raise KeyError(f"存储中没有合约 {symbol}") from None
+        dates = self.columns['trade_date'][lo:hi]
+        start, end = _to_yyyymmdd(start), _to_yyyymmdd(end)
+        first = lo + (int(np.searchsorted(dates, start, side='left')) if start is not None else 0)
+        last = lo + (int(np.searchsorted(dates, end, side='right')) if end is not None else hi - lo)
+        return first, last
+
+    def slice(self, symbol: str, start=None, end=None, columns=None) -> dict:
+        """
+        返回某个合约在 [start, end] 日期区间内的各列（内存映射数组的切片，不复制）。
+
+        Args:
+            symbol (str): 合约代码，例如 "000001.SZ"。
+            start, end: 日期，yyyymmdd 整数、'YYYY-MM-DD' 字符串或 date，为 None 表示不限。
+            columns (list): 需要的列，默认全部。
+
+        Returns:
+            dict: {列名: np.ndarray}。
+        """
+        first, last = self._bounds(symbol, start, end)
+        names = columns or list(self.columns)
+        return {name: self.columns[name][first:last] for name in names}
+
+    def frame(self, symbol: str, start=None, end=None, columns=None) -> pd.DataFrame:
+        """以 DataFrame 形式返回 slice 的结果（带 trade_date 列，可直接传给 vector_backtest）。"""
+        return pd.DataFrame(self.slice(symbol, start, end, columns), copy=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入 Tushare 日线 CSV 为内存映射列式存储")
+    parser.add_argument('paths', nargs='+', help="CSV 文件、目录或通配符")
+    parser.add_argument('--store', default='daily_store', help="存储目录")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认使用全部 CPU")
+    parser.add_argument('--batch-size', type=int, default=64, help="每个任务解析的文件数")
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.csv"))))
+        else:
+            files.extend(sorted(glob.glob(path)))
+    start = time.perf_counter()
+    meta = ingest_tushare_csvs(files, args.store, args.workers, args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"已导入 {len(files)} 个文件，{len(meta['symbols'])} 个合约，{meta['rows']} 行，耗时 {elapsed:.2f} 秒")
+    print("列类型: " + ", ".join(f"{k}={v}" for k, v in meta['columns'].items()))
+    print(f"存储目录: {args.store}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main()
+    else:
+        # 不带参数时运行自检：导入示例 CSV，读回的数据应与 pd.read_csv 一致
+        import tempfile
+
+        sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "000001_SZ_daily_20230101_20231231.csv")
+        expected = pd.read_csv(sample, encoding='utf-8-sig').sort_values('trade_date', ignore_index=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # 只有表头的 CSV 是合法输入；全部为空时生成空存储
+            empty_csv = os.path.join(tmp_dir, "empty.csv")
+            with open(empty_csv, 'w', encoding='utf-8') as f:
+                f.write(",".join(TUSHARE_COLUMNS) + "\n")
+            assert ingest_tushare_csvs([empty_csv], os.path.join(tmp_dir, "empty"), workers=1)['rows'] == 0
+            assert ColumnarStore(os.path.join(tmp_dir, "empty")).symbols == []
+
+            # 后出现的文件覆盖同一合约同一日期的数据
+            changed = expected.iloc[[10]].copy()
+            changed['close'] = 99.99
+            changed_csv = os.path.join(tmp_dir, "changed.csv")
+            changed.to_csv(changed_csv, index=False)
+            store_dir = os.path.join(tmp_dir, "store")
+            meta = ingest_tushare_csvs([sample, empty_csv, changed_csv], store_dir, workers=2, batch_size=1)
+            expected.loc[10, 'close'] = 99.99
+
+            store = ColumnarStore(store_dir)
+            assert store.symbols == ["000001.SZ"] and len(store) == len(expected)
+            cols = store.slice("000001.SZ")
+            assert np.array_equal(cols['trade_date'], expected['trade_date'])
+            for name, dtype in meta['columns'].items():
+                if name == 'trade_date':
+                    continue
+                # 降为 float32 的列四舍五入到原始小数位后应与原值完全相同
+                restored = np.asarray(cols[name], dtype=np.float64)
+                if dtype == 'float32':
+                    restored = np.round(restored, meta['decimals'][name])
+                assert np.array_equal(restored, expected[name].to_numpy(dtype=np.float64)), name
+
+            part = store.slice("000001.SZ", "2023-03-01", 20230331)
+            mask = (expected['trade_date'] >= 20230301) & (expected['trade_date'] <= 20230331)
+            assert np.array_equal(part['trade_date'], expected.loc[mask, 'trade_date'])
+            assert len(store.frame("000001.SZ", date(2023, 12, 1))) == (expected['trade_date'] >= 20231201).sum()
+        print("列式存储自检通过，列类型: " + ", ".join(f"{k}={v}" for k, v in meta['columns'].items()))
@@ -0,0 +1,329 @@
+# costs.py
+
+"""
+事后计入的滑点和手续费模型（向量化）。
+
+TqSdk 回测无法设置滑点，BARSLAST() / run_vector_backtest() 的权益都不含交易成本。
+这里不重新回测，而是对一次信号运行得到的持仓和成交价数组做向量变换：
+每根K线的成交手数 = |持仓变化|，成本按模型计算后累加，从权益中扣除。
+几十种成本假设可以在毫秒级内全部打分，用来检验策略对成本的敏感程度。
+
+    FixedTicks(ticks, tick_size)        固定跳数滑点
+    PercentSlippage(rate)               按成交价的比例滑点
+    VolumeSlippage(coefficient, ...)    随成交量占K线成交量比例增大的滑点（冲击成本）
+    CommissionTable(table)              按合约乘数查表的手续费（每手固定 + 按成交额比例）
+模型之间可以用 + 组合。
+
+    scenarios = {
+        "无成本": None,
+        "1跳+手续费": FixedTicks(1, 1.0) + CommissionTable({10: (1.5, 0)}),
+        "万五": PercentSlippage(0.0005),
+    }
+    table = score_result(run_vector_backtest(klines, volume_multiple=10, detail=True), scenarios,
+                         volume_multiple=10, initial_capital=1_000_000)
+
+手数按不含成本的权益计算（成本不反馈到下单手数），成本相对权益较小时与逐K线扣除成本的回测差异可以忽略。
+"""
+
+import numpy as np
+import pandas as pd
+
+from analytics import PERIODS_PER_YEAR, holding_from_result, metrics_frame
+
+
+class CostModel:
+    """
+    成本模型的基类。子类实现 cost(volume, price, volume_multiple, bar_volume)，
+    返回与 volume 同形状的成本（元）；volume 为每根K线成交的手数（绝对值，无成交为 0）。
+    """
+
+    def cost(self, volume: np.ndarray, price: np.ndarray, volume_multiple, bar_volume) -> np.ndarray:
+        raise NotImplementedError
+
+    def __add__(self, other: 'CostModel') -> 'CompositeCost':
+        return CompositeCost([self, other])
+
+
+class CompositeCost(CostModel):
+    """多个成本模型之和。"""
+
+    def __init__(self, models):
+        self.models = []
+        for m in models:
+            self.models.extend(m.models if isinstance(m, CompositeCost) else [m])
+
+    def cost(self, volume, price, volume_multiple, bar_volume):
+        total = np.zeros(volume.shape)
+        for m in self.models:
+            total += m.cost(volume, price, volume_multiple, bar_volume)
+        return total
+
+    def __repr__(self):
+        return " + ".join(repr(m) for m in self.models)
+
+
+class FixedTicks(CostModel):
+    """
+    固定跳数滑点：每手成本 = ticks * tick_size * 合约乘数。
+
+    Args:
+        ticks (float): 每次成交滑点的跳数。
+        tick_size (float): 最小变动价位。
+    """
+
+    def __init__(self, ticks: float, tick_size: float):
+        self.ticks = ticks
+        self.tick_size = tick_size
+
+    def cost(self, volume, price, volume_multiple, bar_volume):
+        return volume * (self.ticks * self.tick_size) * volume_multiple
+
+    def __repr__(self):
+        return f"FixedTicks({self.ticks}, {self.tick_size})"
+
+
+class PercentSlippage(CostModel):
+    """
+    按成交价比例的滑点：成本 = 成交额 * rate。
+
+    Args:
+        rate (float): 滑点比例，例如 0.0005 表示万分之五。
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+
+    def cost(self, volume, price, volume_multiple, bar_volume):
+        return volume * price * volume_multiple * self.rate
+
+    def __repr__(self):
+        return f"PercentSlippage({self.rate})"
+
+
+class VolumeSlippage(CostModel):
+    """
+    随成交量变化的滑点（平方根冲击模型）：滑点比例 = coefficient * (成交手数 / K线成交量) ** exponent，
+    再加上固定比例 base_rate，成本 = 成交额 * 滑点比例。
+
+    Args:
+        coefficient (float): 冲击系数。
+        exponent (float): 参与率的指数，0.5 为常用的平方根模型。
+        base_rate (float): 与成交量无关的基础滑点比例。
+        max_rate (float): 滑点比例上限；K线成交量缺失或为 0 时按上限计算。
+
+    K线成交量（bar_volume）与持仓的单位相同（手）。
+    """
+
+    def __init__(self, coefficient: float, exponent: float = 0.5, base_rate: float = 0.0, max_rate: float = 0.01):
+        self.coefficient = coefficient
+        self.exponent = exponent
+        self.base_rate = base_rate
+        self.max_rate = max_rate
+
+    def cost(self, volume, price, volume_multiple, bar_volume):
+        if bar_volume is None:
+            raise ValueError("VolumeSlippage 需要K线成交量（bar_volume）")
+        bar_volume = np.broadcast_to(np.asarray(bar_volume, dtype=np.float64), volume.shape)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            participation = volume / bar_volume
+            rate = self.base_rate + self.coefficient * np.power(participation, self.exponent)
+        rate = np.where(np.isfinite(rate), np.minimum(rate, self.max_rate), self.max_rate)
+        return np.where(volume > 0, volume * price * volume_multiple * rate, 0.0)
+
+    def __repr__(self):
+        return f"VolumeSlippage({self.coefficient}, exponent={self.exponent}, base_rate={self.base_rate})"
+
+
+class CommissionTable(CostModel):
+    """
+    按合约乘数查表的手续费：每手成本 = per_lot + 成交额 / 手数 * rate。
+
+    Args:
+        table (dict): {合约乘数: (每手固定手续费, 成交额比例)}，例如 {10: (1.5, 0), 300: (0, 0.000023)}。
+        default (tuple): 表中没有该合约乘数时使用的 (per_lot, rate)；为 None 时抛出 KeyError。
+    """
+
+    def __init__(self, table: dict, default: tuple = None):
+        self.table = {float(k): tuple(v) for k, v in table.items()}
+        self.default = tuple(default) if default is not None else None
+
+    def _lookup(self, multiple: float) -> tuple:
+        fee = self.table.get(float(multiple), self.default)
+        if fee is None:
+            raise KeyError(f"手续费表中没有合约乘数 {multiple}")
+        return fee
+
+    def cost(self, volume, price, volume_multiple, bar_volume):
+        mult = np.asarray(volume_multiple, dtype=np.float64)
+        if mult.ndim == 0:
+            per_lot, rate = self._lookup(mult.item())
+        else:
+            # 每行一个合约乘数：对不同的乘数各查一次表
+            values, inverse = np.unique(mult, return_inverse=True)
+            fees = np.array([self._lookup(v) for v in values])
+            per_lot, rate = fees[inverse, 0].reshape(mult.shape), fees[inverse, 1].reshape(mult.shape)
+        return volume * (per_lot + price * mult * rate)
+
+    def __repr__(self):
+        return f"CommissionTable({self.table})"
+
+
+def _row_multiple(volume_multiple, ndim: int):
+    """二维输入时把按行的合约乘数变为列向量，以便沿K线方向广播。"""
+    mult = np.asarray(volume_multiple, dtype=np.float64)
+    if mult.ndim == 1 and ndim == 2:
+        return mult[:, np.newaxis]
+    return mult
+
+
+def traded_volume(holding) -> np.ndarray:
+    """每根K线成交的手数（持仓变化的绝对值，第一根K线相对空仓），一维或二维（沿最后一个维度）。"""
+    h = np.nan_to_num(np.asarray(holding, dtype=np.float64))
+    return np.abs(np.diff(h, axis=-1, prepend=0.0))
+
+
+def trade_costs(holding, price, model: CostModel, volume_multiple=1, bar_volume=None) -> np.ndarray:
+    """
+    每根K线的交易成本。
+
+    Args:
+        holding: 每根K线开盘成交后的持仓（手），一维或二维（回测次数 × K线数）。
+        price: 成交价（下一根K线开盘成交时为开盘价），形状与 holding 相同。
+        model (CostModel): 成本模型，为 None 时成本为 0。
+        volume_multiple: 合约乘数，标量；二维输入时也可以是每行一个的数组。
+        bar_volume: K线成交量，VolumeSlippage 需要。
+
+    Returns:
+        np.ndarray: 与 holding 同形状的成本（元）。
+    """
+    volume = traded_volume(holding)
+    if model is None:
+        return np.zeros(volume.shape)
+    price = np.broadcast_to(np.asarray(price, dtype=np.float64), volume.shape)
+    cost = model.cost(volume, price, _row_multiple(volume_multiple, volume.ndim), bar_volume)
+    return np.where(volume > 0, np.nan_to_num(cost), 0.0)
+
+
+def apply_costs(balance, holding, price, model: CostModel, volume_multiple=1, bar_volume=None) -> np.ndarray:
+    """扣除累计交易成本后的权益（形状与 balance 相同）。"""
+    costs = trade_costs(holding, price, model, volume_multiple, bar_volume)
+    return np.asarray(balance, dtype=np.float64) - np.cumsum(costs, axis=-1)
+
+
+def score_scenarios(balance, holding, price, scenarios: dict, volume_multiple=1, bar_volume=None,
+                    initial_capital: float = None, periods_per_year: float = PERIODS_PER_YEAR) -> pd.DataFrame:
+    """
+    对同一次信号运行的多种成本假设打分。
+
+    各场景扣除成本后的权益排成 (场景数 × K线数) 的矩阵，由 analytics.metrics_frame 一次算出全部指标。
+
+    Args:
+        balance: 不含成本的权益，一维。
+        holding: 每根K线的持仓，一维。
+        price: 成交价，一维。
+        scenarios (dict): {场景名称: CostModel 或 None}。名称全部为元组时结果使用 MultiIndex。
+        volume_multiple (float): 合约乘数。
+        bar_volume: K线成交量，VolumeSlippage 需要。
+        initial_capital (float): 初始本金。
+        periods_per_year (float): 每年的K线数。
+
+    Returns:
+        pd.DataFrame: 每个场景一行，索引为场景名称，列为 total_cost（累计成本）、cost_ratio（累计成本 / 初始权益）
+            以及 analytics 的权益和持仓指标。
+    """
+    balance = np.asarray(balance, dtype=np.float64)
+    holding = np.nan_to_num(np.asarray(holding, dtype=np.float64))
+    if balance.ndim != 1:
+        raise ValueError("score_scenarios 只接受一次回测（一维）的结果")
+    price = np.asarray(price, dtype=np.float64)
+    volume = traded_volume(holding)
+    traded = volume > 0
+    costs = np.zeros((len(scenarios), len(balance)))
+    for i, model in enumerate(scenarios.values()):
+        if model is not None:
+            costs[i, traded] = np.nan_to_num(
+                model.cost(volume[traded], price[traded], volume_multiple,
+                           None if bar_volume is None else np.asarray(bar_volume, dtype=np.float64)[traded]))
+    net = balance - np.cumsum(costs, axis=1)
+    frame = metrics_frame(net, np.broadcast_to(holding, net.shape), initial_capital, periods_per_year)
+    total_cost = costs.sum(axis=1)
+    base = initial_capital if initial_capital is not None else balance[0]
+    frame.insert(0, 'cost_ratio', total_cost / base)
+    frame.insert(0, 'total_cost', total_cost)
+    keys = list(scenarios)
+    if all(isinstance(key, tuple) for key in keys):
+        frame.index = pd.MultiIndex.from_tuples(keys)  # 参数网格（例如 (滑点跳数, 百分比)）
+    else:
+        frame.index = pd.Index(keys, name='scenario')
+    return frame
+
+
+def score_result(result: pd.DataFrame, scenarios: dict, volume_multiple=1, initial_capital: float = None,
+                 periods_per_year: float = PERIODS_PER_YEAR) -> pd.DataFrame:
+    """
+    对 BARSLAST() / run_vector_backtest() 的结果打分，见 score_scenarios。
+
+    持仓优先取 holding 列，否则由 trade 列还原；成交价优先取 open 列（run_vector_backtest(detail=True)），
+    BARSLAST() 的结果没有开盘价时用成交K线的收盘价近似。成交量取 volume 列（如果有）。
+    """
+    holding = holding_from_result(result)
+    price = result['open'] if 'open' in result.columns else result['price']
+    bar_volume = result['volume'].to_numpy(dtype=np.float64) if 'volume' in result.columns else None
+    return score_scenarios(result['balance'].to_numpy(dtype=np.float64), holding, price.to_numpy(dtype=np.float64),
+                           scenarios, volume_multiple, bar_volume, initial_capital, periods_per_year)
+
+
+if __name__ == "__main__":
+    # 与逐K线扣除成本的循环比对，并测试几十种成本场景的打分耗时
+    import os
+    import time
+
+    from vector_backtest import (dual_ma_signals, random_walk_klines, read_tushare_csv, run_vector_backtest,
+                                 simulate_positions_batch)
+
+    csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "000001_SZ_daily_20230101_20231231.csv")
+    result = run_vector_backtest(read_tushare_csv(csv_path), volume_multiple=100, detail=True)
+    scenarios = {
+        "无成本": None,
+        "1跳": FixedTicks(1, 0.01),
+        "万五滑点": PercentSlippage(0.0005),
+        "万五滑点+每手5元": PercentSlippage(0.0005) + CommissionTable({100: (5.0, 0.0)}),
+        "冲击成本": VolumeSlippage(0.1, base_rate=0.0002),
+    }
+    result['volume'] = read_tushare_csv(csv_path)['vol'].to_numpy() / 100  # 成交量（手）
+    table = score_result(result, scenarios, volume_multiple=100, initial_capital=1_000_000)
+    print("000001.SZ 日线双均线，不同成本假设：")
+    print(table[['total_cost', 'cost_ratio', 'total_return', 'sharpe', 'max_drawdown']].to_string())
+
+    # 逐笔核对：每次持仓变化按 |变化| 手计成本
+    holding, open_ = result['holding'].to_numpy(), result['open'].to_numpy()
+    expected = 0.0
+    for t in range(len(holding)):
+        change = abs(holding[t] - (holding[t - 1] if t else 0))
+        expected += change * open_[t] * 100 * 0.0005 + change * 5.0
+    assert np.isclose(table.loc["万五滑点+每手5元", 'total_cost'], expected)
+    assert table.loc["无成本", 'total_cost'] == 0
+    assert np.isclose(table.loc["无成本", 'total_return'], result['balance'].iloc[-1] / 1_000_000 - 1)
+    net = apply_costs(result['balance'], holding, open_, FixedTicks(1, 0.01), volume_multiple=100)
+    assert np.isclose(net[-1], result['balance'].iloc[-1] - table.loc["1跳", 'total_cost'])
+
+    # 二维：一批回测、每行一个合约乘数
+    klines = random_walk_klines(500)
+    o, c = klines['open'].to_numpy(), klines['close'].to_numpy()
+    signals = np.array([dual_ma_signals(c, s, 26)[2] for s in (5, 8, 12)])
+    batch = simulate_positions_batch(np.tile(o, (3, 1)), np.tile(c, (3, 1)), signals, volume_multiple=10)
+    table2 = CommissionTable({10: (2.0, 0.0), 300: (0.0, 0.000023)})
+    costs = trade_costs(batch['holding'], np.tile(o, (3, 1)), table2, volume_multiple=np.array([10, 10, 300]))
+    assert np.isclose(costs[0].sum(), traded_volume(batch['holding'][0]).sum() * 2.0)
+    assert np.isclose(costs[2].sum(), (traded_volume(batch['holding'][2]) * o * 300 * 0.000023).sum())
+
+    # 48 种成本场景一次打分（约 20 年日线）
+    many = {f"{ticks}跳+万{bp}": FixedTicks(ticks, 1.0) + PercentSlippage(bp / 10_000)
+            for ticks in range(6) for bp in range(8)}
+    long_result = run_vector_backtest(random_walk_klines(5_000), volume_multiple=10, detail=True)
+    start = time.perf_counter()
+    scored = score_result(long_result, many, volume_multiple=10, initial_capital=1_000_000)
+    elapsed = time.perf_counter() - start
+    assert scored.loc["0跳+万0", 'total_cost'] == 0
+    assert (np.diff(scored['total_cost'].to_numpy().reshape(6, 8), axis=0) > 0).all()
+    print(f"{len(many)} 种成本场景 x {len(long_result):,} 根K线，打分耗时 {elapsed * 1000:.1f} 毫秒")
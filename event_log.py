@@ -0,0 +1,225 @@
+# event_log.py
+
+"""
+回测主循环使用的结构化事件日志。
+
+策略循环只把原始字段交给 EventSink（不做任何字符串格式化），
+格式化和输出在后台线程中完成，可同时输出到控制台、JSONL 文件或内存（便于测试）。
+
+事件类型：
+    bar：每根K线的摘要，级别 DEBUG，可按每 N 根K线采样；
+    signal：交易信号，级别 INFO；
+    fill：成交（持仓变化），级别 INFO。
+
+    sink = EventSink([ConsoleWriter(), JsonlWriter("events.jsonl")], sample_every=100)
+    sink.bar("时间: {datetime}, 价格: {price:.2f}", datetime=dt, price=price)
+    sink.close()
+
+静默模式使用 NullSink，所有方法都是空操作，没有格式化开销。
+"""
+
+import json
+import math
+import queue
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+SILENT = 100
+
+
+def _convert_datetime(value, tz):
+    """把纳秒时间戳转换为 pd.Timestamp（tz 不为空时先按 UTC 解释再转换时区）。"""
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        if tz:
+            return pd.Timestamp(int(value), unit='ns', tz='UTC').tz_convert(tz)
+        return pd.Timestamp(int(value), unit='ns')
+    return value
+
+
+class ConsoleWriter:
+    """输出到控制台：有模板时按模板格式化，否则输出 "[类型] 字段: 值, ..."。"""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, record: dict):
+        template = record.get('template')
+        fields = {k: v for k, v in record.items() if k not in ('kind', 'level', 'template')}
+        if template:
+            text = template.format(**fields)
+        else:
+            text = f"[{record['kind']}] " + ", ".join(
+                f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}" for k, v in fields.items())
+        print(text, file=self.stream or sys.stdout)
+
+    def flush(self):
+        (self.stream or sys.stdout).flush()
+
+    def close(self):
+        self.flush()
+
+
+def _json_value(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class JsonlWriter:
+    """每个事件写一行 JSON（不含模板）。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, record: dict):
+        data = {k: _json_value(v) for k, v in record.items() if k != 'template'}
+        self._file.write(json.dumps(data, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class MemoryWriter:
+    """把事件保存在内存列表中，主要用于测试。"""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record: dict):
+        self.records.append(record)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_STOP = object()
+
+
+class EventSink:
+    """
+    带级别和采样的事件输出。
+
+    Args:
+        writers (list): 输出目标，默认为 [ConsoleWriter()]。
+        level (int): 最低输出级别，低于该级别的事件直接丢弃。
+        sample_every (int): bar 事件每隔多少根K线输出一次。
+        background (bool): 为 True 时在后台线程中格式化和输出。
+        tz (str): 纳秒时间戳字段 datetime 的显示时区，为 None 时不转换时区。
+    """
+
+    def __init__(self, writers=None, level: int = DEBUG, sample_every: int = 1, background: bool = True, tz: str = None):
+        self.writers = writers if writers is not None else [ConsoleWriter()]
+        self.level = level
+        self.sample_every = max(1, sample_every)
+        self.tz = tz
+        self._bar_count = 0
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._run, name="EventSink", daemon=True)
+            self._thread.start()
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def emit(self, kind: str, level: int, template: str = None, **fields):
+        """输出一个事件。fields 保持原始值，格式化推迟到输出时进行。"""
+        if level < self.level:
+            return
+        record = {'kind': kind, 'level': level, 'template': template}
+        record.update(fields)
+        if self._queue is not None:
+            self._queue.put(record)
+        else:
+            self._write(record)
+
+    def bar(self, template: str = None, **fields):
+        """K线摘要事件（DEBUG），按 sample_every 采样。"""
+        if DEBUG < self.level:
+            return
+        self._bar_count += 1
+        if (self._bar_count - 1) % self.sample_every:
+            return
+        self.emit('bar', DEBUG, template, **fields)
+
+    def signal(self, template: str = None, **fields):
+        self.emit('signal', INFO, template, **fields)
+
+    def fill(self, template: str = None, **fields):
+        self.emit('fill', INFO, template, **fields)
+
+    def _write(self, record: dict):
+        if 'datetime' in record:
+            record['datetime'] = _convert_datetime(record['datetime'], self.tz)
+        for writer in self.writers:
+            writer.write(record)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                break
+            if isinstance(record, threading.Event):
+                for writer in self.writers:
+                    writer.flush()
+                record.set()
+                continue
+            try:
+                self._write(record)
+            except Exception as e:
+                print(f"日志输出失败: {e}", file=sys.stderr)
+
+    def flush(self):
+        """等待后台线程输出完已提交的事件。"""
+        if self._queue is not None and self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+        else:
+            for writer in self.writers:
+                writer.flush()
+
+    def close(self):
+        """输出剩余事件并关闭所有输出目标。"""
+        if self._queue is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        for writer in self.writers:
+            writer.close()
+
+
+class NullSink(EventSink):
+    """静默模式：不输出任何事件，也没有格式化开销。"""
+
+    def __init__(self):
+        super().__init__(writers=[], level=SILENT, background=False)
+
+    def emit(self, kind, level, template=None, **fields):
+        pass
+
+    def bar(self, template=None, **fields):
+        pass
+
+    def signal(self, template=None, **fields):
+        pass
+
+    def fill(self, template=None, **fields):
+        pass
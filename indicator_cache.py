@@ -0,0 +1,284 @@
+# indicator_cache.py
+
+"""
+策略与条件共享的指标缓存。
+
+同一根K线里，策略本身和多个条件往往引用同一个指标（例如 MA(C,12)、MA(C,26)）。
+IndicatorCache 以 (数据源, 指标, 参数, K线序号) 为键缓存计算结果，
+每个不同的指标每根K线只计算一次，其余引用直接命中缓存。
+
+两种用法：
+    增量：cache.indicator("close", "MA", 12) 返回与 indicators.SMA 接口相同的视图
+        （append / update / extend / next_bar / value / prev），同一数据源和参数的所有视图
+        共用一个增量指标，每根K线按输入值只计算一次；
+        tdxexpr 的 ConditionStream 传入 cache 后，表达式里的 MA/EMA 节点也使用这些视图。
+    整窗：cache.series(klines, "MA", 12) 对K线窗口计算整列指标（tdxfunc），
+        以窗口最后一根K线的时间为键，供布尔条件函数使用。
+
+    cache = IndicatorCache()
+    short_ma = cache.indicator("close", "MA", 12)
+    cond = compile_condition("CROSS(MA(C,12),MA(C,26))").stream(cache=cache)
+
+增量指标每根K线的结果由共享指标自己保存，直到它的所有视图都已越过这根K线才丢弃，
+因此落后的视图（例如后创建、正在预热的条件）总能读到结果，不受 LRU 淘汰影响；
+共享指标已经丢弃了早期结果后才创建的视图改用独立的增量指标（结果相同，只是不再共享）。
+整窗结果保存在容量为 maxsize 的 LRU 中。hits / misses / evictions 记录命中情况。
+"""
+
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+import tdxfunc
+from indicators import EMA, SMA, WMA, _next_bars
+
+INCREMENTAL_INDICATORS = {'MA': SMA, 'SMA': SMA, 'EMA': EMA, 'WMA': WMA}
+SERIES_INDICATORS = {'MA': tdxfunc.MA, 'EMA': tdxfunc.EMA, 'REF': tdxfunc.REF}
+
+
+def _same(a: float, b: float) -> bool:
+    return a == b or (a != a and b != b)
+
+
+class _SharedIndicator:
+    """
+    被多个视图共享的增量指标，记录已推进到的K线序号，并保存第 base 根K线之后每根K线的
+    (输入, 结果)，供落后的视图读取；所有视图都越过的部分定期丢弃。
+    """
+
+    def __init__(self, cache, key: tuple, indicator):
+        self.cache = cache
+        self.key = key
+        self.indicator = indicator
+        self.bar = -1
+        self.input = math.nan
+        self.views = []
+        self.base = 0  # inputs / values 中第一项对应的K线序号
+        self.inputs = []
+        self.values = []
+        self._trim_at = 256
+
+    def at(self, bar: int, x: float) -> float:
+        """返回第 bar 根K线、输入为 x 时的指标值，已计算过则直接命中缓存。"""
+        cache = self.cache
+        x = float(x)
+        if bar == self.bar:
+            if _same(x, self.input):
+                cache.hits += 1
+                return self.indicator.value
+            value = self.indicator.update(x)
+            self.inputs[-1] = x
+            self.values[-1] = value
+        elif bar == self.bar + 1:
+            value = self.indicator.append(x)
+            self.inputs.append(x)
+            self.values.append(value)
+            if len(self.inputs) >= self._trim_at:
+                self._trim()
+        elif bar < self.bar:
+            i = bar - self.base
+            if i < 0 or not _same(self.inputs[i], x):
+                raise ValueError(f"指标 {self.key} 已推进到第 {self.bar} 根K线，不能修改第 {bar} 根K线")
+            cache.hits += 1
+            return self.values[i]
+        else:
+            raise ValueError(f"指标 {self.key} 跳过了K线：当前第 {self.bar} 根，请求第 {bar} 根")
+        cache.misses += 1
+        self.bar = bar
+        self.input = x
+        return value
+
+    def _trim(self):
+        """丢弃所有视图都已越过的结果（视图仍可能更新自己的最后一根K线，因此保留它）。"""
+        keep_from = min((view.count - 1 for view in self.views), default=self.bar)
+        drop = min(max(keep_from, 0), self.bar) - self.base
+        if drop > 0:
+            del self.inputs[:drop], self.values[:drop]
+            self.base += drop
+        self._trim_at = max(256, 2 * len(self.inputs))
+
+
+class IndicatorView:
+    """共享增量指标的一个使用者，接口与 indicators.MovingAverage 相同，各自维护K线序号。"""
+
+    def __init__(self, shared: _SharedIndicator):
+        if shared.base > 0:
+            # 共享指标已丢弃了开头的结果，新视图从第 0 根K线开始时无法共享，改用独立的增量指标
+            shared = _SharedIndicator(shared.cache, shared.key, type(shared.indicator)(shared.indicator.n))
+        shared.views.append(self)
+        self._shared = shared
+        self.n = shared.indicator.n
+        self.count = 0
+        self.value = math.nan
+        self.prev = math.nan
+
+    def append(self, x: float) -> float:
+        self.prev = self.value
+        self.value = self._shared.at(self.count, x)
+        self.count += 1
+        return self.value
+
+    def update(self, x: float) -> float:
+        if self.count == 0:
+            return self.append(x)
+        self.value = self._shared.at(self.count - 1, x)
+        return self.value
+
+    def extend(self, values) -> float:
+        for x in values:
+            self.append(x)
+        return self.value
+
+    def next_bar(self, last_close: float, close: float) -> float:
+        if self.count:
+            self.update(last_close)
+        return self.append(close)
+
+    def next_bars(self, closes, new: int) -> float:
+        return _next_bars(self, closes, new)
+
+
+class IndicatorCache:
+    """
+    带 LRU 淘汰和命中计数的指标缓存。
+
+    Args:
+        maxsize (int): 整窗指标（series）最多保存的结果数量。
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+        self._shared = {}
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def _get(self, key):
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+            self.hits += 1
+        return result
+
+    def _put(self, key, value):
+        self._results[key] = value
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+    def indicator(self, source: str, name: str, n: int) -> IndicatorView:
+        """
+        获取共享增量指标的一个视图。
+
+        Args:
+            source (str): 数据源标识，行情字段用字段名（如 "close"），
+                tdxexpr 中的子表达式用其规范文本（如 "REF(close,1)"）。
+            name (str): 指标名称：MA/SMA、EMA、WMA。
+            n (int): 周期。
+
+        Returns:
+            IndicatorView: 与 indicators.SMA 用法相同的视图。
+        """
+        name = name.upper()
+        factory = INCREMENTAL_INDICATORS.get(name)
+        if factory is None:
+            raise ValueError(f"不支持的增量指标: {name}")
+        if name == 'SMA':
+            name = 'MA'
+        key = (source, name, (int(n),))
+        shared = self._shared.get(key)
+        if shared is None:
+            shared = self._shared[key] = _SharedIndicator(self, key, factory(int(n)))
+        return IndicatorView(shared)
+
+    def series(self, klines, name: str, *params, field: str = 'close') -> np.ndarray:
+        """
+        对K线窗口计算整列指标，同一根K线内重复调用直接返回缓存的结果（只读数组）。
+
+        Args:
+            klines (pd.DataFrame): K线窗口，需包含 datetime 和 field 列。
+            name (str): 指标名称：MA、EMA、REF。
+            *params: 指标参数，例如周期。
+            field (str): 数据源字段。
+
+        Returns:
+            np.ndarray: 与窗口等长的指标值。
+        """
+        name = name.upper()
+        func = SERIES_INDICATORS.get(name)
+        if func is None:
+            raise ValueError(f"不支持的指标: {name}")
+        column = klines[field]
+        key = (field, name + '[]', params, (klines['datetime'].iloc[-1], column.iloc[-1], len(klines)))
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        self.misses += 1
+        result = np.asarray(func(column.to_numpy(dtype=np.float64), *params))
+        result.flags.writeable = False
+        self._put(key, result)
+        return result
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._results),
+            'indicators': len(self._shared),
+        }
+
+    def clear(self):
+        """清空缓存结果、共享指标和计数。"""
+        self._results.clear()
+        self._shared.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+if __name__ == "__main__":
+    # 策略和两个条件共用 MA(C,12)、MA(C,26)：每根K线每个均线只计算一次，结果与独立计算一致
+    import pandas as pd
+    from tdxexpr import compile_condition
+
+    rng = np.random.default_rng(1)
+    n = 400
+    close = 3000 + np.cumsum(rng.normal(0, 20, n))
+    klines = pd.DataFrame({'datetime': np.arange(n, dtype=np.float64), 'close': close})
+    window = 28
+
+    cache = IndicatorCache()
+    short_ma, long_ma = cache.indicator("close", "MA", 12), cache.indicator("close", "MA", 26)
+    golden = compile_condition("CROSS(MA(C,12),MA(C,26))")
+    death = compile_condition("CROSS(MA(C,26),MA(C,12))")
+    streams = [golden.stream(cache=cache), death.stream(cache=cache)]
+    plain = [golden.stream(), death.stream()]
+
+    for end in range(window, n + 1):
+        view = klines.iloc[end - window:end]
+        if short_ma.count == 0:
+            short_ma.extend(view.close.to_numpy())
+            long_ma.extend(view.close.to_numpy())
+            for s in streams + plain:
+                s.warmup(view)
+        else:
+            short_ma.next_bar(view.close.iloc[-2], view.close.iloc[-1])
+            long_ma.next_bar(view.close.iloc[-2], view.close.iloc[-1])
+            for s in streams + plain:
+                s.next_bar(view)
+        assert [s.current for s in streams] == [s.current for s in plain]
+        assert cache.series(view, "MA", 12) is cache.series(view, "MA", 12)
+
+    expected = tdxfunc.MA(close, 26)[window - 1:]
+    assert np.isclose(long_ma.value, expected[-1])
+    stats = cache.stats()
+    # 两个均线每根K线各计算一次，加上每根K线一次整窗计算，其余全部命中
+    assert stats['misses'] == 2 * n + (n - window + 1), stats
+    print("IndicatorCache 测试通过:", stats)
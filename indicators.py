@@ -0,0 +1,272 @@
+# indicators.py
+
+import math
+
+import numpy as np
+
+
+class BarsLast:
+    """
+    流式 BARSLAST 状态：记录上一次条件为 True 的K线序号，每根K线 O(1) 返回结果。
+
+    同一根K线可以多次更新（传入相同的 key），只有最后一次的条件值生效，
+    因此无需保存完整的条件历史和时间列表。
+
+    返回值语义与 backtest.BARSLAST 中原有的 calculate_barslast 一致：
+        当前K线条件为 True 时返回 0；
+        否则返回距离上一次 True 的周期数；
+        从未出现过 True 时返回 -1。
+    """
+
+    def __init__(self):
+        self.bar_index = -1  # 当前K线序号（从0开始）
+        self.key = None  # 当前K线的标识（通常为K线时间）
+        self.current = False  # 当前K线的条件值
+        self.last_true = -1  # 当前K线之前最近一次 True 的序号
+
+    def update(self, condition, key=None) -> int:
+        """
+        写入一根K线的条件值并返回 BARSLAST。
+
+        Args:
+            condition (bool): 当前K线的条件值。
+            key: K线标识（例如 datetime）。与上一次相同表示更新同一根K线，
+                不同或为 None 表示进入新K线。
+
+        Returns:
+            int: 当前K线的 BARSLAST 值。
+        """
+        if key is None or key != self.key or self.bar_index < 0:
+            # 进入新K线前，把上一根K线的最终条件值计入历史
+            if self.current:
+                self.last_true = self.bar_index
+            self.bar_index += 1
+            self.key = key
+        self.current = bool(condition)
+        return self.value
+
+    @property
+    def value(self) -> int:
+        """当前K线的 BARSLAST 值。"""
+        if self.current:
+            return 0
+        if self.last_true < 0:
+            return -1
+        return self.bar_index - self.last_true
+
+
+class MovingAverage:
+    """
+    增量均线基类。
+
+    每根K线只需 O(1) 更新，同时保存当前值和上一根K线的值：
+        append(x)：追加一根新K线；
+        update(x)：用最新价格更新仍在形成中的最后一根K线；
+        next_bar(last_close, close)：先用最终收盘价定稿上一根K线，再追加新K线；
+        next_bars(closes, new)：K线窗口一次推进了 new 根时（例如断线重连后），定稿并依次追加。
+
+    与 tdxfunc、pandas rolling / ewm 和 tqsdk.tafunc 的容差比对见 test/indicators_check.py。
+    """
+
+    def __init__(self, n: int):
+        if n < 1:
+            raise ValueError("均线周期必须 >= 1")
+        self.n = n
+        self.count = 0  # 已写入的K线数量
+        self.value = float('nan')  # 当前K线的均线值
+        self.prev = float('nan')  # 上一根K线的均线值
+
+    def append(self, x: float) -> float:
+        self.prev = self.value
+        self._push(float(x))
+        self.count += 1
+        self.value = self._compute()
+        return self.value
+
+    def update(self, x: float) -> float:
+        if self.count == 0:
+            return self.append(x)
+        self._replace(float(x))
+        self.value = self._compute()
+        return self.value
+
+    def extend(self, values) -> float:
+        """依次追加多根K线（例如用K线窗口预热），返回最后的均线值。"""
+        for x in values:
+            self.append(x)
+        return self.value
+
+    def next_bar(self, last_close: float, close: float) -> float:
+        if self.count:
+            self.update(last_close)
+        return self.append(close)
+
+    def next_bars(self, closes, new: int) -> float:
+        """
+        K线窗口 closes 的最后 new 根是新K线：先用倒数第 new+1 根的最终收盘价定稿上一根K线，再依次追加。
+        new 等于窗口长度时（上一根K线已移出窗口），中间缺失的K线无法补回，直接追加整个窗口。
+        """
+        return _next_bars(self, closes, new)
+
+    def _push(self, x: float):
+        raise NotImplementedError
+
+    def _replace(self, x: float):
+        raise NotImplementedError
+
+    def _compute(self) -> float:
+        raise NotImplementedError
+
+
+class _WindowAverage(MovingAverage):
+    """基于环形缓冲区的定长窗口均线，窗口内存在 NaN 或数量不足时结果为 NaN（与 rolling 一致）。"""
+
+    def __init__(self, n: int):
+        super().__init__(n)
+        self._buf = [0.0] * n
+        self._pos = 0  # 下一个写入位置
+        self._size = 0  # 窗口内的数据个数
+        self._nans = 0  # 窗口内 NaN 的个数
+
+    def _push(self, x: float):
+        old = self._buf[self._pos] if self._size == self.n else None
+        if old is not None and old != old:
+            self._nans -= 1
+        if x != x:
+            self._nans += 1
+        self._slide(old, x)
+        self._buf[self._pos] = x
+        self._pos = (self._pos + 1) % self.n
+        if self._size < self.n:
+            self._size += 1
+        if self._pos == 0:
+            # 每绕行一圈重新精确求和一次，消除累计的浮点误差，均摊仍为 O(1)
+            self._resync()
+
+    def _replace(self, x: float):
+        last = (self._pos - 1) % self.n
+        old = self._buf[last]
+        if old != old:
+            self._nans -= 1
+        if x != x:
+            self._nans += 1
+        self._adjust_last(old, x)
+        self._buf[last] = x
+
+    def _window(self):
+        """按时间顺序返回窗口内的数据。"""
+        if self._size < self.n:
+            return self._buf[:self._size]
+        return self._buf[self._pos:] + self._buf[:self._pos]
+
+    def _compute(self) -> float:
+        if self._size < self.n or self._nans:
+            return float('nan')
+        return self._average()
+
+
+def _next_bars(indicator, closes, new: int) -> float:
+    if new == 1 and len(closes) >= 2:
+        return indicator.next_bar(closes[-2], closes[-1])
+    if new < len(closes) and indicator.count:
+        indicator.update(closes[-new - 1])
+    return indicator.extend(closes[-new:])
+
+
+def count_new_bars(datetimes, last_datetime) -> int:
+    """
+    K线窗口中晚于 last_datetime（上一次处理的最后一根K线时间）的K线数量。
+
+    一次 wait_update 可能带来不止一根新K线（例如实盘断线重连后），只看最后一根会漏掉中间的K线。
+    datetimes 为K线时间列（窗口开头历史不足的部分为 NaN，不计入）；last_datetime 为 None 时返回窗口长度。
+    """
+    if last_datetime is None:
+        return len(datetimes)
+    return int(np.count_nonzero(datetimes > last_datetime))
+
+
+def _finite(x: float) -> float:
+    """NaN 不参与求和。"""
+    return 0.0 if x != x else x
+
+
+class SMA(_WindowAverage):
+    """简单移动平均，等价于 tqsdk.tafunc.ma(series, n)。"""
+
+    def __init__(self, n: int):
+        super().__init__(n)
+        self._sum = 0.0
+
+    def _slide(self, old, x: float):
+        if old is not None:
+            self._sum -= _finite(old)
+        self._sum += _finite(x)
+
+    def _adjust_last(self, old: float, x: float):
+        self._sum += _finite(x) - _finite(old)
+
+    def _resync(self):
+        self._sum = math.fsum(_finite(x) for x in self._buf)
+
+    def _average(self) -> float:
+        return self._sum / self.n
+
+
+class WMA(_WindowAverage):
+    """线性加权移动平均（权重 1..n，最新K线权重最大），等价于 tqsdk.tafunc.wma(series, n)。"""
+
+    def __init__(self, n: int):
+        super().__init__(n)
+        self._sum = 0.0  # 窗口内数据之和
+        self._weighted = 0.0  # 窗口内加权和
+        self._weight_total = n * (n + 1) / 2
+
+    def _slide(self, old, x: float):
+        if old is None:
+            # 窗口未满时，新数据的权重为当前窗口长度
+            self._weighted += (self._size + 1) * _finite(x)
+        else:
+            # 窗口已满：所有旧数据权重减 1，最旧的数据移出
+            self._weighted += self.n * _finite(x) - self._sum
+            self._sum -= _finite(old)
+        self._sum += _finite(x)
+
+    def _adjust_last(self, old: float, x: float):
+        delta = _finite(x) - _finite(old)
+        self._sum += delta
+        self._weighted += self._size * delta
+
+    def _resync(self):
+        window = self._window()
+        self._sum = math.fsum(_finite(x) for x in window)
+        self._weighted = math.fsum((i + 1) * _finite(x) for i, x in enumerate(window))
+
+    def _average(self) -> float:
+        return self._weighted / self._weight_total
+
+
+class EMA(MovingAverage):
+    """
+    指数移动平均，等价于 tqsdk.tafunc.ema(series, n)，即 ewm(span=n, adjust=False)。
+    第一个有效值之前结果为 NaN，之后遇到 NaN 时沿用上一根K线的值。
+    """
+
+    def __init__(self, n: int):
+        super().__init__(n)
+        self.alpha = 2.0 / (n + 1)
+        self._base = float('nan')  # 上一根K线定稿后的 EMA 值
+        self._last = float('nan')  # 最后一根K线的输入值
+
+    def _push(self, x: float):
+        self._base = self.value
+        self._last = x
+
+    def _replace(self, x: float):
+        self._last = x
+
+    def _compute(self) -> float:
+        if self._last != self._last:
+            return self._base
+        if self._base != self._base:
+            return self._last
+        return self.alpha * self._last + (1 - self.alpha) * self._base
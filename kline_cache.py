@@ -0,0 +1,274 @@
+# kline_cache.py
+
+"""
+本地K线缓存。
+
+按 (合约, K线周期) 各保存一个 NumPy .npz 列式文件，并在 index.json 中记录该文件已覆盖的
+日期范围。请求的日期范围超出已缓存范围时，只向数据源请求缺少的部分，合并后写回磁盘。
+
+    cache = KlineCache("kline_cache", fetcher=fetch_and_prepare_futures_data)
+    df = cache.get("SHFE.rb2410", "2023-06-01", "2023-12-31", DURATION_DAILY)
+
+fetcher 的签名与 data_fetcher.fetch_and_prepare_futures_data 相同：
+    fetcher(symbol, start_dt_str, end_dt_str, kline_duration) -> Optional[pd.DataFrame]
+返回的 DataFrame 以时间为索引，列为数值类型。
+
+offline=True 时只读取本地缓存，不会调用 fetcher（不访问网络）。
+缓存总大小超过 max_bytes 时，按最近访问时间淘汰最久未使用的文件。
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kline_cache")
+DEFAULT_MAX_BYTES = 1024 ** 3  # 默认最多缓存 1GB
+INDEX_FILE = "index.json"
+
+
+def _parse_date(text: str):
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def _format_date(d) -> str:
+    return d.strftime('%Y-%m-%d')
+
+
+class KlineCache:
+    """
+    按 (合约, 周期, 日期范围) 缓存K线的本地磁盘缓存。
+
+    Args:
+        cache_dir (str): 缓存目录。
+        fetcher (callable): 缓存未命中时调用的数据源。
+        max_bytes (int): 缓存文件总大小上限。
+        offline (bool): 为 True 时只读本地缓存，从不调用 fetcher。
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, fetcher: Optional[Callable] = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.fetcher = fetcher
+        self.max_bytes = max_bytes
+        self.offline = offline
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, INDEX_FILE)
+        self._index = self._load_index()
+
+    # ---------- 索引 ----------
+
+    def _load_index(self) -> dict:
+        if not os.path.exists(self._index_path):
+            return {}
+        with open(self._index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        # 去掉文件已被手动删除的条目
+        return {k: v for k, v in index.items() if os.path.exists(os.path.join(self.cache_dir, v['file']))}
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self._index_path)
+
+    @staticmethod
+    def _key(symbol: str, kline_duration: int) -> str:
+        return f"{symbol}_{int(kline_duration)}"
+
+    def cached_range(self, symbol: str, kline_duration: int):
+        """返回已缓存的 (开始日期, 结束日期) 字符串，没有缓存时返回 None。"""
+        entry = self._index.get(self._key(symbol, kline_duration))
+        return (entry['start'], entry['end']) if entry else None
+
+    def total_bytes(self) -> int:
+        return sum(entry['bytes'] for entry in self._index.values())
+
+    # ---------- 读写 ----------
+
+    def _read(self, entry: dict) -> pd.DataFrame:
+        with np.load(os.path.join(self.cache_dir, entry['file'])) as data:
+            index = pd.to_datetime(data['__index__'], unit='ns', utc=entry['tz'] is not None)
+            columns = {name: data[name] for name in entry['columns']}
+        if entry['tz'] is not None:
+            index = index.tz_convert(entry['tz'])
+        df = pd.DataFrame(columns, index=index)
+        df.index.name = entry['index_name']
+        return df
+
+    def _write(self, key: str, df: pd.DataFrame, start: str, end: str):
+        index = df.index
+        tz = str(index.tz) if getattr(index, 'tz', None) is not None else None
+        if tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        arrays = {'__index__': index.as_unit('ns').asi8}
+        for name in df.columns:
+            arrays[name] = df[name].to_numpy()
+
+        file_name = key.replace('/', '_') + ".npz"
+        path = os.path.join(self.cache_dir, file_name)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+        self._index[key] = {
+            'file': file_name,
+            'start': start,
+            'end': end,
+            'tz': tz,
+            'index_name': df.index.name,
+            'columns': list(df.columns),
+            'bytes': os.path.getsize(path),
+            'last_access': time.time(),
+        }
+        self._evict(keep=key)
+        self._save_index()
+
+    def _evict(self, keep: str):
+        """总大小超限时，按最近访问时间从旧到新删除缓存文件（保留刚写入的文件）。"""
+        total = self.total_bytes()
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._index.pop(key)
+            total -= entry['bytes']
+            try:
+                os.remove(os.path.join(self.cache_dir, entry['file']))
+            except FileNotFoundError:
+                pass
+            print(f"K线缓存超过上限，已淘汰: {key}")
+
+    @staticmethod
+    def _slice(df: pd.DataFrame, start, end) -> pd.DataFrame:
+        dates = df.index.date
+        return df[(dates >= start) & (dates <= end)]
+
+    def _fetch(self, symbol: str, start, end, kline_duration: int) -> Optional[pd.DataFrame]:
+        print(f"K线缓存未覆盖 {symbol} {_format_date(start)} ~ {_format_date(end)}，从数据源获取...")
+        df = self.fetcher(symbol, _format_date(start), _format_date(end), kline_duration)
+        if df is None or df.empty:
+            return None
+        return self._slice(df, start, end)
+
+    def get(self, symbol: str, start_dt_str: str, end_dt_str: str, kline_duration: int) -> Optional[pd.DataFrame]:
+        """
+        获取K线，优先读取缓存，只请求缓存中缺少的日期段。
+
+        Args:
+            symbol (str): 合约代码。
+            start_dt_str (str): 开始日期 (格式 'YYYY-MM-DD')。
+            end_dt_str (str): 结束日期 (格式 'YYYY-MM-DD')。
+            kline_duration (int): K线周期，单位为秒。
+
+        Returns:
+            Optional[pd.DataFrame]: 请求日期范围内的K线；没有任何数据时返回 None。
+        """
+        start, end = _parse_date(start_dt_str), _parse_date(end_dt_str)
+        if start > end:
+            raise ValueError(f"开始日期 {start_dt_str} 晚于结束日期 {end_dt_str}")
+        key = self._key(symbol, kline_duration)
+        entry = self._index.get(key)
+        cached = self._read(entry) if entry else None
+
+        if entry:
+            cached_start, cached_end = _parse_date(entry['start']), _parse_date(entry['end'])
+            # 缺少的日期段（为保持缓存范围连续，与已缓存范围之间的空档一并补齐）
+            missing = []
+            if start < cached_start:
+                missing.append((start, cached_start - timedelta(days=1)))
+            if end > cached_end:
+                missing.append((cached_end + timedelta(days=1), end))
+        else:
+            cached_start = cached_end = None
+            missing = [(start, end)]
+
+        if missing and self.offline:
+            print(f"离线模式：{symbol} 缓存未完全覆盖 {start_dt_str} ~ {end_dt_str}，只返回已缓存的部分。")
+            missing = []
+        if missing and self.fetcher is None:
+            raise ValueError("缓存未命中且没有配置 fetcher")
+
+        if missing:
+            parts = [cached] if cached is not None else []
+            # 只把实际取回的日期段计入缓存范围；获取失败（fetcher 返回 None）的日期段下次仍会重新请求
+            new_start, new_end = cached_start, cached_end
+            for piece_start, piece_end in missing:
+                fetched = self._fetch(symbol, piece_start, piece_end, kline_duration)
+                if fetched is None:
+                    continue
+                parts.append(fetched)
+                new_start = piece_start if new_start is None else min(new_start, piece_start)
+                new_end = piece_end if new_end is None else max(new_end, piece_end)
+            if len(parts) > (cached is not None):
+                merged = pd.concat(parts).sort_index()
+                cached = merged[~merged.index.duplicated(keep='last')]
+                self._write(key, cached, _format_date(new_start), _format_date(new_end))
+        elif entry:
+            entry['last_access'] = time.time()
+            self._save_index()
+
+        if cached is None:
+            return None
+        result = self._slice(cached, start, end)
+        return result if not result.empty else None
+
+    def clear(self):
+        """删除所有缓存文件。"""
+        for entry in self._index.values():
+            try:
+                os.remove(os.path.join(self.cache_dir, entry['file']))
+            except FileNotFoundError:
+                pass
+        self._index = {}
+        self._save_index()
+
+
+if __name__ == "__main__":
+    # 使用桩数据源测试缓存逻辑，不访问网络
+    import tempfile
+
+    calls = []
+
+    def stub_fetcher(symbol, start_dt_str, end_dt_str, kline_duration):
+        calls.append((start_dt_str, end_dt_str))
+        index = pd.date_range(start_dt_str, end_dt_str, freq='D', tz='Asia/Shanghai', name='trade_date')
+        close = np.arange(len(index), dtype=np.float64) + index.dayofyear.to_numpy()
+        return pd.DataFrame({'open': close - 1, 'close': close}, index=index)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = KlineCache(tmp_dir, fetcher=stub_fetcher)
+        first = cache.get("SHFE.rb2410", "2023-06-01", "2023-06-30", 86400)
+        again = cache.get("SHFE.rb2410", "2023-06-10", "2023-06-20", 86400)
+        extended = cache.get("SHFE.rb2410", "2023-05-15", "2023-07-10", 86400)
+        assert calls == [("2023-06-01", "2023-06-30"), ("2023-05-15", "2023-05-31"), ("2023-07-01", "2023-07-10")], calls
+        assert len(first) == 30 and len(again) == 11 and len(extended) == 57
+        assert str(extended.index.tz) == 'Asia/Shanghai'
+
+        offline = KlineCache(tmp_dir, offline=True)
+        assert len(offline.get("SHFE.rb2410", "2023-05-01", "2023-07-31", 86400)) == 57
+        assert offline.get("DCE.m2401", "2023-05-01", "2023-07-31", 86400) is None
+
+        # 获取失败的日期段不计入缓存范围，数据源恢复后重新请求
+        healthy = [False]
+
+        def flaky_fetcher(*args):
+            return stub_fetcher(*args) if healthy[0] else None
+
+        flaky = KlineCache(tmp_dir, fetcher=flaky_fetcher)
+        assert flaky.get("SHFE.rb2410", "2023-07-01", "2023-08-31", 86400) is not None
+        assert flaky.cached_range("SHFE.rb2410", 86400) == ("2023-05-15", "2023-07-10")
+        assert flaky.get("CZCE.SR401", "2023-07-01", "2023-08-31", 86400) is None
+        assert flaky.cached_range("CZCE.SR401", 86400) is None
+        healthy[0] = True
+        assert len(flaky.get("SHFE.rb2410", "2023-07-01", "2023-08-31", 86400)) == 62
+
+        small = KlineCache(tmp_dir, fetcher=stub_fetcher, max_bytes=1)
+        small.get("DCE.m2401", "2023-01-01", "2023-01-31", 86400)
+        assert small.cached_range("SHFE.rb2410", 86400) is None
+        print("KlineCache 测试通过，数据源调用记录:", calls)
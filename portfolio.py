@@ -0,0 +1,271 @@
+# portfolio.py
+
+"""
+多合约组合回测。
+
+两种运行方式：
+    run_portfolio_backtest：一个 TqApi 会话内同时驱动所有合约，每个合约只订阅一次K线，
+        共用同一个时钟（wait_update）和同一个账户，按权重分配资金；
+    run_portfolio_offline：离线模式，把合约分配到多个进程用向量化引擎回测，再合并权益曲线。
+
+两者都返回 (per_symbol, aggregate) 两个 DataFrame：
+    per_symbol：每个合约每根K线一行，列为 symbol + BARSLAST() 结果的各列，
+        其中 barslast 为距离上一次金叉的周期数；
+    aggregate：组合层面每个时间点一行，列为 datetime, balance。
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from indicators import BarsLast, SMA
+from vector_backtest import RESULT_COLUMNS, run_vector_backtest
+
+DEFAULT_PARAMS = {
+    'short': 12,  # 短周期均线
+    'long': 26,  # 长周期均线
+    'invest_ratio': 0.2,  # 每次投入分配资金的比例
+    'volume_multiple': 1,  # 合约乘数（仅离线模式使用，TqApi 模式从行情中读取）
+}
+
+
+def resolve_params(symbols, params=None) -> dict:
+    """
+    合并每个合约的参数，未指定的使用默认值；未指定权重的合约平分剩余权重。
+
+    Args:
+        symbols (list): 合约代码列表。
+        params (dict): {合约代码: {short, long, invest_ratio, volume_multiple, weight}}，均可省略。
+
+    Returns:
+        dict: {合约代码: 完整参数字典}。
+    """
+    params = params or {}
+    unknown = set(params) - set(symbols)
+    if unknown:
+        raise ValueError(f"参数中包含不在合约列表里的合约: {sorted(unknown)}")
+    fixed = {s: params[s]['weight'] for s in symbols if 'weight' in params.get(s, {})}
+    free = [s for s in symbols if s not in fixed]
+    remaining = 1.0 - sum(fixed.values())
+    if remaining < -1e-9:
+        raise ValueError(f"指定的权重之和超过 1: {sum(fixed.values()):g}")
+    remaining = max(remaining, 0.0)
+    resolved = {}
+    for s in symbols:
+        p = dict(DEFAULT_PARAMS)
+        p.update(params.get(s, {}))
+        p['weight'] = fixed.get(s, remaining / len(free) if free else 0.0)
+        resolved[s] = p
+    return resolved
+
+
+def run_portfolio_backtest(symbols, params=None, start_dt=date(2023, 1, 1), end_dt=date(2023, 12, 31),
+                           initial_capital=1_000_000, kline_duration=24 * 60 * 60, auth=None):
+    """
+    在一个 TqApi 回测会话中同时运行多个合约的双均线策略。
+
+    每个合约的开仓手数 = int(账户权益 * 权重 * 投入比例 / (价格 * 合约乘数))，
+    所有合约共用一个账户，因此盈亏会影响其它合约后续的开仓规模。
+
+    Args:
+        symbols (list): 合约代码列表，例如 ["DCE.m2401", "SHFE.rb2401"]。
+        params (dict): 每个合约的参数，见 resolve_params。
+        start_dt (date): 回测开始日期。
+        end_dt (date): 回测结束日期。
+        initial_capital (float): 初始本金。
+        kline_duration (int): K线周期，单位为秒。
+        auth: TqAuth 实例；为 None 时从 .env 中读取 KQ_ACCOUNT / KQ_PASSWORD。
+
+    Returns:
+        tuple: (per_symbol, aggregate) 两个 DataFrame。
+    """
+    from tqsdk import TqApi, TqAuth, TqBacktest, TargetPosTask, TqSim, BacktestFinished
+
+    if auth is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        auth = TqAuth(os.getenv("KQ_ACCOUNT"), os.getenv("KQ_PASSWORD"))
+
+    params = resolve_params(symbols, params)
+    records = {s: [] for s in symbols}
+    aggregate = []
+    api = None
+
+    try:
+        api = TqApi(account=TqSim(init_balance=initial_capital),
+                    backtest=TqBacktest(start_dt=start_dt, end_dt=end_dt), auth=auth)
+        print(f"开始组合回测：{', '.join(symbols)}")
+        account = api.get_account()
+
+        # 每个合约只订阅一次K线，状态各自维护
+        states = {}
+        for s in symbols:
+            p = params[s]
+            quote = api.get_quote(s)
+            if not quote.volume_multiple:
+                raise ValueError(f"无法获取 {s} 的合约乘数")
+            states[s] = {
+                'klines': api.get_kline_serial(s, duration_seconds=kline_duration, data_length=p['long'] + 2),
+                'target_pos': TargetPosTask(api, s),
+                'volume_multiple': quote.volume_multiple,
+                'short_ma': SMA(p['short']),
+                'long_ma': SMA(p['long']),
+                'bars_last': BarsLast(),
+            }
+
+        while True:
+            if not api.wait_update():
+                break
+
+            updated_dt = None
+            for s, st in states.items():
+                klines = st['klines']
+                if klines.empty or not api.is_changing(klines, "datetime"):
+                    continue
+
+                p = params[s]
+                current_dt = pd.Timestamp(klines.datetime.iloc[-1], unit='ns')
+                current_price = klines.close.iloc[-1]
+                short_ma, long_ma = st['short_ma'], st['long_ma']
+                if short_ma.count == 0:
+                    closes = klines.close.to_numpy()
+                    short_ma.extend(closes)
+                    long_ma.extend(closes)
+                else:
+                    last_close = klines.close.iloc[-2]
+                    short_ma.next_bar(last_close, current_price)
+                    long_ma.next_bar(last_close, current_price)
+
+                current_capital = account.balance
+                invest_amount = current_capital * p['weight'] * p['invest_ratio']
+                position = int(invest_amount / (current_price * st['volume_multiple']))
+
+                golden = short_ma.prev < long_ma.prev and short_ma.value > long_ma.value
+                death = short_ma.prev > long_ma.prev and short_ma.value < long_ma.value
+                bars_last = st['bars_last'].update(golden, key=current_dt)
+
+                trade_action = None
+                if golden:
+                    trade_action = f"开多 {position} 手"
+                    st['target_pos'].set_target_volume(position)
+                elif death:
+                    trade_action = f"开空 {position} 手"
+                    st['target_pos'].set_target_volume(-position)
+
+                records[s].append((current_dt, current_price, current_capital, position, bars_last, trade_action))
+                if trade_action:
+                    print(f"时间: {current_dt}, 合约: {s}, 价格: {current_price:.2f}, 交易: {trade_action}")
+                updated_dt = current_dt if updated_dt is None else max(updated_dt, current_dt)
+
+            if updated_dt is not None:
+                aggregate.append((updated_dt, account.balance))
+
+    except BacktestFinished:
+        print("组合回测结束")
+
+    except Exception as e:
+        print(f"组合回测失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+
+    finally:
+        if api:
+            api.close()
+
+    per_symbol = _concat_symbols({s: pd.DataFrame(rows, columns=RESULT_COLUMNS) for s, rows in records.items()})
+    aggregate = pd.DataFrame(aggregate, columns=['datetime', 'balance'])
+    aggregate = aggregate.drop_duplicates('datetime', keep='last').reset_index(drop=True)
+    return per_symbol, aggregate
+
+
+def _concat_symbols(frames: dict) -> pd.DataFrame:
+    """把 {合约: 结果} 合并为带 symbol 列的长表。"""
+    parts = [df.assign(symbol=s) for s, df in frames.items()]
+    if not parts:
+        return pd.DataFrame(columns=['symbol'] + RESULT_COLUMNS)
+    merged = pd.concat(parts, ignore_index=True)
+    return merged[['symbol'] + RESULT_COLUMNS]
+
+
+def _run_offline_symbols(jobs) -> dict:
+    """工作进程：依次回测分配到本进程的合约。"""
+    return {symbol: run_vector_backtest(klines, short=p['short'], long=p['long'],
+                                        initial_capital=capital, invest_ratio=p['invest_ratio'],
+                                        volume_multiple=p['volume_multiple'])
+            for symbol, klines, p, capital in jobs}
+
+
+def merge_equity(frames: dict, capitals: dict) -> pd.DataFrame:
+    """
+    按时间对齐各合约的权益曲线并求和，得到组合权益。
+
+    某个合约在某个时间点没有K线时沿用其上一次的权益；开始交易之前按分配资金计。
+
+    Args:
+        frames (dict): {合约: 结果 DataFrame}，需包含 datetime 和 balance 列。
+        capitals (dict): {合约: 分配资金}。
+
+    Returns:
+        pd.DataFrame: 列为 datetime, balance。
+    """
+    if not frames:
+        return pd.DataFrame(columns=['datetime', 'balance'])
+    wide = pd.concat({s: df.drop_duplicates('datetime', keep='last').set_index('datetime')['balance']
+                      for s, df in frames.items()}, axis=1).sort_index()
+    wide = wide.ffill().fillna(pd.Series(capitals))
+    return pd.DataFrame({'datetime': wide.index, 'balance': wide.sum(axis=1).to_numpy()})
+
+
+def run_portfolio_offline(klines_by_symbol: dict, params=None, initial_capital=1_000_000, workers=None):
+    """
+    离线并行组合回测。
+
+    每个合约按权重分到独立的子账户资金（initial_capital * weight），在各自进程内用
+    vector_backtest 回测，最后按时间合并权益曲线。由于各进程独立运行，合约之间不会
+    实时共享盈亏，这一点与 run_portfolio_backtest 的共用账户不同。
+
+    Args:
+        klines_by_symbol (dict): {合约代码: K线 DataFrame}。
+        params (dict): 每个合约的参数，见 resolve_params。
+        initial_capital (float): 组合初始本金。
+        workers (int): 进程数，默认使用全部 CPU；为 1 时在当前进程内运行。
+
+    Returns:
+        tuple: (per_symbol, aggregate) 两个 DataFrame。
+    """
+    symbols = list(klines_by_symbol)
+    params = resolve_params(symbols, params)
+    capitals = {s: initial_capital * params[s]['weight'] for s in symbols}
+    jobs = [(s, klines_by_symbol[s], params[s], capitals[s]) for s in symbols]
+
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if workers == 1:
+        frames = _run_offline_symbols(jobs)
+    else:
+        # 轮流分配，使各进程的合约数量接近
+        batches = [jobs[i::workers] for i in range(workers)]
+        frames = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(_run_offline_symbols, batches):
+                frames.update(result)
+        frames = {s: frames[s] for s in symbols}
+
+    return _concat_symbols(frames), merge_equity(frames, capitals)
+
+
+if __name__ == "__main__":
+    # 离线模式示例：用合成数据模拟三个合约
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2023-01-01', periods=500, freq='D')
+    universe = {}
+    for i, symbol in enumerate(["DCE.m2401", "SHFE.rb2401", "CZCE.SR401"]):
+        close = 3000 + np.cumsum(rng.normal(0, 20, len(dates)))
+        universe[symbol] = pd.DataFrame({'datetime': dates[i:], 'close': close[i:]})
+
+    per_symbol, aggregate = run_portfolio_offline(
+        universe, params={"DCE.m2401": {'short': 5, 'long': 20, 'volume_multiple': 10}}, workers=2)
+    print(per_symbol.groupby('symbol')['balance'].last())
+    print(aggregate.tail())
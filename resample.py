@@ -0,0 +1,296 @@
+# resample.py
+
+"""
+从一条分钟K线生成更高周期的K线。
+
+只需下载（或订阅）一次基础分钟线，就能同时得到 5 分钟、1 小时、日线等多个周期，
+例如日线趋势过滤 + 5 分钟入场的策略不必为每个周期单独调用 get_kline_serial。
+
+    bars = resample(minute_klines, 5 * 60)                  # 向量化：整段历史
+    daily, index = resample(minute_klines, 86400, return_index=True)
+
+    resampler = Resampler(5 * 60)                           # 增量：实时K线
+    if resampler.update(dt, open, high, low, close, volume):
+        finished = resampler.completed                      # 刚完成的一根 5 分钟K线
+
+规则（与 TqSdk 一致，时间均为纳秒时间戳，按北京时间划分）：
+    - 日内周期按北京时间的整点对齐（例如 5 分钟线为 9:00、9:05 ...），K线时间为区间开始时间；
+    - 相邻两根分钟线间隔超过 session_gap 视为进入新的交易时段，同一根高周期K线不会跨越交易时段；
+    - 夜盘（18:00 以后及凌晨）属于下一个交易日，周五夜盘和周六凌晨属于下周一，
+      可通过 holidays 指定节假日；
+    - 日线按交易日聚合，K线时间为交易日北京时间 0 点。
+
+输入K线的 datetime 可以是纳秒时间戳（TqSdk）、不带时区的时间（视为 UTC）或带时区的时间；
+缺少 high/low 时用开盘价和收盘价代替，缺少 volume 时视为 0。
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+DAILY = 24 * 60 * 60
+RESAMPLE_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'volume', 'open_oi', 'close_oi', 'trading_day']
+
+_NS = 1_000_000_000
+_NIGHT_SHIFT_NS = 6 * 3600 * _NS  # 18:00 以后的K线归入下一个自然日
+
+
+def _datetime_ns(klines: pd.DataFrame) -> np.ndarray:
+    """取出 UTC 纳秒时间戳。"""
+    if 'datetime' in klines.columns:
+        values = klines['datetime']
+    elif isinstance(klines.index, pd.DatetimeIndex):
+        values = klines.index.to_series()
+    else:
+        raise ValueError("无法识别K线时间列（需要 datetime 列或时间索引）")
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.int64)
+    values = pd.to_datetime(values)
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    return values.dt.as_unit('ns').to_numpy().astype(np.int64)
+
+
+def trading_days(datetime_ns, tz_offset_hours: float = 8, holidays=None) -> np.ndarray:
+    """
+    计算每根K线所属的交易日（夜盘归入下一个交易日）。
+
+    Args:
+        datetime_ns: UTC 纳秒时间戳数组。
+        tz_offset_hours (float): 交易所时区相对 UTC 的小时数，默认为北京时间。
+        holidays: 节假日列表（日期字符串或 datetime64[D]），交易日会顺延到其后的第一个工作日。
+
+    Returns:
+        np.ndarray: datetime64[D] 数组。
+    """
+    local = np.asarray(datetime_ns, dtype=np.int64) + int(tz_offset_hours * 3600 * _NS)
+    days = ((local + _NIGHT_SHIFT_NS) // (86400 * _NS)).astype('datetime64[D]')
+    return np.busday_offset(days, 0, roll='forward', holidays=[] if holidays is None else holidays)
+
+
+def _check_duration(duration) -> int:
+    duration = int(duration)
+    if duration <= 0 or duration > DAILY or (duration < DAILY and duration % 60):
+        raise ValueError(f"不支持的周期: {duration} 秒（需要为整分钟的日内周期或 {DAILY}）")
+    return duration
+
+
+def _column(klines: pd.DataFrame, name: str, default=None) -> np.ndarray:
+    if name in klines.columns:
+        return klines[name].to_numpy(dtype=np.float64)
+    return default
+
+
+def resample(klines: pd.DataFrame, duration: int, tz_offset_hours: float = 8, session_gap: int = 30 * 60,
+             holidays=None, return_index: bool = False):
+    """
+    向量化地把分钟K线聚合为更高周期。
+
+    Args:
+        klines (pd.DataFrame): 按时间升序的基础K线（TqSdk 格式或带时间索引）。
+        duration (int): 目标周期，单位为秒，日内周期或 86400（日线）。
+        tz_offset_hours (float): 交易所时区相对 UTC 的小时数。
+        session_gap (int): 相邻K线间隔超过该秒数时视为新的交易时段。
+        holidays: 节假日，见 trading_days。
+        return_index (bool): 为 True 时同时返回每根基础K线所属的高周期K线序号。
+
+    Returns:
+        pd.DataFrame: 列见 RESAMPLE_COLUMNS，datetime 为纳秒时间戳，trading_day 为 yyyymmdd 整数；
+        return_index 为 True 时返回 (DataFrame, np.ndarray)。
+            某根基础K线之前已经完成的高周期K线为 index - 1，可据此对齐而不引入未来数据。
+    """
+    duration = _check_duration(duration)
+    ts = _datetime_ns(klines)
+    n = len(ts)
+    close = _column(klines, 'close')
+    if close is None:
+        raise ValueError("K线数据缺少 close 列")
+    open_ = _column(klines, 'open', close)
+    high = _column(klines, 'high', np.maximum(open_, close))
+    low = _column(klines, 'low', np.minimum(open_, close))
+    volume = _column(klines, 'volume', np.zeros(n))
+    open_oi = _column(klines, 'open_oi', np.full(n, np.nan))
+    close_oi = _column(klines, 'close_oi', np.full(n, np.nan))
+
+    offset = int(tz_offset_hours * 3600 * _NS)
+    days = trading_days(ts, tz_offset_hours, holidays)
+    day_ids = days.astype(np.int64)
+    if duration == DAILY:
+        starts = np.flatnonzero(np.r_[True, day_ids[1:] != day_ids[:-1]]) if n else np.empty(0, dtype=np.int64)
+        labels = day_ids[starts] * 86400 * _NS - offset
+    else:
+        step = duration * _NS
+        buckets = (ts + offset) // step
+        session_break = np.r_[True, np.diff(ts) > session_gap * _NS] if n else np.empty(0, dtype=bool)
+        new_bar = session_break | np.r_[True, buckets[1:] != buckets[:-1]] | np.r_[True, day_ids[1:] != day_ids[:-1]]
+        starts = np.flatnonzero(new_bar)
+        labels = buckets[starts] * step - offset
+        # 同一个对齐区间被交易时段切开时，后一段以其第一根K线的时间为K线时间，保证时间唯一
+        repeated = np.r_[False, labels[1:] == labels[:-1]]
+        labels[repeated] = ts[starts[repeated]]
+
+    ends = np.r_[starts[1:], n] - 1
+    bars = pd.DataFrame({
+        'datetime': labels,
+        'open': open_[starts],
+        'high': np.maximum.reduceat(high, starts) if n else np.empty(0),
+        'low': np.minimum.reduceat(low, starts) if n else np.empty(0),
+        'close': close[ends],
+        'volume': np.add.reduceat(volume, starts) if n else np.empty(0),
+        'open_oi': open_oi[starts],
+        'close_oi': close_oi[ends],
+        'trading_day': _yyyymmdd(days[starts]),
+    })
+    if return_index:
+        return bars, np.cumsum(np.isin(np.arange(n), starts)) - 1
+    return bars
+
+
+def _yyyymmdd(days: np.ndarray) -> np.ndarray:
+    text = np.datetime_as_string(days, unit='D')
+    return np.array([int(t.replace('-', '')) for t in text], dtype=np.int32) if len(text) else np.empty(0, np.int32)
+
+
+def resample_many(klines: pd.DataFrame, durations, **kwargs) -> dict:
+    """一次生成多个周期：{周期: DataFrame}，参数同 resample。"""
+    return {int(d): resample(klines, d, **kwargs) for d in durations}
+
+
+class Resampler:
+    """
+    增量聚合：每推送一根基础K线 O(1) 更新当前的高周期K线，结果与 resample 一致。
+
+    同一根基础K线（datetime 相同）可以重复推送（未完成的实时K线），只有最后一次的数据生效。
+
+    Attributes:
+        bar (dict): 当前（可能尚未完成）的高周期K线，字段见 RESAMPLE_COLUMNS。
+        completed (dict): 最近一根已完成的高周期K线。
+        count (int): 已产生的高周期K线数量（包括当前这根）。
+    """
+
+    def __init__(self, duration: int, tz_offset_hours: float = 8, session_gap: int = 30 * 60, holidays=None):
+        self.duration = _check_duration(duration)
+        self.tz_offset_hours = tz_offset_hours
+        self.session_gap = session_gap
+        self.holidays = holidays
+        self._offset = int(tz_offset_hours * 3600 * _NS)
+        self.bar = None
+        self.completed = None
+        self.count = 0
+        self._day = None  # 当前高周期K线的交易日
+        self._bucket = None  # 当前高周期K线的对齐区间
+        self._last_dt = None  # 最后一根基础K线的时间
+        self._parts = 0  # 当前高周期K线包含的基础K线数
+        self._acc = (-math.inf, math.inf, 0.0)  # 除最后一根以外的基础K线的 (high, low, volume)
+
+    def update(self, datetime, open, high, low, close, volume: float = 0.0, open_oi: float = math.nan,
+               close_oi: float = math.nan) -> bool:
+        """
+        推送一根基础K线。
+
+        Returns:
+            bool: 这根基础K线开始了一根新的高周期K线时返回 True（此时 completed 为上一根已完成的K线）。
+        """
+        dt = int(datetime)
+        last_dt = self._last_dt
+        if last_dt is not None and dt == last_dt:
+            # 重复推送同一根基础K线：只替换它对当前高周期K线的贡献
+            if self._parts == 1:
+                self.bar['open'] = float(open)
+                self.bar['open_oi'] = float(open_oi)
+            self._set_last(high, low, close, volume, close_oi)
+            return False
+        if last_dt is not None and dt < last_dt:
+            raise ValueError("基础K线时间必须递增")
+        self._last_dt = dt
+
+        day = int(trading_days([dt], self.tz_offset_hours, self.holidays)[0].astype(np.int64))
+        bucket = None if self.duration == DAILY else (dt + self._offset) // (self.duration * _NS)
+        new_session = last_dt is None or (self.duration != DAILY and dt - last_dt > self.session_gap * _NS)
+        if self.bar is not None and not new_session and day == self._day and bucket == self._bucket:
+            # 同一根高周期K线：上一根基础K线已完成，计入聚合
+            bar = self.bar
+            self._acc = (bar['high'], bar['low'], bar['volume'])
+            self._parts += 1
+            self._set_last(high, low, close, volume, close_oi)
+            return False
+
+        if self.duration == DAILY:
+            label = day * 86400 * _NS - self._offset
+        else:
+            label = bucket * self.duration * _NS - self._offset
+            if self.bar is not None and label == self.bar['datetime']:
+                label = dt  # 对齐区间被交易时段切开，后一段以其第一根K线的时间为K线时间
+        if self.bar is not None:
+            self.completed = self.bar
+        day_text = np.datetime_as_string(np.datetime64(day, 'D'))
+        self.bar = {'datetime': label, 'open': float(open), 'high': math.nan, 'low': math.nan, 'close': math.nan,
+                    'volume': 0.0, 'open_oi': float(open_oi), 'close_oi': math.nan,
+                    'trading_day': int(day_text.replace('-', ''))}
+        self._day, self._bucket = day, bucket
+        self._parts = 1
+        self._acc = (-math.inf, math.inf, 0.0)
+        self._set_last(high, low, close, volume, close_oi)
+        self.count += 1
+        return True
+
+    def _set_last(self, high, low, close, volume, close_oi):
+        """用最后一根基础K线和之前的聚合结果计算当前高周期K线。"""
+        acc_high, acc_low, acc_volume = self._acc
+        bar = self.bar
+        bar['high'] = max(acc_high, float(high))
+        bar['low'] = min(acc_low, float(low))
+        bar['close'] = float(close)
+        bar['volume'] = acc_volume + float(volume)
+        bar['close_oi'] = float(close_oi)
+
+
+if __name__ == "__main__":
+    # 合成一段包含夜盘、周末和午休的分钟线，验证向量化与增量聚合一致
+    sessions = [("21:00", "23:00"), ("09:00", "10:15"), ("10:30", "11:30"), ("13:30", "15:00")]
+    times = []
+    for day in pd.bdate_range("2024-03-04", "2024-03-15"):  # 每个工作日的夜盘属于下一个交易日
+        for start, end in sessions:
+            begin = pd.Timestamp(f"{day.date()} {start}")
+            if start == "21:00":
+                begin -= pd.Timedelta(days=3 if day.dayofweek == 0 else 1)
+            times.extend(pd.date_range(begin, begin + (pd.Timestamp(end) - pd.Timestamp(start)),
+                                       freq='min', inclusive='left'))
+    local = pd.DatetimeIndex(times)
+    rng = np.random.default_rng(0)
+    n = len(local)
+    close = 3500 + np.cumsum(rng.normal(0, 2, n))
+    minute = pd.DataFrame({
+        'datetime': (local - pd.Timedelta(hours=8)).as_unit('ns').asi8,
+        'open': close + rng.normal(0, 1, n),
+        'high': close + 2,
+        'low': close - 2,
+        'close': close,
+        'volume': rng.integers(1, 100, n).astype(np.float64),
+        'close_oi': rng.integers(1000, 2000, n).astype(np.float64),
+    })
+
+    for duration in (5 * 60, 15 * 60, 3600, DAILY):
+        bars, index = resample(minute, duration, return_index=True)
+        resampler = Resampler(duration)
+        rows = []
+        for row in minute.itertuples(index=False):
+            # 先推送一个未完成的版本，再推送最终数据
+            started = resampler.update(row.datetime, row.open, row.open + 1, row.open - 1, row.open, row.volume / 2)
+            resampler.update(row.datetime, row.open, row.high, row.low, row.close, row.volume, close_oi=row.close_oi)
+            if started and resampler.completed:
+                rows.append(resampler.completed)
+        rows.append(resampler.bar)
+        incremental = pd.DataFrame(rows)[RESAMPLE_COLUMNS]
+        pd.testing.assert_frame_equal(bars, incremental, check_dtype=False)
+        assert bars['datetime'].is_unique and (np.diff(index) >= 0).all() and index[-1] == len(bars) - 1
+        assert bars['volume'].sum() == minute['volume'].sum()
+        print(f"{duration:>6} 秒: {len(bars)} 根K线")
+
+    daily = resample(minute, DAILY)
+    # 周五夜盘归入下周一：2024-03-08（周五）21:00 的分钟线属于 20240311
+    friday_night = int((pd.Timestamp("2024-03-08 21:00") - pd.Timedelta(hours=8)).value)
+    assert trading_days([friday_night])[0] == np.datetime64('2024-03-11')
+    assert list(daily['trading_day'][:2]) == [20240304, 20240305] and len(daily) == 10
+    print("向量化与增量聚合结果一致")
@@ -0,0 +1,206 @@
+# robustness.py
+
+"""
+双均线策略的蒙特卡洛 / 自助法（bootstrap）稳健性检验。
+
+一年 243 根日线只是一条历史路径，很难说明 12/26 这组参数是否稳健。
+这里从基础K线序列的收益率中重抽样生成大量价格路径：
+    - block_size = 1：逐根独立重抽样（iid bootstrap），破坏所有自相关；
+    - block_size > 1：按长度为 block_size 的连续块重抽样（循环移动块 bootstrap），保留块内的趋势和波动聚集。
+每根K线抽取的是 (开盘跳空, 收盘收益率) 这一对对数收益率，开盘价和收盘价的关系因此保持不变。
+
+所有路径组成 (路径数 × K线数) 的二维数组，均线、交叉信号、持仓和权益都对整批路径一次计算
+（tdxfunc.MA / CROSS 的二维形式和 vector_backtest.simulate_positions_batch），
+指标由 analytics 按行计算。路径按 chunk_size 分块生成和回测，内存占用只与块大小有关，
+10 万条路径也不需要一次放进内存。
+
+    python robustness.py --csv test/000001_SZ_daily_20230101_20231231.csv --paths 100000 --block 10
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import analytics
+from vector_backtest import dual_ma_signals, prepare_klines, simulate_positions_batch
+
+PATH_COLUMNS = ['path', 'short', 'long', 'total_return', 'max_drawdown', 'sharpe', 'calmar', 'trade_count']
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def log_returns(open_, close) -> tuple:
+    """基础序列的 (开盘跳空, 收盘收益率) 对数收益率，长度为K线数 - 1。"""
+    open_ = np.asarray(open_, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    gap = np.log(open_[1:] / close[:-1])
+    ret = np.log(close[1:] / close[:-1])
+    return gap, ret
+
+
+def bootstrap_paths(open_, close, n_paths: int, block_size: int = 1, rng=None) -> tuple:
+    """
+    由基础序列重抽样生成 n_paths 条与基础序列等长的价格路径。
+
+    Args:
+        open_: 基础序列的开盘价。
+        close: 基础序列的收盘价。
+        n_paths (int): 路径数。
+        block_size (int): 重抽样的块长度，1 为逐根独立重抽样。
+        rng (np.random.Generator): 随机数生成器。
+
+    Returns:
+        tuple: (open, close)，形状均为 (n_paths, K线数)，第一根K线与基础序列相同。
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    gap, ret = log_returns(open_, close)
+    m = len(ret)
+    if m == 0:
+        raise ValueError("基础序列至少需要 2 根K线")
+    if block_size < 1:
+        raise ValueError("block_size 必须 >= 1")
+    n_blocks = -(-m // block_size)
+    # 循环移动块：块起点均匀分布，越过末尾后从头接续
+    starts = rng.integers(0, m, size=(n_paths, n_blocks))
+    index = (starts[:, :, np.newaxis] + np.arange(block_size)).reshape(n_paths, -1)[:, :m] % m
+
+    log_close = np.empty((n_paths, m + 1))
+    log_close[:, 0] = np.log(close[0])
+    np.cumsum(ret[index], axis=1, out=log_close[:, 1:])
+    log_close[:, 1:] += log_close[:, :1]
+    path_close = np.exp(log_close)
+    path_open = np.empty_like(path_close)
+    path_open[:, 0] = open_[0]
+    path_open[:, 1:] = path_close[:, :-1] * np.exp(gap[index])
+    return path_open, path_close
+
+
+def _evaluate_chunk(path_open, path_close, params, initial_capital, invest_ratio, volume_multiple,
+                    periods_per_year) -> list:
+    rows = []
+    for short, long in params:
+        _, _, signal = dual_ma_signals(path_close, short, long)
+        sim = simulate_positions_batch(path_open, path_close, signal, initial_capital, invest_ratio,
+                                       volume_multiple)
+        m = analytics.equity_metrics(sim['balance'], initial_capital, periods_per_year)
+        rows.append({'short': short, 'long': long, 'total_return': m['total_return'],
+                     'max_drawdown': m['max_drawdown'], 'sharpe': m['sharpe'], 'calmar': m['calmar'],
+                     'trade_count': sim['fills']})
+    return rows
+
+
+def run_monte_carlo(klines: pd.DataFrame, n_paths: int = 10_000, block_size: int = 10, params=((12, 26),),
+                    initial_capital: float = 1_000_000, invest_ratio: float = 0.2, volume_multiple: float = 1,
+                    chunk_size: int = 10_000, seed: int = 0, periods_per_year: float = analytics.PERIODS_PER_YEAR):
+    """
+    在重抽样路径上回测双均线策略。
+
+    同一批路径上依次回测 params 中的每组参数，便于比较不同参数在相同路径上的表现。
+    第 k 块路径使用由 seed 派生的第 k 个随机数种子，结果由 (seed, chunk_size) 唯一确定。
+
+    Args:
+        klines (pd.DataFrame): 基础K线，格式见 vector_backtest.prepare_klines。
+        n_paths (int): 路径数。
+        block_size (int): 重抽样的块长度，1 为逐根独立重抽样。
+        params: [(short, long), ...] 参数列表。
+        initial_capital (float): 初始本金。
+        invest_ratio (float): 每次投入权益的比例。
+        volume_multiple (float): 合约乘数。
+        chunk_size (int): 每块的路径数，决定内存占用（约 chunk_size × K线数 × 8 字节 × 十余个数组）。
+        seed (int): 随机数种子。
+        periods_per_year (float): 每年的K线数，用于年化夏普和卡玛。
+
+    Returns:
+        tuple: (paths, base)
+            paths：每条路径每组参数一行，列见 PATH_COLUMNS；
+            base：基础序列本身的回测结果，每组参数一行，列同上（path 为 -1）。
+    """
+    df = prepare_klines(klines)
+    open_ = df['open'].to_numpy(dtype=np.float64)
+    close = df['close'].to_numpy(dtype=np.float64)
+    params = [tuple(p) for p in params]
+    settings = (initial_capital, invest_ratio, volume_multiple, periods_per_year)
+
+    frames = []
+    seeds = np.random.SeedSequence(seed).spawn(-(-n_paths // chunk_size)) if n_paths else []
+    for k, chunk_seed in enumerate(seeds):
+        size = min(chunk_size, n_paths - k * chunk_size)
+        path_open, path_close = bootstrap_paths(open_, close, size, block_size, np.random.default_rng(chunk_seed))
+        for row in _evaluate_chunk(path_open, path_close, params, *settings):
+            frames.append(pd.DataFrame(dict(path=np.arange(k * chunk_size, k * chunk_size + size), **row)))
+        del path_open, path_close
+
+    base = pd.concat([pd.DataFrame(dict(path=[-1], **row))
+                      for row in _evaluate_chunk(open_[np.newaxis], close[np.newaxis], params, *settings)],
+                     ignore_index=True)[PATH_COLUMNS]
+    paths = pd.concat(frames, ignore_index=True)[PATH_COLUMNS] if frames else pd.DataFrame(columns=PATH_COLUMNS)
+    return paths, base
+
+
+def summarize(paths: pd.DataFrame, base: pd.DataFrame = None, quantiles=QUANTILES) -> pd.DataFrame:
+    """
+    每组参数的指标分布：均值、分位数、亏损概率，以及基础序列的结果在路径分布中的百分位。
+
+    Returns:
+        pd.DataFrame: 索引为 (short, long, 指标)，列为 mean, q5, q25, ..., loss_prob, base, base_pct。
+    """
+    metrics = ['total_return', 'max_drawdown', 'sharpe', 'calmar', 'trade_count']
+    rows = []
+    for (short, long), group in paths.groupby(['short', 'long'], sort=False):
+        for metric in metrics:
+            values = group[metric].to_numpy(dtype=np.float64)
+            values = values[np.isfinite(values)]
+            row = {'short': short, 'long': long, 'metric': metric,
+                   'mean': values.mean() if len(values) else np.nan}
+            qs = np.quantile(values, quantiles) if len(values) else np.full(len(quantiles), np.nan)
+            row.update({f"q{round(q * 100)}": v for q, v in zip(quantiles, qs)})
+            if metric == 'total_return':
+                row['loss_prob'] = float(np.mean(values < 0)) if len(values) else np.nan
+            if base is not None:
+                b = base[(base['short'] == short) & (base['long'] == long)][metric]
+                if len(b):
+                    row['base'] = float(b.iloc[0])
+                    row['base_pct'] = float(np.mean(values <= row['base'])) if len(values) else np.nan
+            rows.append(row)
+    return pd.DataFrame(rows).set_index(['short', 'long', 'metric'])
+
+
+def _parse_pairs(text: str) -> list:
+    """解析 "12/26,5/20" 形式的参数列表。"""
+    pairs = []
+    for part in text.split(','):
+        short, long = part.split('/')
+        pairs.append((int(short), int(long)))
+    return pairs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="双均线策略的 bootstrap 稳健性检验")
+    parser.add_argument('--csv', required=True, help="基础K线 CSV 文件（TqSdk 导出或 Tushare 日线格式）")
+    parser.add_argument('--paths', type=int, default=10_000, help="路径数")
+    parser.add_argument('--block', type=int, default=10, help="重抽样块长度，1 为逐根独立重抽样")
+    parser.add_argument('--params', default='12/26', help="参数列表，例如 12/26,5/20")
+    parser.add_argument('--ratio', type=float, default=0.2, help="每次投入权益的比例")
+    parser.add_argument('--capital', type=float, default=1_000_000, help="初始本金")
+    parser.add_argument('--multiple', type=float, default=1, help="合约乘数")
+    parser.add_argument('--chunk', type=int, default=10_000, help="每块的路径数")
+    parser.add_argument('--seed', type=int, default=0, help="随机数种子")
+    parser.add_argument('--output', default=None, help="保存每条路径结果的 CSV 文件")
+    args = parser.parse_args(argv)
+
+    klines = pd.read_csv(args.csv, encoding='utf-8-sig')
+    start = time.perf_counter()
+    paths, base = run_monte_carlo(klines, args.paths, args.block, _parse_pairs(args.params), args.capital,
+                                  args.ratio, args.multiple, args.chunk, args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"{args.paths} 条路径 x {len(prepare_klines(klines))} 根K线，块长度 {args.block}，耗时 {elapsed:.2f} 秒")
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(summarize(paths, base).round(4))
+    if args.output:
+        paths.to_csv(args.output, index=False)
+        print(f"每条路径的结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
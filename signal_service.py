@@ -0,0 +1,294 @@
+# signal_service.py
+
+"""
+单个 TqApi 连接上的多合约双均线信号服务（协程版）。
+
+run_dual_ma_strategy 是阻塞的 wait_update 循环，一个进程只能盯一个合约。
+SignalService 为每个合约创建一个协程任务（api.create_task），任务通过
+api.register_update_notify(klines) 等待该合约的K线更新，用增量均线（indicators.SMA）
+在每根新K线上 O(1) 判断金叉 / 死叉；主线程只需不断调用 api.wait_update()，
+所有合约共用同一个连接和同一个事件循环：
+
+    api = TqApi(auth=...)
+    service = SignalService(api, ["SHFE.cu2401", "SHFE.rb2401", ...], short_period=12, long_period=26)
+    service.run()          # 内部循环调用 api.wait_update()
+
+信号经 SignalDispatcher 交给处理函数（默认设置目标持仓），分发带背压：
+    - 同一合约尚未处理的信号被新信号覆盖（目标持仓只需最新值）；
+    - 待处理的合约数达到 max_pending 时，产生信号的任务在 put 处等待，直到分发任务腾出位置；
+    - 处理函数可以是普通函数或协程函数（例如推送到外部系统），慢的处理函数不会让队列无限增长。
+
+replay.ReplayApi 同样实现了 create_task / register_update_notify，可以用合成K线离线测试。
+"""
+
+import asyncio
+import inspect
+from collections import OrderedDict
+
+import numpy as np
+
+from event_log import EventSink
+from indicators import SMA
+from tqcompat import finished_exceptions, target_pos_task
+
+
+class Signal:
+    """一条交易信号：合约、K线时间（纳秒）、类型（golden / dead）和目标持仓。"""
+
+    __slots__ = ('symbol', 'datetime', 'kind', 'target')
+
+    def __init__(self, symbol: str, datetime, kind: str, target: int):
+        self.symbol = symbol
+        self.datetime = datetime
+        self.kind = kind
+        self.target = target
+
+    def __repr__(self):
+        return f"Signal({self.symbol}, {self.datetime}, {self.kind}, {self.target})"
+
+
+class SignalDispatcher:
+    """
+    带背压的信号分发：按合约合并未处理的信号，待处理合约数有上限。
+
+    Args:
+        handler (callable): handler(signal)，可以返回 awaitable。
+        max_pending (int): 最多同时等待分发的合约数。
+    """
+
+    def __init__(self, handler, max_pending: int = 256):
+        if max_pending < 1:
+            raise ValueError("max_pending 必须 >= 1")
+        self.handler = handler
+        self.max_pending = max_pending
+        self._pending = OrderedDict()  # 合约 -> 最新的未处理信号，按首次进入队列的顺序分发
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self.submitted = 0  # 收到的信号数
+        self.coalesced = 0  # 被同一合约的新信号覆盖的信号数
+        self.blocked = 0  # 因队列已满而等待的 put 次数
+        self.dispatched = 0  # 已交给处理函数的信号数
+        self.max_depth = 0  # 待处理合约数的峰值
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def put(self, signal: Signal):
+        """提交信号；同一合约已有未处理的信号时直接覆盖，队列已满时等待。"""
+        self.submitted += 1
+        if signal.symbol not in self._pending and len(self._pending) >= self.max_pending:
+            self.blocked += 1
+            while signal.symbol not in self._pending and len(self._pending) >= self.max_pending:
+                self._not_full.clear()
+                await self._not_full.wait()
+        if signal.symbol in self._pending:
+            self.coalesced += 1
+        self._pending[signal.symbol] = signal
+        self.max_depth = max(self.max_depth, len(self._pending))
+        self._not_empty.set()
+
+    async def run(self):
+        """分发任务：依次把信号交给处理函数，处理函数返回 awaitable 时等待其完成。"""
+        while True:
+            while not self._pending:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+            _, signal = self._pending.popitem(last=False)
+            self._not_full.set()
+            result = self.handler(signal)
+            if inspect.isawaitable(result):
+                await result
+            self.dispatched += 1
+
+    def stats(self) -> dict:
+        return {'submitted': self.submitted, 'coalesced': self.coalesced, 'blocked': self.blocked,
+                'dispatched': self.dispatched, 'pending': len(self._pending), 'max_depth': self.max_depth}
+
+
+class _CrossState:
+    """单个合约的增量均线状态。K线窗口里可能一次出现多根新K线（任务来不及处理时），逐根补算。"""
+
+    def __init__(self, short_period: int, long_period: int):
+        self.short_period = short_period
+        self.long_period = long_period
+        self.short_ma = SMA(short_period)
+        self.long_ma = SMA(long_period)
+        self.last_dt = None  # 最后处理的K线时间
+
+    def _cross(self) -> str:
+        s, l = self.short_ma, self.long_ma
+        if s.value > l.value and s.prev <= l.prev:
+            return 'golden'
+        if s.value < l.value and s.prev >= l.prev:
+            return 'dead'
+        return None
+
+    def on_klines(self, datetimes: np.ndarray, closes: np.ndarray) -> list:
+        """
+        处理K线窗口中新出现的K线，返回 [(K线时间, 信号类型), ...]。
+
+        与 run_dual_ma_strategy 相同：新K线出现时先用最终收盘价定稿上一根K线，再追加新K线。
+        """
+        valid = ~np.isnan(datetimes) if datetimes.dtype.kind == 'f' else np.ones(len(datetimes), dtype=bool)
+        datetimes, closes = datetimes[valid], closes[valid]
+        if len(datetimes) == 0 or datetimes[-1] == self.last_dt:
+            return []
+
+        found = np.flatnonzero(datetimes == self.last_dt) if self.last_dt is not None else ()
+        self.last_dt = datetimes[-1]
+        if len(found) == 0:
+            # 首次或缺失的K线超过窗口长度：用整个窗口重新预热，只判断最后一根K线
+            self.short_ma = SMA(self.short_period)
+            self.long_ma = SMA(self.long_period)
+            self.short_ma.extend(closes)
+            self.long_ma.extend(closes)
+            kind = self._cross()
+            return [(datetimes[-1], kind)] if kind else []
+
+        last = found[0]
+        self.short_ma.update(closes[last])
+        self.long_ma.update(closes[last])
+        signals = []
+        for i in range(last + 1, len(closes)):
+            self.short_ma.append(closes[i])
+            self.long_ma.append(closes[i])
+            kind = self._cross()
+            if kind:
+                signals.append((datetimes[i], kind))
+        return signals
+
+
+class SignalService:
+    """
+    多合约双均线信号服务：每个合约一个协程任务，共用一个 API 实例。
+
+    Args:
+        api: TqApi 实例，或 replay.ReplayApi 离线回放实例。
+        symbols (list): 合约代码列表。
+        short_period (int): 短周期均线窗口。
+        long_period (int): 长周期均线窗口。
+        volume (int): 金叉时的目标持仓手数，死叉时目标持仓为 0。
+        kline_duration (int): K 线周期，单位为秒。
+        params (dict): 按合约覆盖参数：{合约代码: {short, long, volume}}，均可省略。
+        handler (callable): 信号处理函数 handler(signal)，可以是协程函数；默认按信号设置目标持仓。
+        max_pending (int): 最多同时等待分发的合约数，超过时产生信号的任务等待。
+        sink (EventSink): 信号日志输出，默认在后台线程打印到控制台 (上海时区)；传入 NullSink() 可完全静默。
+    """
+
+    def __init__(self, api, symbols, short_period: int = 12, long_period: int = 26, volume: int = 1,
+                 kline_duration: int = 24 * 60 * 60, params: dict = None, handler=None, max_pending: int = 256,
+                 sink: EventSink = None):
+        params = params or {}
+        unknown = set(params) - set(symbols)
+        if unknown:
+            raise ValueError(f"参数中包含不在合约列表里的合约: {sorted(unknown)}")
+        self.api = api
+        self.kline_duration = kline_duration
+        self.params = {}
+        for symbol in symbols:
+            p = {'short': short_period, 'long': long_period, 'volume': volume}
+            p.update(params.get(symbol, {}))
+            self.params[symbol] = p
+        self.dispatcher = SignalDispatcher(handler or self.set_target, max_pending)
+        self._own_sink = sink is None
+        self.sink = EventSink(tz='Asia/Shanghai') if sink is None else sink
+        self._target_tasks = {}
+        self.tasks = []
+
+    def set_target(self, signal: Signal):
+        """默认的信号处理：设置目标持仓。"""
+        task = self._target_tasks.get(signal.symbol)
+        if task is None:
+            task = self._target_tasks[signal.symbol] = target_pos_task(self.api, signal.symbol)
+        task.set_target_volume(signal.target)
+
+    async def _watch(self, symbol: str):
+        p = self.params[symbol]
+        # 与 run_dual_ma_strategy 相同，多取几根K线作为缓冲，任务偶尔来不及处理时也能逐根补算
+        klines = self.api.get_kline_serial(symbol, duration_seconds=self.kline_duration, data_length=p['long'] + 5)
+        state = _CrossState(p['short'], p['long'])
+        async with self.api.register_update_notify(klines) as update_chan:
+            async for _ in update_chan:
+                for dt, kind in state.on_klines(klines["datetime"].to_numpy(), klines["close"].to_numpy()):
+                    target = p['volume'] if kind == 'golden' else 0
+                    self.sink.signal("{datetime} {symbol} {kind} 目标持仓: {target} 手",
+                                     datetime=dt, symbol=symbol, kind="金叉" if kind == 'golden' else "死叉",
+                                     target=target)
+                    await self.dispatcher.put(Signal(symbol, dt, kind, target))
+
+    def start(self) -> list:
+        """创建各合约的任务和分发任务；任务在之后的 api.wait_update() 中运行。"""
+        if not self.tasks:
+            self.tasks = [self.api.create_task(self._watch(symbol)) for symbol in self.params]
+            self.tasks.append(self.api.create_task(self.dispatcher.run()))
+        return self.tasks
+
+    def run(self):
+        """启动任务并循环调用 api.wait_update()，直到回测结束（BacktestFinished）或被中断。"""
+        self.start()
+        try:
+            while True:
+                self.api.wait_update()
+        except (*finished_exceptions(), KeyboardInterrupt):
+            pass
+        finally:
+            if self._own_sink:
+                self.sink.close()
+            else:
+                self.sink.flush()
+
+
+if __name__ == "__main__":
+    # 用合成K线离线运行：每个合约的信号应与向量化的 CROSS 完全一致，
+    # 成交后的持仓应与信号一一对应
+    import time
+
+    import tdxfunc
+    from event_log import NullSink
+    from replay import ReplayApi
+    from vector_backtest import random_walk_klines
+
+    n_symbols, n_bars = 200, 500
+    feeds = {f"SIM.{i:03d}": random_walk_klines(n_bars, seed=i) for i in range(n_symbols)}
+    api = ReplayApi(feeds)
+    received = []
+    service = SignalService(api, list(feeds), short_period=5, long_period=20, volume=3,
+                            handler=received.append, max_pending=16, sink=NullSink())
+    start = time.perf_counter()
+    service.run()
+    elapsed = time.perf_counter() - start
+    api.close()
+
+    got = {}
+    for signal in received:
+        got.setdefault(signal.symbol, []).append((int(signal.datetime), signal.kind))
+    for symbol, df in feeds.items():
+        close = df['close'].to_numpy(dtype=float)
+        short_ma, long_ma = tdxfunc.MA(close, 5), tdxfunc.MA(close, 20)
+        golden = tdxfunc.CROSS(short_ma, long_ma)
+        dead = tdxfunc.CROSS(long_ma, short_ma)
+        dts = df['datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        expected = sorted([(int(dts[i]), 'golden') for i in np.flatnonzero(golden)] +
+                          [(int(dts[i]), 'dead') for i in np.flatnonzero(dead)])
+        assert got.get(symbol, []) == expected, symbol
+    stats = service.dispatcher.stats()
+    print(f"{n_symbols} 个合约 x {n_bars} 根K线，耗时 {elapsed:.2f} 秒"
+          f"（{n_symbols * n_bars / elapsed:,.0f} 根K线/秒），信号统计: {stats}")
+
+    # 慢的异步处理函数：队列有上限，同一合约的信号被合并
+    api = ReplayApi({s: df.iloc[:200] for s, df in list(feeds.items())[:50]})
+    handled = []
+
+    async def slow_handler(signal):
+        for _ in range(20):
+            await asyncio.sleep(0)
+        handled.append(signal)
+
+    service = SignalService(api, list(api._feeds), short_period=2, long_period=4,
+                            handler=slow_handler, max_pending=4, sink=NullSink())
+    service.run()
+    api.close()
+    stats = service.dispatcher.stats()
+    assert stats['max_depth'] <= 4 and stats['dispatched'] == len(handled)
+    assert stats['submitted'] == stats['dispatched'] + stats['coalesced'] + stats['pending']
+    print(f"慢处理函数: {stats}")
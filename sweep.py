@@ -0,0 +1,178 @@
+# sweep.py
+
+"""
+双均线参数（SHORT / LONG / INVEST_RATIO）并行扫描。
+
+价格数组只写入一次共享内存，各工作进程直接映射为 NumPy 视图，不会把K线数据
+pickle 到每个进程。每个进程按周期缓存均线，同一周期在进程内只计算一次。
+
+命令行示例：
+    python sweep.py --csv test/000001_SZ_daily_20230101_20231231.csv \
+        --short 5:20:1 --long 20:60:2 --ratio 0.1,0.2 --workers 8 --output sweep_results.csv
+"""
+
+import argparse
+import itertools
+import os
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+import pandas as pd
+
+import tdxfunc
+from vector_backtest import prepare_klines, simulate_positions
+
+SWEEP_COLUMNS = ['short', 'long', 'invest_ratio', 'total_return', 'max_drawdown', 'trade_count']
+
+# 工作进程内的全局状态（由 _init_worker 设置）
+_shm = None
+_open = None
+_close = None
+_ma_cache = {}
+_settings = {}
+
+
+def _init_worker(shm_name: str, n: int, initial_capital: float, volume_multiple: float):
+    """工作进程初始化：映射共享内存中的价格数组。"""
+    global _shm, _open, _close
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    prices = np.ndarray((2, n), dtype=np.float64, buffer=_shm.buf)
+    _open, _close = prices[0], prices[1]
+    _ma_cache.clear()
+    _settings.update(initial_capital=initial_capital, volume_multiple=volume_multiple)
+
+
+def _release_worker():
+    """释放共享内存映射（数组视图必须先于共享内存关闭）。"""
+    global _shm, _open, _close
+    _open = _close = None
+    _ma_cache.clear()
+    if _shm is not None:
+        _shm.close()
+        _shm = None
+
+
+def _get_ma(period: int) -> np.ndarray:
+    if period not in _ma_cache:
+        _ma_cache[period] = tdxfunc.MA(_close, period)
+    return _ma_cache[period]
+
+
+def _evaluate(params) -> tuple:
+    """回测一组参数，返回 (short, long, invest_ratio, 收益率, 最大回撤, 成交次数)。"""
+    short, long, invest_ratio = params
+    short_ma, long_ma = _get_ma(short), _get_ma(long)
+    signal = tdxfunc.CROSS(short_ma, long_ma).astype(np.int8) - tdxfunc.CROSS(long_ma, short_ma).astype(np.int8)
+    initial_capital = _settings['initial_capital']
+    sim = simulate_positions(_open, _close, signal, initial_capital, invest_ratio, _settings['volume_multiple'])
+    return (short, long, invest_ratio) + summarize_simulation(sim, initial_capital)
+
+
+def summarize_simulation(sim: dict, initial_capital: float) -> tuple:
+    """由 simulate_positions 的结果计算 (收益率, 最大回撤, 成交次数)。"""
+    balance = sim['balance']
+    if len(balance) == 0:
+        return 0.0, 0.0, 0
+    total_return = balance[-1] / initial_capital - 1
+    peak = np.maximum.accumulate(np.maximum(balance, initial_capital))
+    max_drawdown = float(np.max(1 - balance / peak))
+    trade_count = int(np.count_nonzero(~np.isnan(sim['fill_price'])))
+    return float(total_return), max_drawdown, trade_count
+
+
+def _evaluate_chunk(chunk) -> list:
+    return [_evaluate(params) for params in chunk]
+
+
+def build_grid(shorts, longs, invest_ratios) -> list:
+    """生成参数组合，自动去掉 short >= long 的无效组合。"""
+    return [(int(s), int(l), float(r)) for s, l, r in itertools.product(shorts, longs, invest_ratios) if s < l]
+
+
+def run_sweep(klines: pd.DataFrame, shorts, longs, invest_ratios=(0.2,), initial_capital: float = 1_000_000,
+              volume_multiple: float = 1, workers: int = None) -> pd.DataFrame:
+    """
+    对参数网格并行回测。
+
+    Args:
+        klines (pd.DataFrame): K线数据，格式见 vector_backtest.prepare_klines。
+        shorts: 短周期候选值。
+        longs: 长周期候选值。
+        invest_ratios: 投入比例候选值。
+        initial_capital (float): 初始本金。
+        volume_multiple (float): 合约乘数。
+        workers (int): 进程数，默认使用全部 CPU；为 1 时在当前进程内运行。
+
+    Returns:
+        pd.DataFrame: 每组参数一行，列为 short, long, invest_ratio, total_return, max_drawdown, trade_count。
+    """
+    df = prepare_klines(klines)
+    n = len(df)
+    grid = build_grid(shorts, longs, invest_ratios)
+    if not grid:
+        return pd.DataFrame(columns=SWEEP_COLUMNS)
+    workers = workers or os.cpu_count() or 1
+
+    shm = shared_memory.SharedMemory(create=True, size=max(2 * n * 8, 1))
+    try:
+        prices = np.ndarray((2, n), dtype=np.float64, buffer=shm.buf)
+        prices[0] = df['open'].to_numpy(dtype=np.float64)
+        prices[1] = df['close'].to_numpy(dtype=np.float64)
+        del prices
+        initargs = (shm.name, n, initial_capital, volume_multiple)
+
+        # 网格按短周期排序，连续切块可让同一块共用短周期均线缓存
+        chunk_size = max(1, len(grid) // (workers * 4))
+        chunks = [grid[i:i + chunk_size] for i in range(0, len(grid), chunk_size)]
+
+        if workers == 1:
+            _init_worker(*initargs)
+            try:
+                rows = [row for chunk in chunks for row in _evaluate_chunk(chunk)]
+            finally:
+                _release_worker()
+        else:
+            with Pool(processes=workers, initializer=_init_worker, initargs=initargs) as pool:
+                rows = [row for result in pool.imap(_evaluate_chunk, chunks) for row in result]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+
+
+def parse_values(text: str, cast=int) -> list:
+    """解析 "5,10,20" 或 "start:stop:step"（包含 stop）形式的参数列表。"""
+    if ':' in text:
+        start, stop, step = (float(x) for x in text.split(':'))
+        values = np.arange(start, stop + step / 2, step)
+        return [cast(round(v, 10)) for v in values]
+    return [cast(x) for x in text.split(',') if x]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="双均线参数并行扫描")
+    parser.add_argument('--csv', required=True, help="K线 CSV 文件（TqSdk 导出或 Tushare 日线格式）")
+    parser.add_argument('--short', default='12', help="短周期，例如 5,10 或 5:20:1")
+    parser.add_argument('--long', default='26', help="长周期，例如 20,30 或 20:60:2")
+    parser.add_argument('--ratio', default='0.2', help="投入比例，例如 0.1,0.2 或 0.1:0.5:0.1")
+    parser.add_argument('--capital', type=float, default=1_000_000, help="初始本金")
+    parser.add_argument('--multiple', type=float, default=1, help="合约乘数")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认使用全部 CPU")
+    parser.add_argument('--output', default='sweep_results.csv', help="结果保存路径")
+    args = parser.parse_args(argv)
+
+    klines = pd.read_csv(args.csv, encoding='utf-8-sig')
+    start = time.perf_counter()
+    results = run_sweep(klines, parse_values(args.short), parse_values(args.long),
+                        parse_values(args.ratio, float), args.capital, args.multiple, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"共回测 {len(results)} 组参数，耗时 {elapsed:.2f} 秒")
+    print(results.sort_values('total_return', ascending=False).head(10).to_string(index=False))
+    results.to_csv(args.output, index=False)
+    print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
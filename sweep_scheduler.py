@@ -0,0 +1,550 @@
+# sweep_scheduler.py
+
+"""
+可续跑的参数扫描调度器（内容寻址的结果缓存）。
+
+SHORT / LONG / INVEST_RATIO × 合约 × 日期区间的研究被拆成单个任务，每个任务的键是
+    数据指纹（该区间 datetime / open / close 的哈希）+ 参数 + 代码版本（回测引擎源码的哈希）
+的 SHA-256，结果以 JSON 保存在 <root>/results/<键前两位>/<键>.json：
+    - 已有结果的任务直接跳过，中断后重新运行只计算剩下的任务，相互重叠的研究共用结果；
+    - 数据或引擎代码变化后键随之改变，旧结果不会被误用。
+
+未完成的任务按数据集分批写入 <root>/queue/pending，工作进程用原子 rename 认领批次
+（pending -> running），每完成一个任务立即写入结果，批次完成后删除批次文件；
+运行中的批次定期更新修改时间作为心跳，超过 stale_timeout 没有心跳的批次（进程或机器崩溃）
+会被放回 pending。本机多进程和多台机器（共享文件系统上的同一个 root）使用同一套队列：
+
+    # 单机：提交、本机并行计算、汇总；中断后重新执行同一命令即可续跑
+    python sweep_scheduler.py run --csv test/000001_SZ_daily_20230101_20231231.csv \
+        --short 5:20:1 --long 20:60:2 --ratio 0.1,0.2 --root sweep_jobs --workers 8
+
+    # 多台机器：一台提交，各台机器拉取，全部完成后再次 run 直接从结果缓存汇总
+    python sweep_scheduler.py submit --store daily_store --symbols 000001.SZ,600000.SH \
+        --start 2020-01-01 --end 2023-12-31 --short 5:20:1 --long 20:60:2 --root /mnt/shared/jobs
+    python sweep_scheduler.py work --root /mnt/shared/jobs --workers 8
+    python sweep_scheduler.py status --root /mnt/shared/jobs
+
+单个任务的回测与 sweep.run_sweep 相同（vector_backtest.simulate_positions，
+与 backtest.BARSLAST 的逐K线回放结果一致）。数据源（CSV 路径或列式存储目录）必须能被
+所有工作机器以相同路径访问；工作进程读取数据后会校验数据指纹，数据被改动的批次记为失败。
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import socket
+import time
+from functools import lru_cache
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+import tdxfunc
+from sweep import build_grid, parse_values, summarize_simulation
+from vector_backtest import prepare_klines, simulate_positions
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# 影响回测结果的源码，任意一个改动都会使旧结果失效
+CODE_FILES = ('tdxfunc.py', 'vector_backtest.py', 'sweep.py', 'sweep_scheduler.py')
+JOB_COLUMNS = ['symbol', 'start', 'end', 'short', 'long', 'invest_ratio']
+RESULT_COLUMNS = JOB_COLUMNS + ['total_return', 'max_drawdown', 'trade_count', 'key']
+DEFAULT_STALE_TIMEOUT = 600  # 秒
+
+# 工作进程内按数据源缓存的价格和均线
+_datasets = {}
+
+
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    """回测引擎源码（CODE_FILES）的哈希。"""
+    h = hashlib.sha256()
+    for name in CODE_FILES:
+        with open(os.path.join(ROOT_DIR, name), 'rb') as f:
+            h.update(name.encode() + b'\0' + f.read() + b'\0')
+    return h.hexdigest()[:16]
+
+
+def _write_json(path: str, obj):
+    """先写临时文件再替换，读者不会看到写了一半的文件（共享文件系统上同样适用）。"""
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+# ---------- 数据 ----------
+
+def load_prices(source: dict) -> dict:
+    """
+    读取数据源在 [start, end] 区间内的价格。
+
+    Args:
+        source (dict): {'csv': 路径} 或 {'store': 列式存储目录, 'symbol': 合约}，
+            可选 'start' / 'end'（'YYYY-MM-DD'，包含端点）。
+
+    Returns:
+        dict: datetime（纳秒 int64）、open、close 三个数组。
+    """
+    if 'store' in source:
+        from columnar_store import ColumnarStore
+        df = ColumnarStore(source['store']).frame(source['symbol'], source.get('start'), source.get('end'),
+                                                  columns=['trade_date', 'open', 'close'])
+        df = prepare_klines(df)
+    else:
+        df = prepare_klines(pd.read_csv(source['csv'], encoding='utf-8-sig'))
+        if source.get('start'):
+            df = df[df['datetime'] >= pd.Timestamp(source['start'])]
+        if source.get('end'):
+            df = df[df['datetime'] < pd.Timestamp(source['end']) + pd.Timedelta(days=1)]
+    return {
+        'datetime': df['datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64),
+        'open': df['open'].to_numpy(dtype=np.float64),
+        'close': df['close'].to_numpy(dtype=np.float64),
+    }
+
+
+def fingerprint(prices: dict) -> str:
+    """价格数据的指纹：datetime、open、close 的字节内容哈希。"""
+    h = hashlib.blake2b(digest_size=16)
+    for name in ('datetime', 'open', 'close'):
+        values = np.ascontiguousarray(prices[name])
+        h.update(f"{name}:{values.dtype.str}:{len(values)}".encode())
+        h.update(values.tobytes())
+    return h.hexdigest()
+
+
+def _dataset(source: dict, expected: str) -> dict:
+    """工作进程内缓存的数据集（价格和均线），指纹与提交时不一致时抛出 ValueError。"""
+    cache_key = json.dumps(source, sort_keys=True)
+    data = _datasets.get(cache_key)
+    if data is None:
+        prices = load_prices(source)
+        data = {'prices': prices, 'fingerprint': fingerprint(prices)}
+        if len(_datasets) >= 8:
+            _datasets.pop(next(iter(_datasets)))
+        _datasets[cache_key] = data
+    if data['fingerprint'] != expected:
+        raise ValueError(f"数据源 {source} 的内容与提交任务时不一致")
+    return data
+
+
+# ---------- 任务 ----------
+
+def job_key(data_fingerprint: str, short: int, long: int, invest_ratio: float,
+            initial_capital: float, volume_multiple: float) -> str:
+    """任务的内容寻址键：数据指纹 + 参数 + 代码版本。"""
+    payload = {
+        'data': data_fingerprint,
+        'code': code_version(),
+        'short': int(short),
+        'long': int(long),
+        'invest_ratio': float(invest_ratio),
+        'initial_capital': float(initial_capital),
+        'volume_multiple': float(volume_multiple),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def build_jobs(sources, shorts, longs, invest_ratios=(0.2,), initial_capital: float = 1_000_000,
+               volume_multiple: float = 1) -> list:
+    """
+    生成研究的全部任务，每个数据源只读取一次以计算指纹。
+
+    Args:
+        sources (list): 数据源列表，格式见 load_prices；可带 'label' 作为结果中的合约名。
+        shorts, longs, invest_ratios: 参数候选值（short >= long 的组合自动去掉）。
+        initial_capital (float): 初始本金。
+        volume_multiple (float): 合约乘数。
+
+    Returns:
+        list: 任务 dict，包含 key、source、fingerprint、参数和结果中的标识列。
+    """
+    grid = build_grid(shorts, longs, invest_ratios)
+    jobs = []
+    for source in sources:
+        source = dict(source)
+        label = source.pop('label', None) or source.get('symbol') or os.path.basename(source.get('csv', ''))
+        fp = fingerprint(load_prices(source))
+        for short, long, ratio in grid:
+            jobs.append({
+                'key': job_key(fp, short, long, ratio, initial_capital, volume_multiple),
+                'source': source,
+                'fingerprint': fp,
+                'symbol': label,
+                'start': source.get('start'),
+                'end': source.get('end'),
+                'short': short,
+                'long': long,
+                'invest_ratio': ratio,
+                'initial_capital': float(initial_capital),
+                'volume_multiple': float(volume_multiple),
+            })
+    return jobs
+
+
+def evaluate_job(job: dict) -> dict:
+    """回测一个任务，返回 (收益率, 最大回撤, 成交次数)；同一数据集的均线在进程内只计算一次。"""
+    data = _dataset(job['source'], job['fingerprint'])
+    prices = data['prices']
+    mas = data.setdefault('ma', {})
+    for period in (job['short'], job['long']):
+        if period not in mas:
+            mas[period] = tdxfunc.MA(prices['close'], period)
+    short_ma, long_ma = mas[job['short']], mas[job['long']]
+    signal = tdxfunc.CROSS(short_ma, long_ma).astype(np.int8) - tdxfunc.CROSS(long_ma, short_ma).astype(np.int8)
+    sim = simulate_positions(prices['open'], prices['close'], signal, job['initial_capital'],
+                             job['invest_ratio'], job['volume_multiple'])
+    total_return, max_drawdown, trade_count = summarize_simulation(sim, job['initial_capital'])
+    return {'total_return': total_return, 'max_drawdown': max_drawdown, 'trade_count': trade_count}
+
+
+# ---------- 结果缓存和队列 ----------
+
+class ResultStore:
+    """
+    内容寻址的结果目录：每个任务一个 JSON 文件，写入是原子的，可被多个进程和机器共享。
+
+    Args:
+        root (str): 目录，结果保存在 root/<键前两位>/<键>.json。
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> dict:
+        """读取结果，不存在时返回 None。"""
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, record: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_json(path, record)
+
+
+class JobQueue:
+    """
+    共享目录上的批次队列：pending / running / failed 三个子目录，批次在目录间 rename 即状态转换。
+
+    Args:
+        root (str): 队列目录。
+        stale_timeout (float): running 中的批次超过该秒数没有心跳时视为认领者已崩溃。
+    """
+
+    def __init__(self, root: str, stale_timeout: float = DEFAULT_STALE_TIMEOUT):
+        self.root = root
+        self.stale_timeout = stale_timeout
+        self.dirs = {name: os.path.join(root, name) for name in ('pending', 'running', 'failed')}
+        for d in self.dirs.values():
+            os.makedirs(d, exist_ok=True)
+
+    def push(self, batch: list) -> str:
+        """加入一个批次（任务列表），批次名由其中的任务键决定，重复提交同一批次只保留一份。"""
+        batch_id = hashlib.sha256("".join(job['key'] for job in batch).encode()).hexdigest()[:24]
+        _write_json(os.path.join(self.dirs['pending'], f"{batch_id}.json"), batch)
+        return batch_id
+
+    def claim(self):
+        """认领一个待处理批次，返回 (running 中的路径, 任务列表)；没有时返回 (None, None)。"""
+        for name in sorted(os.listdir(self.dirs['pending'])):
+            if not name.endswith('.json'):
+                continue
+            running = os.path.join(self.dirs['running'], name)
+            try:
+                os.rename(os.path.join(self.dirs['pending'], name), running)
+            except FileNotFoundError:
+                continue  # 被其他进程抢先认领
+            os.utime(running)
+            with open(running, 'r', encoding='utf-8') as f:
+                return running, json.load(f)
+        return None, None
+
+    @staticmethod
+    def heartbeat(path: str):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def release(self, path: str):
+        """放回 pending（例如被 Ctrl+C 中断），其他进程可以立即认领。"""
+        try:
+            os.rename(path, os.path.join(self.dirs['pending'], os.path.basename(path)))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def complete(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # 批次超时后被放回队列又被再次完成
+
+    def fail(self, path: str, error: str):
+        """把批次移到 failed，并在旁边记录错误信息。"""
+        name = os.path.basename(path)
+        try:
+            os.rename(path, os.path.join(self.dirs['failed'], name))
+        except FileNotFoundError:
+            return
+        with open(os.path.join(self.dirs['failed'], name + ".error"), 'w', encoding='utf-8') as f:
+            f.write(error)
+
+    def requeue_stale(self) -> int:
+        """把心跳超时的批次放回 pending，返回放回的数量。"""
+        now = time.time()
+        count = 0
+        for name in os.listdir(self.dirs['running']):
+            path = os.path.join(self.dirs['running'], name)
+            try:
+                if now - os.path.getmtime(path) > self.stale_timeout:
+                    os.rename(path, os.path.join(self.dirs['pending'], name))
+                    count += 1
+            except FileNotFoundError:
+                continue
+        return count
+
+    def clear_finished(self, store) -> int:
+        """
+        删除 running 中所有任务都已有结果的批次（认领者在完成后、删除批次文件前崩溃，
+        或者批次已被重新提交并完成），返回删除的数量。
+        """
+        count = 0
+        for name in os.listdir(self.dirs['running']):
+            path = os.path.join(self.dirs['running'], name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    batch = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue  # 刚被完成或正在写入
+            if all(job['key'] in store for job in batch):
+                self.complete(path)
+                count += 1
+        return count
+
+    def counts(self) -> dict:
+        return {name: sum(1 for f in os.listdir(d) if f.endswith('.json')) for name, d in self.dirs.items()}
+
+
+def _store_and_queue(root: str, stale_timeout: float = DEFAULT_STALE_TIMEOUT):
+    return ResultStore(os.path.join(root, "results")), JobQueue(os.path.join(root, "queue"), stale_timeout)
+
+
+# ---------- 调度 ----------
+
+def submit(root: str, jobs: list, batch_size: int = 256, workers: int = None) -> dict:
+    """
+    把尚无结果的任务按数据集分批加入队列。
+
+    同一批次只包含同一个数据集的任务，并按短周期排序，工作进程可以共用已读取的价格和均线。
+    指定 workers 时批次大小不超过 ceil(入队任务数 / workers)，任务较少时每个进程也都能分到批次。
+
+    Returns:
+        dict: {'total': 任务数, 'cached': 已有结果的任务数, 'queued': 入队任务数, 'batches': 批次数}。
+    """
+    store, queue = _store_and_queue(root)
+    todo = {}
+    cached = 0
+    for job in jobs:
+        if job['key'] in store:
+            cached += 1
+        else:
+            todo.setdefault(job['fingerprint'], {})[job['key']] = job  # 同一研究中的重复任务只算一次
+    queued = sum(len(g) for g in todo.values())
+    if workers and queued:
+        batch_size = min(batch_size, math.ceil(queued / workers))
+    batches = 0
+    for group in todo.values():
+        group = sorted(group.values(), key=lambda j: (j['short'], j['long'], j['invest_ratio']))
+        for i in range(0, len(group), batch_size):
+            queue.push(group[i:i + batch_size])
+            batches += 1
+    return {'total': len(jobs), 'cached': cached, 'queued': queued, 'batches': batches}
+
+
+def work(root: str, wait: bool = False, poll_interval: float = 5.0,
+         stale_timeout: float = DEFAULT_STALE_TIMEOUT) -> int:
+    """
+    工作循环：认领批次、逐个计算并写入结果，直到队列为空。
+
+    Args:
+        root (str): 调度目录（本机或共享文件系统）。
+        wait (bool): 队列为空且仍有批次在运行时继续等待（用于接手其他机器超时的批次）。
+        poll_interval (float): 等待时的轮询间隔（秒）。
+        stale_timeout (float): 心跳超时时间（秒）。
+
+    Returns:
+        int: 本进程完成的任务数。
+    """
+    store, queue = _store_and_queue(root, stale_timeout)
+    done = 0
+    while True:
+        queue.requeue_stale()
+        path, batch = queue.claim()
+        if path is None:
+            if wait and queue.counts()['running']:
+                time.sleep(poll_interval)
+                continue
+            return done
+        last_beat = time.time()
+        try:
+            for job in batch:
+                if job['key'] in store:
+                    continue  # 其他进程或之前的运行已经算过
+                record = {c: job[c] for c in JOB_COLUMNS}
+                record.update(evaluate_job(job), code=code_version(), data=job['fingerprint'])
+                store.put(job['key'], record)
+                done += 1
+                if time.time() - last_beat > stale_timeout / 4:
+                    queue.heartbeat(path)
+                    last_beat = time.time()
+        except Exception as e:
+            import traceback
+            queue.fail(path, traceback.format_exc())
+            print(f"批次 {os.path.basename(path)} 失败: {e}")
+            continue
+        except BaseException:
+            queue.release(path)
+            raise
+        queue.complete(path)
+
+
+def run_local(root: str, workers: int = None, stale_timeout: float = DEFAULT_STALE_TIMEOUT) -> int:
+    """在本机用 workers 个进程运行 work，返回完成的任务数。"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return work(root, stale_timeout=stale_timeout)
+    with Pool(processes=workers) as pool:
+        return sum(pool.starmap(work, [(root, False, 5.0, stale_timeout)] * workers))
+
+
+def collect(root: str, jobs: list) -> pd.DataFrame:
+    """
+    从结果缓存汇总研究的结果（每个任务一行，按任务顺序）。尚未完成的任务各指标为 NaN。
+    """
+    store = ResultStore(os.path.join(root, "results"))
+    rows = []
+    for job in jobs:
+        record = store.get(job['key']) or {}
+        rows.append([job[c] for c in JOB_COLUMNS]
+                    + [record.get('total_return', np.nan), record.get('max_drawdown', np.nan),
+                       record.get('trade_count', np.nan), job['key']])
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+def run_study(root: str, sources, shorts, longs, invest_ratios=(0.2,), initial_capital: float = 1_000_000,
+              volume_multiple: float = 1, workers: int = None, batch_size: int = 256) -> pd.DataFrame:
+    """
+    提交、本机并行计算并汇总一项研究。已有结果的任务不会重算，中断后再次调用即从断点继续；
+    上次崩溃时留在 running 中、任务已全部有结果的批次会被清除。
+
+    Args:
+        root (str): 调度目录（结果缓存和队列）。
+        sources (list): 数据源列表，格式见 load_prices。
+        shorts, longs, invest_ratios: 参数候选值。
+        initial_capital (float): 初始本金。
+        volume_multiple (float): 合约乘数。
+        workers (int): 本机进程数，默认使用全部 CPU。
+        batch_size (int): 每个批次的最大任务数（任务较少时按 workers 均分）。
+
+    Returns:
+        pd.DataFrame: 列见 RESULT_COLUMNS。
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = build_jobs(sources, shorts, longs, invest_ratios, initial_capital, volume_multiple)
+    info = submit(root, jobs, batch_size, workers)
+    print(f"共 {info['total']} 个任务，已有结果 {info['cached']} 个，入队 {info['queued']} 个（{info['batches']} 批）")
+    if info['queued']:
+        run_local(root, workers)
+    store, queue = _store_and_queue(root)
+    cleared = queue.clear_finished(store)
+    if cleared:
+        print(f"清除了 {cleared} 个任务已全部完成、仍留在 running 中的批次")
+    return collect(root, jobs)
+
+
+def _sources_from_args(args) -> list:
+    if args.store:
+        symbols = [s for s in (args.symbols or '').split(',') if s]
+        if not symbols:
+            from columnar_store import ColumnarStore
+            symbols = ColumnarStore(args.store).symbols
+        return [{'store': os.path.abspath(args.store), 'symbol': s, 'start': args.start, 'end': args.end}
+                for s in symbols]
+    return [{'csv': os.path.abspath(path), 'start': args.start, 'end': args.end} for path in args.csv]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="可续跑的双均线参数扫描调度器")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_study_args(p):
+        source = p.add_mutually_exclusive_group(required=True)
+        source.add_argument('--csv', nargs='+', help="K线 CSV 文件（TqSdk 导出或 Tushare 日线格式），可多个")
+        source.add_argument('--store', help="columnar_store 生成的列式存储目录")
+        p.add_argument('--symbols', default=None, help="--store 时的合约列表，默认全部")
+        p.add_argument('--start', default=None, help="开始日期 YYYY-MM-DD")
+        p.add_argument('--end', default=None, help="结束日期 YYYY-MM-DD")
+        p.add_argument('--short', default='12', help="短周期，例如 5,10 或 5:20:1")
+        p.add_argument('--long', default='26', help="长周期，例如 20,30 或 20:60:2")
+        p.add_argument('--ratio', default='0.2', help="投入比例，例如 0.1,0.2 或 0.1:0.5:0.1")
+        p.add_argument('--capital', type=float, default=1_000_000, help="初始本金")
+        p.add_argument('--multiple', type=float, default=1, help="合约乘数")
+        p.add_argument('--batch-size', type=int, default=256, help="每个批次的任务数")
+
+    for name, help_text in (('run', "提交并在本机计算，完成后汇总结果"), ('submit', "只提交任务到队列")):
+        p = sub.add_parser(name, help=help_text)
+        add_study_args(p)
+        p.add_argument('--root', default='sweep_jobs', help="调度目录（结果缓存和队列）")
+        if name == 'run':
+            p.add_argument('--workers', type=int, default=None, help="本机进程数，默认使用全部 CPU")
+            p.add_argument('--output', default='sweep_results.csv', help="结果保存路径")
+    p = sub.add_parser('work', help="从队列拉取批次计算（可在多台机器上运行）")
+    p.add_argument('--root', default='sweep_jobs', help="调度目录（共享文件系统上的同一路径）")
+    p.add_argument('--workers', type=int, default=None, help="本机进程数，默认使用全部 CPU")
+    p.add_argument('--stale-timeout', type=float, default=DEFAULT_STALE_TIMEOUT, help="心跳超时（秒）")
+    p = sub.add_parser('status', help="查看队列状态")
+    p.add_argument('--root', default='sweep_jobs', help="调度目录")
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        _, queue = _store_and_queue(args.root)
+        print(queue.counts())
+        return
+    if args.command == 'work':
+        start = time.perf_counter()
+        done = run_local(args.root, args.workers, args.stale_timeout)
+        print(f"完成 {done} 个任务，耗时 {time.perf_counter() - start:.2f} 秒")
+        return
+
+    sources = _sources_from_args(args)
+    grid = (parse_values(args.short), parse_values(args.long), parse_values(args.ratio, float))
+    if args.command == 'submit':
+        jobs = build_jobs(sources, *grid, args.capital, args.multiple)
+        info = submit(args.root, jobs, args.batch_size)
+        print(f"共 {info['total']} 个任务，已有结果 {info['cached']} 个，入队 {info['queued']} 个（{info['batches']} 批）")
+        return
+
+    start = time.perf_counter()
+    results = run_study(args.root, sources, *grid, args.capital, args.multiple, args.workers, args.batch_size)
+    print(f"耗时 {time.perf_counter() - start:.2f} 秒，完成 {results['total_return'].notna().sum()}/{len(results)} 个任务")
+    print(results.sort_values('total_return', ascending=False).head(10).drop(columns='key').to_string(index=False))
+    results.to_csv(args.output, index=False)
+    print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
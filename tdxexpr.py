@@ -0,0 +1,560 @@
+# tdxexpr.py
+
+"""
+通达信风格的条件表达式，编译一次，之后可增量或向量化求值。
+
+    cond = compile_condition("CROSS(MA(C,12),MA(C,26))")
+    cond.data_length            # 至少需要的K线数量，这里为 27
+    cond.evaluate(klines)       # 向量化：对整段历史求值，返回布尔数组
+    stream = cond.stream()      # 增量：每根K线 O(1)
+    stream.warmup(klines)       # 用已有K线窗口预热
+    stream.next_bar(klines)     # 上一根K线定稿并追加最新一根，返回当前条件值
+
+支持的语法：
+    行情字段：C/CLOSE、O/OPEN、H/HIGH、L/LOW、V/VOL/VOLUME（不区分大小写）；
+    函数：MA(X,N)、EMA(X,N)、REF(X,N)、CROSS(A,B)、BARSLAST(X)、COUNT(X,N)，N 必须是整数常量；
+    运算：+ - * /，> < >= <= =（或 ==）<>（或 !=），AND/&&、OR/||、NOT。
+
+表达式被编译为有向无环图，相同的子表达式（如两个条件里的 MA(C,26)）只计算一次。
+两种后端的语义完全一致：所有中间值都是浮点数，条件为真当且仅当值非 0 且不是 NaN；
+均线数据不足时为 NaN，REF 越过开头时为 NaN，比较中出现 NaN 时结果为假。
+
+lookback 按各函数定义所需的最少K线数推算（MA/COUNT 为 N-1，REF 为 N，CROSS 为 1，逐层累加）。
+EMA、BARSLAST 和 COUNT(X,0) 依赖全部历史，lookback 只保证结果有定义，
+窗口求值与全历史求值可能不同，增量求值则始终与全历史一致。
+"""
+
+import ast
+import math
+import re
+from collections import deque
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+import tdxfunc
+from indicators import EMA, SMA, BarsLast
+
+if TYPE_CHECKING:  # 只用于类型标注；只有 __call__ 构造 Series 时才导入 pandas
+    import pandas as pd
+
+FIELD_ALIASES = {
+    'C': 'close', 'CLOSE': 'close',
+    'O': 'open', 'OPEN': 'open',
+    'H': 'high', 'HIGH': 'high',
+    'L': 'low', 'LOW': 'low',
+    'V': 'volume', 'VOL': 'volume', 'VOLUME': 'volume',
+}
+
+# 函数名 -> 参数形式，'x' 为序列参数，'n' 为整数常量参数
+FUNCTIONS = {
+    'MA': 'xn',
+    'EMA': 'xn',
+    'REF': 'xn',
+    'CROSS': 'xx',
+    'BARSLAST': 'x',
+    'COUNT': 'xn',
+}
+
+_BINARY_OPS = {ast.Add: 'add', ast.Sub: 'sub', ast.Mult: 'mul', ast.Div: 'div'}
+_COMPARE_OPS = {ast.Gt: 'gt', ast.Lt: 'lt', ast.GtE: 'ge', ast.LtE: 'le', ast.Eq: 'eq', ast.NotEq: 'ne'}
+
+
+class Node:
+    """DAG 中的一个节点。args 为子节点序号，param 为常量参数（字段名、数值或周期）。"""
+
+    __slots__ = ('op', 'args', 'param', 'lookback', 'text')
+
+    def __init__(self, op: str, args: tuple, param, lookback: int, text: str):
+        self.op = op
+        self.args = args
+        self.param = param
+        self.lookback = lookback  # 求值当前K线需要向前追溯的K线数
+        self.text = text  # 规范文本，相同的子表达式文本相同，用作共享指标缓存的数据源标识
+
+    def __repr__(self):
+        return f"Node({self.op}, {self.args}, {self.param!r})"
+
+
+_OP_SYMBOLS = {'add': '+', 'sub': '-', 'mul': '*', 'div': '/', 'gt': '>', 'lt': '<', 'ge': '>=', 'le': '<=',
+               'eq': '==', 'ne': '!=', 'and': ' AND ', 'or': ' OR '}
+
+
+def _translate(text: str) -> str:
+    """把通达信写法改写为 Python 表达式语法。"""
+    text = text.strip().rstrip(';')
+    text = text.replace('<>', '!=').replace('&&', ' and ').replace('||', ' or ')
+    text = re.sub(r'(?<![<>=!])=(?!=)', '==', text)
+    text = re.sub(r'\bAND\b', ' and ', text, flags=re.IGNORECASE)
+    text = re.sub(r'\bOR\b', ' or ', text, flags=re.IGNORECASE)
+    text = re.sub(r'\bNOT\b', ' not ', text, flags=re.IGNORECASE)
+    return text
+
+
+class _Compiler:
+    """把 Python AST 转换为去重后的节点列表（按拓扑顺序排列）。"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.nodes = []
+        self._ids = {}
+
+    def add(self, op: str, args=(), param=None) -> int:
+        key = (op, args, param)
+        index = self._ids.get(key)
+        if index is not None:
+            return index
+        lookback = max((self.nodes[a].lookback for a in args), default=0)
+        if op in ('ma', 'ema'):
+            lookback += param - 1
+        elif op == 'ref':
+            lookback += param
+        elif op == 'cross':
+            lookback += 1
+        elif op == 'count' and param > 0:
+            lookback += param - 1
+        texts = [self.nodes[a].text for a in args]
+        if op == 'field':
+            text = param
+        elif op == 'const':
+            text = repr(param)
+        elif op == 'not':
+            text = f"NOT({texts[0]})"
+        elif op == 'neg':
+            text = f"-({texts[0]})"
+        elif op in _OP_SYMBOLS:
+            text = f"({_OP_SYMBOLS[op].join(texts)})"
+        else:
+            text = f"{op.upper()}({','.join(texts + ([] if param is None else [str(param)]))})"
+        self.nodes.append(Node(op, args, param, lookback, text))
+        index = self._ids[key] = len(self.nodes) - 1
+        return index
+
+    def error(self, message: str):
+        return ValueError(f"条件表达式 {self.text!r} 无效：{message}")
+
+    def visit(self, node) -> int:
+        if isinstance(node, ast.Expression):
+            return self.visit(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            return self.add('const', param=float(node.value))
+        if isinstance(node, ast.Name):
+            field = FIELD_ALIASES.get(node.id.upper())
+            if field is None:
+                raise self.error(f"未知的行情字段 {node.id}")
+            return self.add('field', param=field)
+        if isinstance(node, ast.UnaryOp):
+            operand = self.visit(node.operand)
+            if isinstance(node.op, ast.Not):
+                return self.add('not', (operand,))
+            if isinstance(node.op, ast.USub):
+                return self.add('neg', (operand,))
+            if isinstance(node.op, ast.UAdd):
+                return operand
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            return self.add(_BINARY_OPS[type(node.op)], (self.visit(node.left), self.visit(node.right)))
+        if isinstance(node, ast.BoolOp):
+            op = 'and' if isinstance(node.op, ast.And) else 'or'
+            result = self.visit(node.values[0])
+            for value in node.values[1:]:
+                result = self.add(op, (result, self.visit(value)))
+            return result
+        if isinstance(node, ast.Compare):
+            # A < B < C 视为 (A < B) AND (B < C)
+            left = self.visit(node.left)
+            result = None
+            for op, comparator in zip(node.ops, node.comparators):
+                if type(op) not in _COMPARE_OPS:
+                    raise self.error("不支持的比较运算")
+                right = self.visit(comparator)
+                term = self.add(_COMPARE_OPS[type(op)], (left, right))
+                result = term if result is None else self.add('and', (result, term))
+                left = right
+            return result
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            return self.visit_call(node)
+        raise self.error(f"不支持的语法 {ast.dump(node)[:40]}")
+
+    def visit_call(self, node: ast.Call) -> int:
+        name = node.func.id.upper()
+        signature = FUNCTIONS.get(name)
+        if signature is None:
+            raise self.error(f"未知的函数 {node.func.id}")
+        if node.keywords or len(node.args) != len(signature):
+            raise self.error(f"{name} 需要 {len(signature)} 个参数")
+        args, param = [], None
+        for kind, arg in zip(signature, node.args):
+            if kind == 'x':
+                args.append(self.visit(arg))
+                continue
+            if not (isinstance(arg, ast.Constant) and isinstance(arg.value, int)) or arg.value < 0:
+                raise self.error(f"{name} 的周期参数必须是非负整数常量")
+            param = arg.value
+        if name in ('MA', 'EMA') and param < 1:
+            raise self.error(f"{name} 的周期必须 >= 1")
+        return self.add(name.lower(), tuple(args), param)
+
+
+def _truth(x: np.ndarray) -> np.ndarray:
+    """向量化真值：非 0 且不是 NaN。"""
+    return (x != 0) & ~np.isnan(x)
+
+
+def _eval_vector(node: Node, args: list, columns: dict, length: int) -> np.ndarray:
+    op = node.op
+    if op == 'field':
+        return columns[node.param]
+    if op == 'const':
+        return np.full(length, node.param)
+    if op == 'ma':
+        return tdxfunc.MA(args[0], node.param)
+    if op == 'ema':
+        return tdxfunc.EMA(args[0], node.param)
+    if op == 'ref':
+        return tdxfunc.REF(args[0], node.param)
+    if op == 'cross':
+        return tdxfunc.CROSS(args[0], args[1]).astype(np.float64)
+    if op == 'barslast':
+        return tdxfunc.BARSLAST(_truth(args[0])).astype(np.float64)
+    if op == 'count':
+        return tdxfunc.COUNT(_truth(args[0]), node.param).astype(np.float64)
+    if op == 'not':
+        return (~_truth(args[0])).astype(np.float64)
+    if op == 'neg':
+        return -args[0]
+    if op == 'and':
+        return (_truth(args[0]) & _truth(args[1])).astype(np.float64)
+    if op == 'or':
+        return (_truth(args[0]) | _truth(args[1])).astype(np.float64)
+    a, b = args
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if op == 'add':
+            return a + b
+        if op == 'sub':
+            return a - b
+        if op == 'mul':
+            return a * b
+        if op == 'div':
+            return a / b
+        if op == 'gt':
+            return (a > b).astype(np.float64)
+        if op == 'lt':
+            return (a < b).astype(np.float64)
+        if op == 'ge':
+            return (a >= b).astype(np.float64)
+        if op == 'le':
+            return (a <= b).astype(np.float64)
+        if op == 'eq':
+            return (a == b).astype(np.float64)
+        return (a != b).astype(np.float64)
+
+
+class CompiledCondition:
+    """
+    编译后的条件表达式。
+
+    Attributes:
+        text (str): 原始表达式。
+        nodes (list): 按拓扑顺序排列的 DAG 节点，最后一个为输出。
+        fields (list): 用到的行情字段。
+        lookback (int): 求值当前K线需要向前追溯的K线数。
+        data_length (int): 需要的最短K线窗口长度（lookback + 1）。
+    """
+
+    def __init__(self, text: str):
+        compiler = _Compiler(text)
+        try:
+            tree = ast.parse(_translate(text), mode='eval')
+        except SyntaxError as e:
+            raise compiler.error(f"语法错误 {e.msg}") from None
+        compiler.visit(tree)
+        self.text = text
+        self.nodes = compiler.nodes
+        self.fields = sorted({n.param for n in self.nodes if n.op == 'field'})
+        self.lookback = self.nodes[-1].lookback
+        self.data_length = self.lookback + 1
+
+    def __repr__(self):
+        return f"CompiledCondition({self.text!r}, nodes={len(self.nodes)}, data_length={self.data_length})"
+
+    def values(self, klines: "pd.DataFrame") -> np.ndarray:
+        """向量化求值，返回输出节点的原始浮点数组（例如 BARSLAST(...) 的周期数）。"""
+        missing = [f for f in self.fields if f not in klines.columns]
+        if missing:
+            raise ValueError(f"K线缺少字段: {missing}")
+        columns = {f: klines[f].to_numpy(dtype=np.float64) for f in self.fields}
+        length = len(klines)
+        results = []
+        for node in self.nodes:
+            results.append(_eval_vector(node, [results[a] for a in node.args], columns, length))
+        return results[-1]
+
+    def evaluate(self, klines: "pd.DataFrame") -> np.ndarray:
+        """向量化求值，返回每根K线的布尔条件值。"""
+        return _truth(self.values(klines))
+
+    def __call__(self, klines: "pd.DataFrame") -> "pd.Series":
+        """与布尔条件函数用法相同：接受 klines，返回布尔 Series。"""
+        import pandas as pd
+
+        return pd.Series(self.evaluate(klines), index=klines.index)
+
+    def stream(self, cache=None) -> 'ConditionStream':
+        """创建增量求值状态，传入 indicator_cache.IndicatorCache 时与其它使用者共享 MA/EMA。"""
+        return ConditionStream(self, cache)
+
+
+class _Ref:
+    def __init__(self, n: int):
+        self.buffer = deque(maxlen=n + 1)
+
+    def step(self, x: float, new_bar: bool) -> float:
+        if new_bar:
+            self.buffer.append(x)
+        else:
+            self.buffer[-1] = x
+        return self.buffer[0] if len(self.buffer) == self.buffer.maxlen else math.nan
+
+
+class _Cross:
+    def __init__(self):
+        self.prev = (math.nan, math.nan)  # 上一根K线的最终值
+        self.current = (math.nan, math.nan)
+
+    def step(self, a: float, b: float, new_bar: bool) -> float:
+        if new_bar:
+            self.prev = self.current
+        self.current = (a, b)
+        return 1.0 if self.prev[0] < self.prev[1] and a > b else 0.0
+
+
+class _Count:
+    def __init__(self, n: int):
+        self.buffer = deque(maxlen=n) if n > 0 else None
+        self.total = 0
+        self.last = 0  # 当前K线计入的值（n=0 时使用）
+
+    def step(self, flag: int, new_bar: bool) -> float:
+        buffer = self.buffer
+        if buffer is None:
+            self.total += flag if new_bar else flag - self.last
+            self.last = flag
+        elif new_bar:
+            if len(buffer) == buffer.maxlen:
+                self.total -= buffer[0]
+            buffer.append(flag)
+            self.total += flag
+        else:
+            self.total += flag - buffer[-1]
+            buffer[-1] = flag
+        return float(self.total)
+
+
+def _true(x: float) -> bool:
+    return x == x and x != 0
+
+
+class ConditionStream:
+    """
+    条件表达式的增量求值状态，每根K线对每个节点 O(1) 更新。
+
+    append 进入新K线，update 重新计算当前（尚未完成的）K线；
+    bar 为任意支持 bar[字段名] 的对象（dict、pd.Series 等）。
+    cache 为 IndicatorCache 时，MA/EMA 节点从缓存中获取共享指标，同一根K线只计算一次。
+    """
+
+    def __init__(self, condition: CompiledCondition, cache=None):
+        self.condition = condition
+        self.bar_index = -1
+        self.value = math.nan  # 输出节点的原始值
+        self._values = [math.nan] * len(condition.nodes)
+        self._states = []
+        for node in condition.nodes:
+            if node.op in ('ma', 'ema') and cache is not None:
+                state = cache.indicator(condition.nodes[node.args[0]].text, node.op, node.param)
+            elif node.op == 'ma':
+                state = SMA(node.param)
+            elif node.op == 'ema':
+                state = EMA(node.param)
+            elif node.op == 'ref':
+                state = _Ref(node.param)
+            elif node.op == 'cross':
+                state = _Cross()
+            elif node.op == 'barslast':
+                state = BarsLast()
+            elif node.op == 'count':
+                state = _Count(node.param)
+            else:
+                state = None
+            self._states.append(state)
+
+    @property
+    def current(self) -> bool:
+        """当前K线的条件值。"""
+        return _true(self.value)
+
+    def _step(self, bar, new_bar: bool) -> bool:
+        if new_bar or self.bar_index < 0:
+            new_bar = True
+            self.bar_index += 1
+        values = self._values
+        for i, (node, state) in enumerate(zip(self.condition.nodes, self._states)):
+            op = node.op
+            args = [values[a] for a in node.args]
+            if op == 'field':
+                v = float(bar[node.param])
+            elif op == 'const':
+                v = node.param
+            elif op in ('ma', 'ema'):
+                v = state.append(args[0]) if new_bar else state.update(args[0])
+            elif op == 'ref':
+                v = state.step(args[0], new_bar)
+            elif op == 'cross':
+                v = state.step(args[0], args[1], new_bar)
+            elif op == 'barslast':
+                v = float(state.update(_true(args[0]), key=self.bar_index))
+            elif op == 'count':
+                v = state.step(int(_true(args[0])), new_bar)
+            elif op == 'not':
+                v = 0.0 if _true(args[0]) else 1.0
+            elif op == 'neg':
+                v = -args[0]
+            elif op == 'and':
+                v = 1.0 if _true(args[0]) and _true(args[1]) else 0.0
+            elif op == 'or':
+                v = 1.0 if _true(args[0]) or _true(args[1]) else 0.0
+            else:
+                a, b = args
+                if op == 'add':
+                    v = a + b
+                elif op == 'sub':
+                    v = a - b
+                elif op == 'mul':
+                    v = a * b
+                elif op == 'div':
+                    v = a / b if b != 0 else (math.nan if a == 0 or a != a else math.copysign(math.inf, a) * math.copysign(1, b))
+                elif op == 'gt':
+                    v = float(a > b)
+                elif op == 'lt':
+                    v = float(a < b)
+                elif op == 'ge':
+                    v = float(a >= b)
+                elif op == 'le':
+                    v = float(a <= b)
+                elif op == 'eq':
+                    v = float(a == b)
+                else:
+                    v = float(a != b)
+            values[i] = v
+        self.value = values[-1]
+        return _true(self.value)
+
+    def append(self, bar) -> bool:
+        """进入新K线并返回其条件值。"""
+        return self._step(bar, True)
+
+    def update(self, bar) -> bool:
+        """用最新数据重新计算当前K线并返回其条件值。"""
+        return self._step(bar, False)
+
+    def _columns(self, klines) -> dict:
+        """取出条件用到的各列；klines 可以是K线 DataFrame，也可以是已经取好的 {字段: 数组}。"""
+        return {f: np.asarray(klines[f], dtype=np.float64) for f in self.condition.fields}
+
+    def warmup(self, klines: "pd.DataFrame") -> bool:
+        """依次追加K线窗口中的每一根K线（开头为 NaN 的行同样追加，与向量化求值保持一致）。"""
+        columns = self._columns(klines)
+        for i in range(len(klines)):
+            self.append({f: column[i] for f, column in columns.items()})
+        return self.current
+
+    def next_bar(self, klines: "pd.DataFrame") -> bool:
+        """
+        K线窗口推进一根时调用：先用倒数第二根K线的最终数据定稿上一根K线，再追加最新一根。
+        klines 也可以是 {字段: 数组}，调用方每根K线已经取过列时可以直接传入，省去重复的 pandas 取列。
+        """
+        columns = self._columns(klines)
+        if self.bar_index >= 0:
+            self.update({f: column[-2] for f, column in columns.items()})
+        return self.append({f: column[-1] for f, column in columns.items()})
+
+    def next_bars(self, klines: "pd.DataFrame", new: int) -> list:
+        """
+        K线窗口一次推进了 new 根时调用（见 indicators.count_new_bars）：定稿上一根K线后依次追加
+        最后 new 根K线；new 等于窗口长度时直接追加整个窗口。
+
+        Returns:
+            list: 每根新K线的条件值。
+        """
+        if new == 1:
+            return [self.next_bar(klines)]
+        columns = self._columns(klines)
+        n = len(klines) if hasattr(klines, 'columns') else len(next(iter(klines.values())))
+        if new < n and self.bar_index >= 0:
+            self.update({f: column[n - new - 1] for f, column in columns.items()})
+        return [self.append({f: column[i] for f, column in columns.items()}) for i in range(n - new, n)]
+
+
+def compile_condition(text: str) -> CompiledCondition:
+    """编译条件表达式，见模块说明。"""
+    return CompiledCondition(text)
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    # 向量化与增量两种后端的结果应完全一致
+    rng = np.random.default_rng(0)
+    n = 600
+    close = 3000 + np.cumsum(rng.normal(0, 20, n))
+    close[rng.integers(0, n, 5)] = 3000.0  # 制造相等的比较
+    klines = pd.DataFrame({
+        'open': close + rng.normal(0, 5, n),
+        'high': close + 10,
+        'low': close - 10,
+        'close': close,
+        'volume': rng.integers(100, 1000, n).astype(np.float64),
+    })
+
+    expressions = [
+        "CROSS(MA(C,12),MA(C,26))",
+        "CROSS(MA(C,26),MA(C,12))",
+        "BARSLAST(CROSS(MA(C,5),MA(C,20))) < 3 AND C > REF(C,1)",
+        "EMA(C,10) > MA(C,10) OR NOT(V > 500)",
+        "COUNT(C > O, 5) >= 3 && C <> 3000",
+        "COUNT(C = 3000, 0) > 0 || (H - L) / C * 100 > 0.7",
+        "REF(CROSS(EMA(C,5), EMA(C,15)), 2)",
+        "MA(REF(C,3),4) < C",
+    ]
+    for text in expressions:
+        cond = compile_condition(text)
+        vector = cond.evaluate(klines)
+
+        # 增量求值：每根K线先推送一个未完成的价格，再用最终价格更新
+        stream = cond.stream()
+        incremental = np.empty(n, dtype=bool)
+        for i in range(n):
+            row = klines.iloc[i]
+            stream.append({f: row[f] * 0.99 for f in cond.fields})
+            incremental[i] = stream.update(row)
+        assert (vector == incremental).all(), text
+
+        # 不含依赖全部历史的函数时，用 data_length 长度的窗口求值，最后一根K线的结果与全历史一致
+        if not re.search(r'EMA|BARSLAST|COUNT\(.*, 0\)', text):
+            window = cond.data_length
+            for i in range(window - 1, n, 37):
+                assert cond.evaluate(klines.iloc[i - window + 1:i + 1])[-1] == vector[i], (text, i)
+        print(f"{text:<55} data_length={cond.data_length:<3} 触发 {int(vector.sum())} 次")
+
+    # 窗口推进方式与 backtest.BARSLAST 相同
+    cond = compile_condition("CROSS(MA(C,12),MA(C,26))")
+    stream = cond.stream()
+    stream.warmup(klines.iloc[:cond.data_length])
+    results = [stream.current]
+    for i in range(cond.data_length + 1, n + 1):
+        results.append(stream.next_bar(klines.iloc[i - cond.data_length:i]))
+    assert results == list(cond.evaluate(klines)[cond.data_length - 1:])
+    assert len(cond.nodes) == 4  # MA(C,12)、MA(C,26) 各只有一个节点
+    print("向量化与增量求值结果一致")
@@ -0,0 +1,255 @@
+# tdxfunc.py
+
+"""
+通达信风格的向量化序列函数（BARSLAST 系列及 MA、EMA、REF、CROSS）。
+
+所有函数一次性计算整段序列，内部只使用 NumPy 向量运算，没有 Python 循环。
+输入可以是 pd.Series 或 np.ndarray：传入 Series 时返回同索引的 Series，
+传入数组时返回 np.ndarray。BARSLAST 系列中未满足条件的位置统一返回 -1
+（与 backtest.BARSLAST 一致）。
+
+模块只在导入时加载 NumPy：输入本身是 Series 时 pandas 必然已经导入，只处理数组的工作进程
+（参数扫描、BARSLAST / MA 计算）不会加载 pandas。EMA 和对象数组的缺失值判断例外，调用时才导入 pandas。
+"""
+
+import sys
+
+import numpy as np
+
+
+def _is_series(obj) -> bool:
+    """obj 是否为 pd.Series；pandas 尚未导入时 obj 不可能是 Series，无需导入。"""
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(obj, pd.Series)
+
+
+def _as_array(series) -> np.ndarray:
+    return series.to_numpy() if _is_series(series) else np.asarray(series)
+
+
+def _isna(values: np.ndarray) -> np.ndarray:
+    """缺失值掩码：数值和布尔数组直接用 NumPy 判断，对象数组（可能含 None / pd.NA）交给 pandas。"""
+    if values.dtype.kind in 'biu':
+        return np.zeros(values.shape, dtype=bool)
+    if values.dtype.kind in 'fc':
+        return np.isnan(values)
+    import pandas as pd
+    return pd.isna(values)
+
+
+def _as_bool_array(condition) -> np.ndarray:
+    """把条件序列转换为一维布尔数组，NaN 视为 False。"""
+    values = _as_array(condition)
+    if values.ndim != 1:
+        raise ValueError("条件序列必须是一维的。")
+    if values.dtype == bool:
+        return values
+    if values.dtype.kind == 'f':
+        return np.nan_to_num(values, nan=0.0) != 0
+    if values.dtype.kind in 'iu':
+        return values != 0
+    import pandas as pd
+    return pd.array(values, dtype="boolean").fillna(False).to_numpy(dtype=bool)
+
+
+def _wrap(result: np.ndarray, like):
+    """输入为 Series 时，把结果包装回同索引的 Series（此时 pandas 已经导入）。"""
+    if _is_series(like):
+        import pandas as pd
+        return pd.Series(result, index=like.index, name=like.name)
+    return result
+
+
+def BARSLAST(condition):
+    """
+    计算每根K线距离上一次条件成立的周期数。
+
+    Args:
+        condition: 布尔型 Series 或数组。
+
+    Returns:
+        每根K线的 BARSLAST 值：当前成立为 0，从未成立为 -1。
+    """
+    cond = _as_bool_array(condition)
+    idx = np.arange(len(cond))
+    last_true = np.where(cond, idx, -1)
+    np.maximum.accumulate(last_true, out=last_true)
+    return _wrap(np.where(last_true >= 0, idx - last_true, -1), condition)
+
+
+def BARSLASTS(condition, n: int):
+    """
+    计算每根K线距离倒数第 n 次条件成立的周期数（n=1 时等同于 BARSLAST）。
+
+    Args:
+        condition: 布尔型 Series 或数组。
+        n (int): 倒数第几次成立，必须 >= 1。
+
+    Returns:
+        每根K线的结果，成立次数不足 n 次时为 -1。
+    """
+    if n < 1:
+        raise ValueError("n 必须 >= 1。")
+    cond = _as_bool_array(condition)
+    idx = np.arange(len(cond))
+    true_pos = np.flatnonzero(cond)
+    # 截至每根K线（含）条件成立的次数
+    true_count = np.cumsum(cond)
+    valid = true_count >= n
+    result = np.full(len(cond), -1, dtype=np.int64)
+    result[valid] = idx[valid] - true_pos[true_count[valid] - n]
+    return _wrap(result, condition)
+
+
+def BARSSINCE(condition):
+    """
+    计算每根K线距离第一次条件成立的周期数。
+
+    Args:
+        condition: 布尔型 Series 或数组。
+
+    Returns:
+        每根K线的结果：第一次成立的K线为 0，此前为 -1。
+    """
+    cond = _as_bool_array(condition)
+    idx = np.arange(len(cond))
+    first = np.argmax(cond) if cond.any() else len(cond)
+    return _wrap(np.where(idx >= first, idx - first, -1), condition)
+
+
+def BARSCOUNT(series):
+    """
+    计算第一个有效数据到当前的K线总数（含当前K线）。
+
+    Args:
+        series: 数值或布尔型 Series/数组，数值序列中的 NaN 视为无效数据。
+
+    Returns:
+        每根K线的结果：第一个有效数据处为 1，此前为 0。
+    """
+    values = _as_array(series)
+    valid = ~_isna(values)
+    idx = np.arange(len(values))
+    first = np.argmax(valid) if valid.any() else len(values)
+    return _wrap(np.where(idx >= first, idx - first + 1, 0), series)
+
+
+def COUNT(condition, n: int):
+    """
+    统计最近 n 根K线（含当前）中条件成立的次数。
+
+    Args:
+        condition: 布尔型 Series 或数组。
+        n (int): 统计周期，0 表示从第一根K线开始累计。
+
+    Returns:
+        每根K线的成立次数，不足 n 根时按已有K线统计。
+    """
+    if n < 0:
+        raise ValueError("n 必须 >= 0。")
+    cond = _as_bool_array(condition)
+    total = np.cumsum(cond, dtype=np.int64)
+    if n == 0 or n >= len(cond):
+        return _wrap(total, condition)
+    result = total.copy()
+    result[n:] -= total[:-n]
+    return _wrap(result, condition)
+
+
+def _as_float_array(series) -> np.ndarray:
+    values = _as_array(series)
+    return values.astype(np.float64, copy=False)
+
+
+def MA(series, n: int):
+    """
+    计算 n 周期简单移动平均，等价于 tqsdk.tafunc.ma(series, n)。
+
+    使用累加和一次性计算所有窗口；窗口内不足 n 根或含有 NaN 时结果为 NaN。
+    二维数组（例如 路径数 × K线数）沿最后一个维度按行计算。
+
+    Args:
+        series: 数值 Series 或数组。
+        n (int): 均线周期。
+
+    Returns:
+        与输入同类型的均线序列。
+    """
+    if n < 1:
+        raise ValueError("n 必须 >= 1。")
+    x = _as_float_array(series)
+    result = np.full(x.shape, np.nan)
+    if x.shape[-1] >= n:
+        nan = np.isnan(x)
+        # 减去每行首个有效值再累加，降低大数相减带来的精度损失
+        offset = np.take_along_axis(x, np.argmax(~nan, axis=-1)[..., np.newaxis], axis=-1)
+        offset = np.where(np.isnan(offset), 0.0, offset)
+        zeros = np.zeros(x.shape[:-1] + (1,))
+        total = np.concatenate((zeros, np.cumsum(np.where(nan, 0.0, x - offset), axis=-1)), axis=-1)
+        nan_count = np.concatenate((zeros, np.cumsum(nan, axis=-1)), axis=-1)
+        window_sum = total[..., n:] - total[..., :-n]
+        window_nan = nan_count[..., n:] - nan_count[..., :-n]
+        result[..., n - 1:] = np.where(window_nan > 0, np.nan, window_sum / n + offset)
+    return _wrap(result, series)
+
+
+def EMA(series, n: int):
+    """
+    计算 n 周期指数移动平均，等价于 tqsdk.tafunc.ema(series, n)，即 ewm(span=n, adjust=False)。
+
+    Args:
+        series: 数值 Series 或数组。
+        n (int): 均线周期。
+
+    Returns:
+        与输入同类型的均线序列。
+    """
+    if n < 1:
+        raise ValueError("n 必须 >= 1。")
+    import pandas as pd  # 递推式没有纯 NumPy 的向量化写法，借用 pandas 的 ewm 实现
+
+    x = _as_float_array(series)
+    result = pd.Series(x).ewm(span=n, adjust=False).mean().to_numpy()
+    return _wrap(result, series)
+
+
+def REF(series, n: int = 1):
+    """
+    引用 n 根K线之前的值，开头不足的部分为 NaN（布尔序列为 False）。
+
+    Args:
+        series: Series 或数组。
+        n (int): 向前引用的周期数，必须 >= 0。
+
+    Returns:
+        与输入同类型的序列。
+    """
+    if n < 0:
+        raise ValueError("n 必须 >= 0。")
+    values = _as_array(series)
+    if values.dtype == bool:
+        result = np.zeros(len(values), dtype=bool)
+    else:
+        result = np.full(len(values), np.nan)
+    if n < len(values):
+        result[n:] = values[:len(values) - n]
+    return _wrap(result, series)
+
+
+def CROSS(a, b):
+    """
+    判断 a 是否上穿 b：上一根K线 a < b，且当前K线 a > b（与 backtest.BARSLAST 的金叉判断一致）。
+    b 下穿 a 即 CROSS(b, a)。任意一侧为 NaN 时结果为 False。二维数组沿最后一个维度按行判断。
+
+    Args:
+        a: 数值 Series 或数组。
+        b: 数值 Series、数组或标量。
+
+    Returns:
+        与 a 同类型的布尔序列。
+    """
+    x = _as_float_array(a)
+    y = np.broadcast_to(_as_float_array(b), x.shape)
+    result = np.zeros(x.shape, dtype=bool)
+    result[..., 1:] = (x[..., :-1] < y[..., :-1]) & (x[..., 1:] > y[..., 1:])
+    return _wrap(result, a)
@@ -4,8 +4,13 @@ from tqsdk import TqApi, TqBacktest, BacktestFinished, TqAuth
 from datetime import date, datetime
 from strategy import run_dual_ma_strategy
 import os                 # 导入 os 模块
+import sys
 from dotenv import load_dotenv # 导入 load_dotenv
 
+# 将项目根目录加入搜索路径，以便导入根目录下的公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics import analyze_trades, print_metrics
+
 # --- 加载环境变量 ---
 # load_dotenv 会查找当前目录或父目录中的 .env 文件并加载
 if not load_dotenv():
@@ -76,7 +81,10 @@ except BacktestFinished:
         # TQSDK 回测的账户对象可能不直接反映基于历史数据的精确资金曲线
         # 可能需要根据 trades 自行计算详细的回测指标
         print(f"总交易次数: {len(trades)}")
-        # ... [打印交易记录等] ...
+        # 由成交记录计算回合交易的胜率、盈亏比和持仓时间
+        quote = api.get_quote(FUTURES_SYMBOL)
+        print("回合交易统计:")
+        print_metrics(analyze_trades(trades, volume_multiple=quote.volume_multiple))
     else:
         print("API 未成功初始化，无法获取回测结果。")
 
@@ -3,18 +3,24 @@
 import pandas as pd
 import numpy as np
 from datetime import date, datetime
-from tqsdk import TqApi, TqAuth, TqBacktest, TqSim, BacktestFinished # 导入 TQSDK 相关组件
-from tqsdk.tafunc import ma # 导入 ma 函数
 import os
-from dotenv import load_dotenv # 用于加载 .env 文件
+import sys
 from typing import Optional
 
+# 将项目根目录加入搜索路径，以便导入根目录下的公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 多个条件共用一个 (K 线数 × 条件数) 矩阵和长度为条件数的状态向量
+from barslast_matrix import BarsLastMatrix
+
 # ==================================================
-# BARSLAST 函数定义 (保持不变，这是核心工具函数)
+# BARSLAST 函数定义 (核心工具函数)
 # ==================================================
 def BARSLAST(condition_series: pd.Series) -> int:
     """
     计算距离上一次条件为 True 的 K 线周期数。
+    只返回最后一根 K 线的结果：从当前 K 线向前查找最近一次 True，只扫描到该位置为止，不处理整个窗口。
+    策略循环中每根 K 线都要取值时请使用 indicators.BarsLast (每根 O(1) 流式更新，多个条件用 BarsLastMatrix)；
+    需要每根 K 线的结果时请直接使用 tdxfunc.BARSLAST。
     Args:
         condition_series: 布尔型的 Pandas Series。
     Returns:
@@ -22,22 +28,22 @@ def BARSLAST(condition_series: pd.Series) -> int:
     """
     if not isinstance(condition_series, pd.Series) or condition_series.dtype != bool:
         raise TypeError("BARSLAST 输入必须是布尔型的 Pandas Series。")
-    n = len(condition_series)
-    if n < 2:
-        return -1
-    current_iloc = n - 1
-    series_before_now = condition_series.iloc[:current_iloc]
-    true_indices = np.where(series_before_now)[0]
-    if len(true_indices) == 0:
+    if len(condition_series) < 2:
         return -1
-    else:
-        last_true_iloc = true_indices[-1]
-        return current_iloc - last_true_iloc
+    # 不计当前 K 线；布尔数组的 argmax 遇到第一个 True 即停止
+    before = condition_series.to_numpy()[-2::-1]
+    bars = int(before.argmax())
+    return bars + 1 if before[bars] else -1
 
 # ==================================================
 # 当 barslast_util.py 被直接运行时，执行以下测试代码
 # ==================================================
 if __name__ == "__main__":
+    # TQSDK 和 .env 只在独立测试时需要，导入 BARSLAST 工具函数时不加载
+    from tqsdk import TqApi, TqAuth, TqBacktest, TqSim, BacktestFinished # 导入 TQSDK 相关组件
+    from tqsdk.tafunc import ma # 导入 ma 函数
+    from dotenv import load_dotenv # 用于加载 .env 文件
+
     print("--- 开始独立测试 BARSLAST 函数 (使用 TQPY 回测数据流) ---")
     print("    本测试将使用与提供的 backtest.py 相同的参数配置回测环境。")
 
@@ -74,6 +80,10 @@ if __name__ == "__main__":
         data_length = LONG + 5
         klines = api.get_kline_serial(SYMBOL, duration_seconds=KLINE_DURATION_SECONDS, data_length=data_length)
 
+        # --- 四个条件的 BARSLAST 状态，每根 K 线一次 O(4) 更新，不再对窗口逐个调用 BARSLAST ---
+        CONDITION_NAMES = ["金叉", "死叉", f"收盘价 > MA{LONG}", f"MA{SHORT} > MA{LONG}"]
+        bars_state = BarsLastMatrix(CONDITION_NAMES)
+
         # --- 主循环 (仅用于数据更新和 BARSLAST 测试) ---
         k_count = 0 # K 线计数器
         print_freq = 50 # 每 50 根 K 线打印一次 BARSLAST 结果 (5分钟线，减少打印频率)
@@ -103,16 +113,21 @@ if __name__ == "__main__":
                 condition_close_above_long = klines["close"] > long_avg
                 condition_short_above_long = short_avg > long_avg # 短均线是否在长均线上方
 
-                # --- 调用 BARSLAST 函数 (核心测试点) ---
+                # --- 更新多条件 BARSLAST 状态 (核心测试点) ---
                 # 使用 .fillna(False) 处理因 shift 产生的 NaN
-                bars_gc = BARSLAST(condition_gc.fillna(False))
-                bars_dc = BARSLAST(condition_dc.fillna(False))
-                bars_cal = BARSLAST(condition_close_above_long.fillna(False))
-                bars_sal = BARSLAST(condition_short_above_long.fillna(False)) # 测试短上长条件
+                conditions = {name: cond.fillna(False) for name, cond in zip(CONDITION_NAMES, [
+                    condition_gc, condition_dc, condition_close_above_long, condition_short_above_long])}
+                current_dt_nano = klines.iloc[-1]["datetime"]
+                if bars_state.bar_index < 0:
+                    # 第一次用整个窗口预热，之后每根 K 线只写入最后一行
+                    bars_state.extend(conditions, key=current_dt_nano)
+                else:
+                    bars_state.update([c.iloc[-1] for c in conditions.values()], key=current_dt_nano)
+                # prior 与 BARSLAST(condition_series) 相同，不计当前 K 线；历史从预热窗口开始累计，不受窗口长度限制
+                bars_gc, bars_dc, bars_cal, bars_sal = bars_state.prior.tolist()
 
                 # --- 按频率打印结果 ---
                 if k_count % print_freq == 0:
-                    current_dt_nano = klines.iloc[-1]["datetime"]
                     current_dt = pd.to_datetime(current_dt_nano, unit='ns', utc=True).tz_convert('Asia/Shanghai')
                     print(f"\n{current_dt} (K线计数: {k_count}, 序列长度: {len(klines)}) BARSLAST 测试:")
                     print(f"  收盘价: {klines.close.iloc[-1]:.2f}, MA{SHORT}: {short_avg.iloc[-1]:.2f}, MA{LONG}: {long_avg.iloc[-1]:.2f}")
@@ -1,10 +1,16 @@
 # data_fetcher.py
 
 import pandas as pd
-from tqsdk import TqApi, TqBacktest, BacktestFinished
 from typing import Optional
 import warnings
 from datetime import datetime # <<---- 1. 导入 datetime 模块
+import os
+import sys
+
+# 将项目根目录加入搜索路径，以便导入根目录下的公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kline_cache import KlineCache, DEFAULT_CACHE_DIR
+from resample import resample_many
 
 # 忽略 TQSDK 内部操作可能引发的特定 pandas 警告
 warnings.filterwarnings("ignore", category=FutureWarning, module="tqsdk.sim")
@@ -32,6 +38,9 @@ def fetch_and_prepare_futures_data(
     Returns:
         Optional[pd.DataFrame]: 处理后的 DataFrame 或 None。
     """
+    # 只有真正向 TQSDK 请求数据时才导入 tqsdk，命中缓存时不加载
+    from tqsdk import TqApi, TqBacktest, BacktestFinished
+
     required_columns = ['datetime', 'open', 'close']
     api = None
 
@@ -130,6 +139,62 @@ def fetch_and_prepare_futures_data(
             print("TqApi 连接已关闭。")
 
 
+def fetch_futures_data_cached(
+    symbol: str,
+    start_dt_str: str,
+    end_dt_str: str,
+    kline_duration: int = DURATION_DAILY,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    offline: bool = False
+) -> Optional[pd.DataFrame]:
+    """
+    带本地缓存的 fetch_and_prepare_futures_data。
+
+    已缓存的日期范围直接从磁盘读取，只有缓存中缺少的日期段才会启动 TqApi 回测会话去获取。
+
+    Args:
+        symbol (str): 期货合约代码。
+        start_dt_str (str): 开始日期字符串 (格式 'YYYY-MM-DD')。
+        end_dt_str (str): 结束日期字符串 (格式 'YYYY-MM-DD')。
+        kline_duration (int): K 线周期，单位为秒。
+        cache_dir (str): 缓存目录。
+        offline (bool): 为 True 时只读本地缓存，不访问网络。
+
+    Returns:
+        Optional[pd.DataFrame]: 与 fetch_and_prepare_futures_data 格式相同的 DataFrame 或 None。
+    """
+    cache = KlineCache(cache_dir, fetcher=fetch_and_prepare_futures_data, offline=offline)
+    return cache.get(symbol, start_dt_str, end_dt_str, kline_duration)
+
+
+def fetch_multi_timeframe(
+    symbol: str,
+    start_dt_str: str,
+    end_dt_str: str,
+    durations=(5 * DURATION_MINUTE, DURATION_DAILY),
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    offline: bool = False
+) -> Optional[dict]:
+    """
+    只获取一次分钟 K 线，聚合出多个周期的 K 线 (按交易时段和交易日划分，夜盘归入下一个交易日)。
+
+    Args:
+        symbol (str): 期货合约代码。
+        start_dt_str (str): 开始日期字符串 (格式 'YYYY-MM-DD')。
+        end_dt_str (str): 结束日期字符串 (格式 'YYYY-MM-DD')。
+        durations: 需要的 K 线周期列表，单位为秒。
+        cache_dir (str): 分钟 K 线的缓存目录。
+        offline (bool): 为 True 时只读本地缓存，不访问网络。
+
+    Returns:
+        Optional[dict]: {周期: DataFrame}，格式见 resample.resample；没有数据时返回 None。
+    """
+    minute = fetch_futures_data_cached(symbol, start_dt_str, end_dt_str, DURATION_MINUTE, cache_dir, offline)
+    if minute is None:
+        return None
+    return resample_many(minute, durations)
+
+
 # --- 模块测试代码 (也需要修改传入的参数名) ---
 if __name__ == "__main__":
     print("--- 开始测试 data_fetcher 模块 (使用 TQPY 获取期货数据) ---")
@@ -0,0 +1,105 @@
+# indicators_check.py
+
+"""
+增量均线（indicators.SMA / EMA / WMA）的容差比对脚本，直接运行：python test/indicators_check.py
+
+逐K线模拟形成中的K线（每根K线先以开盘价 append，随后 update 为收盘价），把每根K线的 value / prev
+与整段序列的全量计算比对：
+    - tdxfunc.MA / EMA 和 pandas rolling / ewm，离线即可运行；
+    - tqsdk.tafunc.ma / ema / wma，未安装 tqsdk 时跳过这一部分。
+另外检查一次更新带来多根新K线时 next_bars 的追补结果。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# 将项目根目录加入搜索路径，以便导入根目录下的公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tdxfunc
+from indicators import EMA, SMA, WMA, count_new_bars
+
+RTOL, ATOL = 1e-9, 1e-6
+
+
+def _rolling_wma(closes: pd.Series, n: int) -> np.ndarray:
+    weights = np.arange(1, n + 1, dtype=np.float64)
+    return closes.rolling(n).apply(lambda w: np.dot(w, weights) / weights.sum(), raw=True).to_numpy()
+
+
+def _stream(cls, n: int, opens: pd.Series, closes: pd.Series):
+    """逐K线 append 开盘价、update 收盘价，返回每根K线定稿后的 value 和 prev。"""
+    indicator = cls(n)
+    values = np.empty(len(closes))
+    prevs = np.empty(len(closes))
+    for i, (o, c) in enumerate(zip(opens, closes)):
+        indicator.append(o)
+        indicator.update(c)
+        values[i] = indicator.value
+        prevs[i] = indicator.prev
+    return values, prevs
+
+
+def _check(label: str, values: np.ndarray, prevs: np.ndarray, expected: np.ndarray):
+    assert np.allclose(values, expected, rtol=RTOL, atol=ATOL, equal_nan=True), f"{label} 当前值不一致"
+    assert np.allclose(prevs[1:], expected[:-1], rtol=RTOL, atol=ATOL, equal_nan=True), f"{label} 上一周期值不一致"
+    print(f"{label}: 一致 ({len(values)} 根K线)")
+
+
+def _check_next_bars(closes: np.ndarray, window: int = 30, n: int = 12):
+    """K线窗口每次随机推进 1～5 根，用 count_new_bars + next_bars 追补，结果应与逐根追加一致。"""
+    rng = np.random.default_rng(1)
+    datetimes = np.arange(len(closes), dtype=np.int64)
+    expected = tdxfunc.MA(closes, n)
+    indicator = SMA(n)
+    end = window
+    indicator.extend(closes[:end])
+    last_dt = datetimes[end - 1]
+    while end < len(closes):
+        end = min(end + int(rng.integers(1, 6)), len(closes))
+        window_dts = datetimes[end - window:end]
+        new = count_new_bars(window_dts, last_dt)
+        indicator.next_bars(closes[end - window:end], new)
+        last_dt = window_dts[-1]
+        assert np.isclose(indicator.value, expected[end - 1], rtol=RTOL, atol=ATOL, equal_nan=True), \
+            f"next_bars 在第 {end} 根K线不一致"
+    print(f"next_bars: 一次推进多根K线时与逐根追加一致 ({len(closes)} 根K线)")
+
+
+def main():
+    rng = np.random.default_rng(0)
+    closes = pd.Series(3000 + np.cumsum(rng.normal(0, 10, 5000)))
+    closes.iloc[:5] = np.nan  # 模拟K线窗口开头的空数据
+    opens = closes.shift(1).fillna(closes)
+
+    cases = [("MA", SMA, 12), ("MA", SMA, 26), ("EMA", EMA, 12), ("WMA", WMA, 26)]
+    streams = {(name, n): _stream(cls, n, opens, closes) for name, cls, n in cases}
+
+    # 离线基准：tdxfunc 向量化实现和 pandas rolling / ewm
+    offline = {
+        "MA": [("tdxfunc.MA", lambda s, n: tdxfunc.MA(s.to_numpy(), n)),
+               ("pandas.rolling", lambda s, n: s.rolling(n).mean().to_numpy())],
+        "EMA": [("tdxfunc.EMA", lambda s, n: tdxfunc.EMA(s.to_numpy(), n)),
+                ("pandas.ewm", lambda s, n: s.ewm(span=n, adjust=False).mean().to_numpy())],
+        "WMA": [("pandas.rolling", _rolling_wma)],
+    }
+    for (name, n), (values, prevs) in streams.items():
+        for label, func in offline[name]:
+            _check(f"{name}{n} vs {label}", values, prevs, func(closes, n))
+
+    _check_next_bars(closes.to_numpy()[5:])
+
+    try:
+        from tqsdk.tafunc import ema, ma, wma
+    except ImportError:
+        print("未安装 tqsdk，跳过与 tqsdk.tafunc 的比对")
+        return
+    tafunc = {"MA": ma, "EMA": ema, "WMA": wma}
+    for (name, n), (values, prevs) in streams.items():
+        _check(f"{name}{n} vs tafunc.{tafunc[name].__name__}", values, prevs, tafunc[name](closes, n).to_numpy())
+
+
+if __name__ == "__main__":
+    main()
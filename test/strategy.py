@@ -1,21 +1,35 @@
 # strategy.py
 
 import pandas as pd
-from tqsdk import TqApi, TargetPosTask, BacktestFinished
-from tqsdk.tafunc import ma # 导入移动平均线函数
 from datetime import datetime
-
-def run_dual_ma_strategy(api: TqApi, symbol: str, short_period: int, long_period: int, volume: int, kline_duration: int):
+import os
+import sys
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # 只用于类型标注，运行时不导入 tqsdk
+    from tqsdk import TqApi
+
+# 将项目根目录加入搜索路径，以便导入根目录下的公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from indicators import SMA, count_new_bars
+from event_log import EventSink
+from profiler import BarProfiler, NullProfiler
+from tqcompat import finished_exceptions, target_pos_task
+
+def run_dual_ma_strategy(api: "TqApi", symbol: str, short_period: int, long_period: int, volume: int, kline_duration: int,
+                         sink: EventSink = None, profiler: BarProfiler = None):
     """
     执行双均线策略的核心逻辑。
 
     Args:
-        api (TqApi): TqApi 实例。
+        api (TqApi): TqApi 实例，也可以是 replay.ReplayApi 离线回放实例。
         symbol (str): 交易的合约代码。
         short_period (int): 短周期均线窗口。
         long_period (int): 长周期均线窗口。
         volume (int): 每次交易的目标手数 (正数表示做多，负数表示做空)。
         kline_duration (int): K 线周期，单位为秒。
+        sink (EventSink): 日志输出，默认在后台线程打印到控制台 (上海时区)；传入 NullSink() 可完全静默。
+        profiler (BarProfiler): 逐 K 线分段计时 (wait_update、指标、信号与下单、日志)，结束时输出汇总；为 None 时不计时。
     """
     print(f"启动双均线策略: 合约={symbol}, 短周期={short_period}, 长周期={long_period}, 手数={volume}, K线周期={kline_duration}秒")
 
@@ -29,12 +43,27 @@ def run_dual_ma_strategy(api: TqApi, symbol: str, short_period: int, long_period
     # 修正后的代码
     klines = api.get_kline_serial(symbol, duration_seconds=kline_duration, data_length=data_length)
     # 创建目标持仓管理任务实例
-    target_pos = TargetPosTask(api, symbol)
+    # 离线回放驱动 (ReplayApi) 自带目标持仓任务，TqApi 时才导入 tqsdk.TargetPosTask
+    target_pos = target_pos_task(api, symbol)
+    # 创建增量均线，每根 K 线 O(1) 更新，不再每次对整个窗口调用 ma()
+    short_ma = SMA(short_period)
+    long_ma = SMA(long_period)
+    # 日志输出：策略循环只提交原始字段，格式化在后台线程中完成
+    own_sink = sink is None
+    if own_sink:
+        sink = EventSink(tz='Asia/Shanghai')
+    if profiler is None:
+        profiler = NullProfiler()
+    position_info = api.get_position(symbol)
+    last_pos = position_info.pos
+    last_bar_dt = None # 已处理的最后一根 K 线的时间
 
     try:
         while True:
             # 等待数据更新或回测结束信号
+            profiler.begin_bar()
             api.wait_update()
+            profiler.mark('wait_update')
 
             # 检查是否有新的 K 线生成（检查最后一根 K 线的 datetime 是否变化）
             # 确保 klines 不为空再访问 iloc[-1]
@@ -43,44 +72,65 @@ def run_dual_ma_strategy(api: TqApi, symbol: str, short_period: int, long_period
                 if len(klines) < long_period + 1: # 需要 long_period+1 根才能计算出长周期均线
                     continue
 
-                # 计算短周期和长周期移动平均线 (使用收盘价)
-                short_avg = ma(klines["close"], short_period)
-                long_avg = ma(klines["close"], long_period)
+                # 更新短周期和长周期移动平均线 (使用收盘价)
+                closes = klines["close"].to_numpy()
+                close = closes[-1]
+                # 一次 wait_update 可能带来多根新 K 线 (例如断线重连后)，按上次处理到的时间计算新 K 线数量
+                new_bars = count_new_bars(klines["datetime"].to_numpy(), last_bar_dt)
+                last_bar_dt = klines["datetime"].iloc[-1]
+                if short_ma.count == 0:
+                    # 第一次时用已有的 K 线窗口预热均线
+                    short_ma.extend(closes)
+                    long_ma.extend(closes)
+                else:
+                    # 上一根 K 线已完成，先用其最终收盘价定稿，再逐根追加新 K 线，均线窗口不会错位
+                    short_ma.next_bars(closes, new_bars)
+                    long_ma.next_bars(closes, new_bars)
+                profiler.mark('indicators')
 
                 # 确保均线值已有效计算出来 (非 NaN)
                 # 至少需要比较当前和上一根K线的均线值
-                if pd.isna(short_avg.iloc[-1]) or pd.isna(long_avg.iloc[-1]) or \
-                   pd.isna(short_avg.iloc[-2]) or pd.isna(long_avg.iloc[-2]):
+                if pd.isna(short_ma.value) or pd.isna(long_ma.value) or \
+                   pd.isna(short_ma.prev) or pd.isna(long_ma.prev):
                     continue # 如果均线还未计算出来，则跳过
 
-                current_dt_nano = klines.iloc[-1]["datetime"]
-                current_dt = pd.to_datetime(current_dt_nano, unit='ns', utc=True).tz_convert('Asia/Shanghai')
-                print(f"\n{current_dt} 新 K 线:")
-                print(f"  Close: {klines.iloc[-1]['close']:.2f}")
-                print(f"  MA{short_period}: {short_avg.iloc[-1]:.2f} (上一周期: {short_avg.iloc[-2]:.2f})")
-                print(f"  MA{long_period}: {long_avg.iloc[-1]:.2f} (上一周期: {long_avg.iloc[-2]:.2f})")
+                # 时间戳保持纳秒整数，由日志线程负责转换为上海时间
+                current_dt_nano = klines["datetime"].iloc[-1]
+                if position_info.pos != last_pos:
+                    sink.fill("{datetime} 成交: {volume:+d} 手, 当前持仓: {pos} 手",
+                              datetime=current_dt_nano, volume=position_info.pos - last_pos, pos=position_info.pos)
+                    last_pos = position_info.pos
+                sink.bar("\n{datetime} 新 K 线:\n"
+                         "  Close: {close:.2f}\n"
+                         "  MA{short_period}: {short:.2f} (上一周期: {short_prev:.2f})\n"
+                         "  MA{long_period}: {long:.2f} (上一周期: {long_prev:.2f})",
+                         datetime=current_dt_nano, close=close, short_period=short_period, long_period=long_period,
+                         short=short_ma.value, short_prev=short_ma.prev, long=long_ma.value, long_prev=long_ma.prev)
+                profiler.mark('logging')
 
                 # 金叉判断：短均线上穿长均线
                 # 条件：当前短均线 > 当前长均线  并且  上一周期短均线 <= 上一周期长均线
-                if short_avg.iloc[-1] > long_avg.iloc[-1] and short_avg.iloc[-2] <= long_avg.iloc[-2]:
-                    print(f"*** {current_dt} 金叉信号 ***")
-                    print(f"  设置目标持仓为: {volume} 手")
+                if short_ma.value > long_ma.value and short_ma.prev <= long_ma.prev:
+                    sink.signal("*** {datetime} 金叉信号 ***\n  设置目标持仓为: {target} 手",
+                                datetime=current_dt_nano, target=volume)
                     target_pos.set_target_volume(volume) # 设置目标持仓为 volume 手 (做多)
 
                 # 死叉判断：短均线下穿长均线
                 # 条件：当前短均线 < 当前长均线  并且  上一周期短均线 >= 上一周期长均线
-                elif short_avg.iloc[-1] < long_avg.iloc[-1] and short_avg.iloc[-2] >= long_avg.iloc[-2]:
-                    print(f"--- {current_dt} 死叉信号 ---")
+                elif short_ma.value < long_ma.value and short_ma.prev >= long_ma.prev:
+                    sink.signal("--- {datetime} 死叉信号 ---", datetime=current_dt_nano)
                     # 如果 volume 是正数（表示做多），死叉时应平仓，目标设为 0
                     # 如果 volume 是负数（表示做空），可以考虑死叉时开空仓（目标设为 -volume）
                     # 这里我们假设 volume 代表多头手数，死叉时平多仓
                     if volume > 0:
-                        print(f"  设置目标持仓为: 0 手")
+                        sink.signal("  设置目标持仓为: {target} 手", datetime=current_dt_nano, target=0)
                         target_pos.set_target_volume(0)
                     # 如果需要根据死叉做空，可以取消下面注释
                     # else:
                     #     print(f"  设置目标持仓为: {volume} 手") # volume 本身为负
                     #     target_pos.set_target_volume(volume)
+                profiler.mark('order')
+                profiler.end_bar(current_dt_nano)
 
             # 可以在这里添加其他逻辑，比如定时打印账户信息等
             # if api.is_changing(api.get_account()):
@@ -88,13 +138,24 @@ def run_dual_ma_strategy(api: TqApi, symbol: str, short_period: int, long_period
             #     position = api.get_position(symbol)
             #     print(f"账户更新: Balance={account.balance:.2f}, Position={position.pos}")
 
-    except BacktestFinished:
+    except finished_exceptions():  # TqSdk 或离线回放的回测结束信号
+        sink.flush()
         print("策略模块收到回测结束信号。")
         # 回测结束时，可以在主程序中获取最终结果
 
     except Exception as e:
+        sink.flush()
         print(f"策略模块运行时发生错误: {e}")
         import traceback
         traceback.print_exc()
 
+    finally:
+        # 输出剩余日志
+        if own_sink:
+            sink.close()
+        else:
+            sink.flush()
+        # 输出逐 K 线耗时汇总 (未开启计时时为空操作)
+        profiler.report()
+
     print("策略函数执行完毕。")
\ No newline at end of file
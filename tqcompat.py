@@ -0,0 +1,97 @@
+# tqcompat.py
+
+"""
+TqSdk 适配层（延迟导入）。
+
+指标、BARSLAST、均线和信号逻辑（tdxfunc、indicators、indicator_cache、tdxexpr、vector_backtest、
+sweep、walk_forward、robustness、analytics、replay 等）都不依赖 tqsdk；tqsdk 及其依赖只在
+真正创建 TqApi 回测会话或 TargetPosTask 时才导入。参数扫描的工作进程、离线回放和信号计算
+因此不再承担导入 tqsdk 的开销（导入耗时见 python benchmark.py --imports）。
+其中 tdxfunc、indicators、indicator_cache、barslast_matrix、tdxexpr 导入时也只加载 NumPy，
+pandas 在真正构造 Series / DataFrame 时才导入，只做数组计算的工作进程不会加载 pandas。
+
+    api = create_backtest_api(start_dt, end_dt)            # 此时才导入 tqsdk
+    target_pos = target_pos_task(api, symbol)              # ReplayApi 使用自带的目标持仓任务
+    try:
+        ...
+    except finished_exceptions():                          # 同时捕获离线回放和 TqSdk 的回测结束
+        ...
+"""
+
+import os
+import sys
+
+
+class BacktestFinished(Exception):
+    """离线回放结束（replay.ReplayApi 抛出）。TqSdk 回测会话抛出的是 tqsdk.BacktestFinished。"""
+
+
+def tqsdk_loaded() -> bool:
+    """当前进程是否已经导入了 tqsdk。"""
+    return 'tqsdk' in sys.modules
+
+
+def finished_exceptions() -> tuple:
+    """
+    回测结束异常的元组，用于 except 子句。
+
+    tqsdk 已导入时（即存在 TqApi 会话）同时包含 tqsdk.BacktestFinished，否则只包含离线回放的
+    BacktestFinished；本身不会触发 tqsdk 的导入。
+    """
+    tqsdk = sys.modules.get('tqsdk')
+    if tqsdk is not None and hasattr(tqsdk, 'BacktestFinished'):
+        return BacktestFinished, tqsdk.BacktestFinished
+    return (BacktestFinished,)
+
+
+def create_backtest_api(start_dt, end_dt, init_balance: float = 1_000_000, auth=None):
+    """
+    创建 TqSdk 回测会话（TqApi + TqSim + TqBacktest）。
+
+    Args:
+        start_dt (date): 回测开始日期。
+        end_dt (date): 回测结束日期。
+        init_balance (float): 模拟账户初始资金。
+        auth: TqAuth 实例或 (账户, 密码)；为 None 时从 .env 中读取 KQ_ACCOUNT / KQ_PASSWORD。
+
+    Returns:
+        TqApi: 回测会话，由调用方负责 close()。
+    """
+    from tqsdk import TqApi, TqAuth, TqBacktest, TqSim
+
+    if auth is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        auth = (os.getenv("KQ_ACCOUNT"), os.getenv("KQ_PASSWORD"))
+    if isinstance(auth, tuple):
+        auth = TqAuth(*auth)
+    return TqApi(account=TqSim(init_balance=init_balance), backtest=TqBacktest(start_dt=start_dt, end_dt=end_dt),
+                 auth=auth)
+
+
+def target_pos_task(api, symbol: str):
+    """返回合约的目标持仓任务：离线回放驱动使用自带的实现，TqApi 使用 tqsdk.TargetPosTask。"""
+    if hasattr(api, "target_pos_task"):
+        return api.target_pos_task(symbol)
+    from tqsdk import TargetPosTask
+    return TargetPosTask(api, symbol)
+
+
+def kline_columns(api, klines, fields) -> dict:
+    """
+    返回K线窗口各列的 NumPy 数组，窗口推进后无需重新获取。
+
+    离线回放驱动直接返回与窗口共享内存的只读数组；TqApi 的K线 DataFrame 不保证原地更新，返回 None，
+    调用方应在每根K线上自行从 klines 取列。
+
+    Args:
+        api: TqApi 或 replay.ReplayApi。
+        klines (pd.DataFrame): get_kline_serial 返回的K线窗口。
+        fields (list): 需要的列名。
+
+    Returns:
+        dict | None: {列名: 数组}，不支持时为 None。
+    """
+    if hasattr(api, "kline_columns"):
+        return api.kline_columns(klines, fields)
+    return None
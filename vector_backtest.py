@@ -0,0 +1,326 @@
+# vector_backtest.py
+
+"""
+纯 NumPy 向量化的双均线回测引擎（离线，无需 TqApi / 网络）。
+
+与 backtest.BARSLAST 的逻辑保持一致：
+    - 金叉（上一根短均线 < 长均线，当前短均线 > 长均线）时目标持仓设为 +手数，死叉时设为 -手数；
+    - 手数 = int(当前权益 * 投入比例 / (价格 * 合约乘数))；
+    - 信号在K线收盘时产生，于下一根K线开盘价成交（没有 open 列时按下一根收盘价成交）；
+    - 权益按收盘价逐K线盯市，不计手续费和滑点。
+
+输出与 BARSLAST() 返回的 DataFrame 列一致：datetime, price, balance, position, barslast, trade。
+"""
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import tdxfunc
+
+RESULT_COLUMNS = ['datetime', 'price', 'balance', 'position', 'barslast', 'trade']
+
+
+def prepare_klines(klines: pd.DataFrame) -> pd.DataFrame:
+    """
+    把不同来源的K线统一为按时间升序、带 datetime 列的 DataFrame。
+
+    支持：
+        TqSdk K线（datetime 列为纳秒时间戳）；
+        Tushare 日线 CSV（trade_date 列为 yyyymmdd）；
+        data_fetcher.fetch_and_prepare_futures_data 的结果（时间在索引上）。
+
+    Args:
+        klines (pd.DataFrame): 原始K线，至少包含 close 列。
+
+    Returns:
+        pd.DataFrame: 包含 datetime, open, close 等列的新 DataFrame，已去掉收盘价为空的K线。
+    """
+    if 'close' not in klines.columns:
+        raise ValueError("K线数据缺少 close 列")
+    df = klines.copy()
+    if 'datetime' in df.columns:
+        if pd.api.types.is_numeric_dtype(df['datetime']):
+            df['datetime'] = pd.to_datetime(df['datetime'], unit='ns')
+        else:
+            df['datetime'] = pd.to_datetime(df['datetime'])
+    elif 'trade_date' in df.columns:
+        df['datetime'] = pd.to_datetime(df['trade_date'].astype(str), format='%Y%m%d')
+    elif isinstance(df.index, pd.DatetimeIndex):
+        df['datetime'] = df.index
+    else:
+        raise ValueError("无法识别K线时间列（需要 datetime、trade_date 或时间索引）")
+    if 'open' not in df.columns:
+        df['open'] = df['close']
+    df = df[df['close'].notna()].sort_values('datetime', kind='stable')
+    return df.reset_index(drop=True)
+
+
+def read_tushare_csv(path: str) -> pd.DataFrame:
+    """读取 Tushare 格式的日线 CSV（带 BOM，日期为 yyyymmdd）并统一格式。"""
+    return prepare_klines(pd.read_csv(path, encoding='utf-8-sig'))
+
+
+def random_walk_klines(n: int, seed: int = 0, start_price: float = 3000.0) -> pd.DataFrame:
+    """
+    生成 n 根随机游走日K线（datetime 为纳秒时间戳），用于基准测试、自检和离线演示。
+
+    Args:
+        n (int): K线数量。
+        seed (int): 随机种子。
+        start_price (float): 初始价格。
+
+    Returns:
+        pd.DataFrame: 列为 datetime, open, high, low, close, volume。
+    """
+    rng = np.random.default_rng(seed)
+    close = start_price * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.empty(n)
+    open_[0] = start_price
+    open_[1:] = close[:-1] * np.exp(rng.normal(0, 0.002, n - 1))
+    spread = np.abs(rng.normal(0, 0.005, n)) * close
+    return pd.DataFrame({
+        'datetime': np.datetime64('2000-01-01', 'ns').astype(np.int64) + np.arange(n, dtype=np.int64) * 86_400_000_000_000,
+        'open': open_,
+        'high': np.maximum(open_, close) + spread,
+        'low': np.minimum(open_, close) - spread,
+        'close': close,
+        'volume': rng.integers(1, 10_000, n).astype(np.float64),
+    })
+
+
+def dual_ma_signals(close, short: int, long: int):
+    """
+    计算双均线及交叉信号。
+
+    Args:
+        close: 收盘价数组。
+        short (int): 短周期。
+        long (int): 长周期。
+
+    Returns:
+        tuple: (短均线, 长均线, 信号)，信号为 int8 数组：1 金叉，-1 死叉，0 无信号。
+    """
+    short_ma = tdxfunc.MA(close, short)
+    long_ma = tdxfunc.MA(close, long)
+    signal = tdxfunc.CROSS(short_ma, long_ma).astype(np.int8)
+    signal -= tdxfunc.CROSS(long_ma, short_ma).astype(np.int8)
+    return short_ma, long_ma, signal
+
+
+def simulate_positions(open_, close, signal, initial_capital: float = 1_000_000,
+                       invest_ratio: float = 0.2, volume_multiple: float = 1) -> dict:
+    """
+    根据信号模拟下一根K线开盘成交后的持仓和权益。
+
+    持仓在两次成交之间保持不变，因此每段的权益有闭式解：
+        权益[t] = 成交前权益 + 乘数 * (旧持仓 * (开盘价[f] - 收盘价[f-1]) + 新持仓 * (收盘价[t] - 开盘价[f]))
+    只有确定每次信号的手数时需要按信号顺序递推（循环次数等于信号个数，而非K线数），
+    其余全部为向量运算。
+
+    Args:
+        open_: 开盘价数组。
+        close: 收盘价数组。
+        signal: 信号数组（1 金叉，-1 死叉，0 无信号）。
+        initial_capital (float): 初始本金。
+        invest_ratio (float): 每次投入权益的比例。
+        volume_multiple (float): 合约乘数。
+
+    Returns:
+        dict: 各列为长度与K线相同的数组：
+            balance: 收盘时的权益；
+            position: 按当前权益计算的可开手数；
+            target: 信号K线设置的目标持仓（无信号为 0）；
+            holding: 开盘成交后的实际持仓；
+            fill_price: 成交K线的成交价（其余为 NaN）。
+    """
+    open_ = np.asarray(open_, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    signal = np.asarray(signal)
+    n = len(close)
+    mult = volume_multiple
+
+    # 每段持仓：成交K线序号、成交前权益、成交前持仓、成交后持仓
+    fills, start_equity, old_pos, new_pos = [0], [float(initial_capital)], [0], [0]
+    sig_idx = np.flatnonzero(signal)
+    targets = np.zeros(len(sig_idx), dtype=np.int64)
+    f, e0, p0, p = 0, float(initial_capital), 0, 0
+    for k, t in enumerate(sig_idx.tolist()):
+        equity = e0 + mult * (p0 * (open_[f] - close[f - 1]) + p * (close[t] - open_[f]))
+        size = int(equity * invest_ratio / (close[t] * mult))
+        targets[k] = size if signal[t] > 0 else -size
+        if t + 1 < n and targets[k] != p:
+            f, e0, p0, p = t + 1, equity, p, int(targets[k])
+            fills.append(f)
+            start_equity.append(e0)
+            old_pos.append(p0)
+            new_pos.append(p)
+
+    fills = np.asarray(fills)
+    start_equity = np.asarray(start_equity)
+    old_pos = np.asarray(old_pos, dtype=np.int64)
+    new_pos = np.asarray(new_pos, dtype=np.int64)
+
+    # 每根K线所属的持仓段
+    seg = np.searchsorted(fills, np.arange(n), side='right') - 1
+    seg_fill = fills[seg]
+    fill_open = open_[seg_fill]
+    balance = start_equity[seg] + mult * (old_pos[seg] * (fill_open - close[seg_fill - 1])
+                                          + new_pos[seg] * (close - fill_open))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        position = np.trunc(balance * invest_ratio / (close * mult))
+    position = np.nan_to_num(position, nan=0, posinf=0, neginf=0).astype(np.int64)
+
+    target = np.zeros(n, dtype=np.int64)
+    target[sig_idx] = targets
+    fill_price = np.full(n, np.nan)
+    fill_price[fills[1:]] = open_[fills[1:]]
+    return {
+        'balance': balance,
+        'position': position,
+        'target': target,
+        'holding': new_pos[seg],
+        'fill_price': fill_price,
+    }
+
+
+def simulate_positions_batch(open_, close, signal, initial_capital: float = 1_000_000,
+                             invest_ratio: float = 0.2, volume_multiple: float = 1) -> dict:
+    """
+    simulate_positions 的二维版本：同时模拟多条价格路径（路径数 × K线数）。
+
+    手数依赖信号时的权益，只能按时间顺序递推；这里按K线循环、每根K线对所有路径做向量运算，
+    循环次数等于K线数，与路径数无关。每条路径的结果与对该行调用 simulate_positions 相同。
+
+    Args:
+        open_: 开盘价，二维数组。
+        close: 收盘价，二维数组。
+        signal: 信号，二维数组（1 金叉，-1 死叉，0 无信号）。
+        initial_capital (float): 初始本金。
+        invest_ratio (float): 每次投入权益的比例。
+        volume_multiple (float): 合约乘数。
+
+    Returns:
+        dict: balance（收盘时的权益）、holding（开盘成交后的实际持仓）、
+            fills（每条路径的成交次数），前两项形状与输入相同。
+    """
+    # 按K线逐行访问，转置为 (K线数 × 路径数) 的连续内存
+    open_ = np.ascontiguousarray(np.asarray(open_, dtype=np.float64).T)
+    close = np.ascontiguousarray(np.asarray(close, dtype=np.float64).T)
+    signal = np.ascontiguousarray(np.asarray(signal).T)
+    n, paths = close.shape
+    mult = volume_multiple
+    balance = np.empty((n, paths))
+    holding = np.empty((n, paths), dtype=np.int64)
+    fills = np.zeros(paths, dtype=np.int64)
+
+    equity = np.full(paths, float(initial_capital))
+    pos = np.zeros(paths, dtype=np.int64)
+    target = np.zeros(paths, dtype=np.int64)
+    pending = np.zeros(paths, dtype=bool)
+    prev_close = close[0]
+    for t in range(n):
+        # 上一根K线的信号在本根K线开盘成交
+        fill = pending & (target != pos)
+        old = pos
+        pos = np.where(fill, target, pos)
+        fills += fill
+        equity = equity + mult * (old * (open_[t] - prev_close) + pos * (close[t] - open_[t]))
+        balance[t] = equity
+        holding[t] = pos
+        prev_close = close[t]
+
+        sig = signal[t]
+        pending = sig != 0
+        if pending.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                size = np.trunc(equity * invest_ratio / (close[t] * mult))
+            size = np.nan_to_num(size, nan=0, posinf=0, neginf=0).astype(np.int64)
+            target = np.where(sig > 0, size, -size)
+    balance, holding = balance.T, holding.T
+    return {'balance': balance, 'holding': holding, 'fills': fills}
+
+
+def run_vector_backtest(klines: pd.DataFrame, condition=None, short: int = 12, long: int = 26,
+                        initial_capital: float = 1_000_000, invest_ratio: float = 0.2,
+                        volume_multiple: float = 1, detail: bool = False) -> pd.DataFrame:
+    """
+    离线向量化回测双均线策略并计算 BARSLAST。
+
+    Args:
+        klines (pd.DataFrame): K线数据，格式见 prepare_klines。
+        condition (callable or array-like): 布尔条件。可调用对象接收整理后的K线 DataFrame，
+            返回整段历史的布尔 Series/数组（注意需要是向量化写法，而不是只计算最后一根）；
+            为 None 时使用金叉信号。
+        short (int): 短周期均线。
+        long (int): 长周期均线。
+        initial_capital (float): 初始本金。
+        invest_ratio (float): 每次投入权益的比例。
+        volume_multiple (float): 合约乘数。
+        detail (bool): 为 True 时额外返回 open, short_ma, long_ma, signal, target, holding, fill_price 列。
+
+    Returns:
+        pd.DataFrame: 列与 BARSLAST() 的结果一致：datetime, price, balance, position, barslast, trade。
+    """
+    df = prepare_klines(klines)
+    close = df['close'].to_numpy(dtype=np.float64)
+    open_ = df['open'].to_numpy(dtype=np.float64)
+
+    short_ma, long_ma, signal = dual_ma_signals(close, short, long)
+    sim = simulate_positions(open_, close, signal, initial_capital, invest_ratio, volume_multiple)
+
+    if condition is None:
+        cond = signal > 0
+    else:
+        cond = condition(df) if callable(condition) else condition
+        cond = cond.to_numpy() if isinstance(cond, pd.Series) else np.asarray(cond)
+        if len(cond) != len(df):
+            raise ValueError(f"条件长度 {len(cond)} 与K线数量 {len(df)} 不一致")
+
+    trade = np.full(len(df), None, dtype=object)
+    for t in np.flatnonzero(signal):
+        action = "开多" if signal[t] > 0 else "开空"
+        trade[t] = f"{action} {abs(sim['target'][t])} 手"
+
+    result = pd.DataFrame({
+        'datetime': df['datetime'],
+        'price': close,
+        'balance': sim['balance'],
+        'position': sim['position'],
+        'barslast': tdxfunc.BARSLAST(cond),
+        'trade': trade,
+    })
+    if detail:
+        result['open'] = open_
+        result['short_ma'] = short_ma
+        result['long_ma'] = long_ma
+        result['signal'] = signal
+        result['target'] = sim['target']
+        result['holding'] = sim['holding']
+        result['fill_price'] = sim['fill_price']
+    return result
+
+
+if __name__ == "__main__":
+    csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "000001_SZ_daily_20230101_20231231.csv")
+    klines = read_tushare_csv(csv_path)
+    result_df = run_vector_backtest(klines, condition=lambda k: k["close"] > tdxfunc.MA(k["close"], 26))
+    print("000001.SZ 日线向量化回测结果:")
+    print(result_df[result_df['trade'].notna()])
+    print(f"期末权益: {result_df['balance'].iloc[-1]:.2f}")
+
+    # 一年分钟线（约 24 万根）的合成随机游走数据，测试速度
+    n = 240 * 1000
+    rng = np.random.default_rng(0)
+    close = 3000 + np.cumsum(rng.normal(0, 1, n))
+    minute_klines = pd.DataFrame({
+        'datetime': pd.date_range('2023-01-01', periods=n, freq='min').asi8,
+        'open': np.concatenate(([close[0]], close[:-1])),
+        'close': close,
+    })
+    start = time.perf_counter()
+    result_df = run_vector_backtest(minute_klines, volume_multiple=10)
+    elapsed = time.perf_counter() - start
+    print(f"{n} 根分钟线回测耗时 {elapsed:.3f} 秒，交易次数 {result_df['trade'].notna().sum()}")
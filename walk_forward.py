@@ -0,0 +1,221 @@
+# walk_forward.py
+
+"""
+双均线参数的滚动（walk-forward）优化。
+
+在第 k 个训练窗口上扫描参数网格，选出最优参数后在紧接着的测试窗口上回测，
+然后整体向后滚动一个测试窗口的长度。所有测试窗口的权益首尾相接，得到样本外权益曲线。
+
+每个周期的均线只在整段数据上计算一次（均线只依赖过去的数据，切片后不会引入未来信息，
+窗口开头的均线也因此无需重新预热），连同价格一起写入共享内存，
+各窗口的优化在多个进程中并行进行，只对切片做运算。
+
+命令行示例：
+    python walk_forward.py --csv test/000001_SZ_daily_20230101_20231231.csv \
+        --short 5:15:1 --long 20:40:2 --train 120 --test 20 --workers 4
+"""
+
+import argparse
+import os
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+import pandas as pd
+
+import tdxfunc
+from sweep import build_grid, parse_values, summarize_simulation
+from vector_backtest import prepare_klines, simulate_positions
+
+WINDOW_COLUMNS = ['window', 'train_start', 'train_end', 'test_start', 'test_end', 'short', 'long', 'invest_ratio',
+                  'train_score', 'train_return', 'test_return', 'test_max_drawdown', 'test_trade_count']
+
+OBJECTIVES = {
+    'total_return': lambda total_return, max_drawdown: total_return,
+    'calmar': lambda total_return, max_drawdown: total_return / max(max_drawdown, 1e-9),
+}
+
+# 工作进程内的全局状态（由 _init_worker 设置）
+_shm = None
+_open = None
+_close = None
+_mas = {}
+_settings = {}
+
+
+def _init_worker(shm_name: str, shape: tuple, periods: list, settings: dict):
+    """工作进程初始化：映射共享内存中的价格和均线。"""
+    global _shm, _open, _close
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    data = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+    _open, _close = data[0], data[1]
+    _mas.clear()
+    _mas.update({p: data[2 + i] for i, p in enumerate(periods)})
+    _settings.clear()
+    _settings.update(settings)
+
+
+def _release_worker():
+    global _shm, _open, _close
+    _open = _close = None
+    _mas.clear()
+    if _shm is not None:
+        _shm.close()
+        _shm = None
+
+
+def _simulate(window: slice, short: int, long: int, invest_ratio: float, initial_capital: float) -> dict:
+    short_ma, long_ma = _mas[short][window], _mas[long][window]
+    signal = tdxfunc.CROSS(short_ma, long_ma).astype(np.int8) - tdxfunc.CROSS(long_ma, short_ma).astype(np.int8)
+    return simulate_positions(_open[window], _close[window], signal, initial_capital, invest_ratio,
+                              _settings['volume_multiple'])
+
+
+def _optimize_window(task) -> tuple:
+    """在一个训练窗口上扫描参数网格，返回 (窗口序号, 最优参数, 得分, 收益率)。"""
+    index, start, stop = task
+    objective = OBJECTIVES[_settings['objective']]
+    capital = _settings['initial_capital']
+    best = None
+    for short, long, invest_ratio in _settings['grid']:
+        sim = _simulate(slice(start, stop), short, long, invest_ratio, capital)
+        total_return, max_drawdown, _ = summarize_simulation(sim, capital)
+        score = objective(total_return, max_drawdown)
+        if best is None or score > best[2]:
+            best = ((short, long, invest_ratio), total_return, score)
+    return index, best[0], best[2], best[1]
+
+
+def make_windows(n: int, train_bars: int, test_bars: int, anchored: bool = False) -> list:
+    """
+    生成 (训练开始, 训练结束, 测试结束) 下标列表（左闭右开），最后一个测试窗口可以不足 test_bars。
+
+    anchored 为 True 时训练窗口起点固定为 0，长度逐步增加。
+    """
+    if train_bars < 1 or test_bars < 1:
+        raise ValueError("训练窗口和测试窗口长度必须 >= 1")
+    windows = []
+    train_end = train_bars
+    while train_end < n:
+        train_start = 0 if anchored else train_end - train_bars
+        windows.append((train_start, train_end, min(train_end + test_bars, n)))
+        train_end += test_bars
+    return windows
+
+
+def run_walk_forward(klines: pd.DataFrame, shorts, longs, invest_ratios=(0.2,), train_bars: int = 120,
+                     test_bars: int = 20, anchored: bool = False, objective: str = 'total_return',
+                     initial_capital: float = 1_000_000, volume_multiple: float = 1, workers: int = None):
+    """
+    滚动优化并拼接样本外权益曲线。
+
+    每个测试窗口以上一个测试窗口结束时的权益为初始资金、从空仓开始交易；
+    窗口结束时的持仓按收盘价计入权益，不带入下一个窗口。
+
+    Args:
+        klines (pd.DataFrame): K线数据，格式见 vector_backtest.prepare_klines。
+        shorts, longs, invest_ratios: 参数候选值，见 sweep.build_grid。
+        train_bars (int): 训练窗口K线数。
+        test_bars (int): 测试窗口K线数，也是每次滚动的步长。
+        anchored (bool): 为 True 时训练窗口从第一根K线开始逐步扩大。
+        objective (str): 选择参数的目标：total_return 或 calmar（收益率 / 最大回撤）。
+        initial_capital (float): 初始本金。
+        volume_multiple (float): 合约乘数。
+        workers (int): 进程数，默认使用全部 CPU；为 1 时在当前进程内运行。
+
+    Returns:
+        tuple: (windows, equity)
+            windows：每个窗口一行，列见 WINDOW_COLUMNS；
+            equity：样本外权益曲线，列为 datetime, balance, window。
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"未知的优化目标: {objective}，可选 {sorted(OBJECTIVES)}")
+    df = prepare_klines(klines)
+    n = len(df)
+    grid = build_grid(shorts, longs, invest_ratios)
+    windows = make_windows(n, train_bars, test_bars, anchored)
+    if not grid or not windows:
+        return pd.DataFrame(columns=WINDOW_COLUMNS), pd.DataFrame(columns=['datetime', 'balance', 'window'])
+
+    periods = sorted({p for short, long, _ in grid for p in (short, long)})
+    shape = (2 + len(periods), n)
+    settings = {'grid': grid, 'objective': objective, 'initial_capital': initial_capital,
+                'volume_multiple': volume_multiple}
+    workers = min(workers or os.cpu_count() or 1, len(windows))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(shape[0] * n * 8, 1))
+    try:
+        data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        data[0] = df['open'].to_numpy(dtype=np.float64)
+        data[1] = df['close'].to_numpy(dtype=np.float64)
+        for i, p in enumerate(periods):
+            data[2 + i] = tdxfunc.MA(data[1], p)  # 每个周期只在整段数据上计算一次
+        del data
+        initargs = (shm.name, shape, periods, settings)
+        tasks = [(i, start, stop) for i, (start, stop, _) in enumerate(windows)]
+
+        # 先在当前进程映射共享内存，用于之后按顺序拼接测试窗口
+        _init_worker(*initargs)
+        try:
+            if workers == 1:
+                chosen = [_optimize_window(task) for task in tasks]
+            else:
+                with Pool(processes=workers, initializer=_init_worker, initargs=initargs) as pool:
+                    chosen = pool.map(_optimize_window, tasks)
+
+            rows, equity = [], []
+            capital = initial_capital
+            datetimes = df['datetime'].to_numpy()
+            for (index, params, score, train_return), (train_start, train_end, test_end) in zip(chosen, windows):
+                short, long, invest_ratio = params
+                sim = _simulate(slice(train_end, test_end), short, long, invest_ratio, capital)
+                test_return, test_drawdown, test_trades = summarize_simulation(sim, capital)
+                rows.append((index, datetimes[train_start], datetimes[train_end - 1], datetimes[train_end],
+                             datetimes[test_end - 1], short, long, invest_ratio, score, train_return,
+                             test_return, test_drawdown, test_trades))
+                equity.append(pd.DataFrame({'datetime': datetimes[train_end:test_end],
+                                            'balance': sim['balance'], 'window': index}))
+                capital = sim['balance'][-1]
+        finally:
+            _release_worker()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return pd.DataFrame(rows, columns=WINDOW_COLUMNS), pd.concat(equity, ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="双均线参数滚动优化")
+    parser.add_argument('--csv', required=True, help="K线 CSV 文件（TqSdk 导出或 Tushare 日线格式）")
+    parser.add_argument('--short', default='5:15:1', help="短周期，例如 5,10 或 5:20:1")
+    parser.add_argument('--long', default='20:40:2', help="长周期，例如 20,30 或 20:60:2")
+    parser.add_argument('--ratio', default='0.2', help="投入比例，例如 0.1,0.2 或 0.1:0.5:0.1")
+    parser.add_argument('--train', type=int, default=120, help="训练窗口K线数")
+    parser.add_argument('--test', type=int, default=20, help="测试窗口K线数（滚动步长）")
+    parser.add_argument('--anchored', action='store_true', help="训练窗口从第一根K线开始逐步扩大")
+    parser.add_argument('--objective', default='total_return', choices=sorted(OBJECTIVES), help="选择参数的目标")
+    parser.add_argument('--capital', type=float, default=1_000_000, help="初始本金")
+    parser.add_argument('--multiple', type=float, default=1, help="合约乘数")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认使用全部 CPU")
+    parser.add_argument('--output', default='walk_forward', help="结果文件名前缀")
+    args = parser.parse_args(argv)
+
+    klines = pd.read_csv(args.csv, encoding='utf-8-sig')
+    start = time.perf_counter()
+    windows, equity = run_walk_forward(klines, parse_values(args.short), parse_values(args.long),
+                                       parse_values(args.ratio, float), args.train, args.test, args.anchored,
+                                       args.objective, args.capital, args.multiple, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"共 {len(windows)} 个窗口，耗时 {elapsed:.2f} 秒")
+    print(windows[['window', 'test_start', 'test_end', 'short', 'long', 'invest_ratio', 'train_return',
+                   'test_return']].to_string(index=False))
+    if len(equity):
+        print(f"样本外总收益率: {equity['balance'].iloc[-1] / args.capital - 1:.2%}")
+    windows.to_csv(f"{args.output}_windows.csv", index=False)
+    equity.to_csv(f"{args.output}_equity.csv", index=False)
+    print(f"结果已保存到 {args.output}_windows.csv 和 {args.output}_equity.csv")
+
+
+if __name__ == "__main__":
+    main()